@@ -147,6 +147,13 @@ void sendJson() {
   Serial.println();
 }
 
+// 응답(ack) 전송: 요청에 "id"가 있으면 그대로 돌려준다 (Pi가 요청/응답을 짝지음)
+long reqId = -1;
+void sendAck(JsonDocument& ack) {
+  if (reqId >= 0) ack["id"] = reqId;
+  serializeJson(ack, Serial); Serial.println();
+}
+
 // [수정] 시리얼 명령 처리: Arduino A의 handleIncoming() 함수를 그대로 복사
 // (SEAT_NAMES이 {"S3", "S4"} 이므로 S3, S4에 대해 정상 동작함)
 void handleIncoming() {
@@ -158,6 +165,7 @@ void handleIncoming() {
   if (deserializeJson(msg, line)) return;
 
   const char* cmd = msg["cmd"]; if (!cmd) return;
+  reqId = msg["id"] | -1L;
 
   if (strcmp(cmd,"set_cal_seat")==0 && msg.containsKey("seat") && msg.containsKey("value")) {
     const char* seatName = msg["seat"]; float val = msg["value"].as<float>();
@@ -166,7 +174,9 @@ void handleIncoming() {
     if (idx>=0) {
       calibrationSeat[idx] = val; applyCalibrationSeat(idx);
       StaticJsonDocument<120> ack; ack["ack"]="set_cal_seat"; ack["seat"]=SEAT_NAMES[idx]; ack["value"]=val;
-      serializeJson(ack, Serial); Serial.println();
+      sendAck(ack);
+    } else {
+      StaticJsonDocument<96> err; err["ack"]="set_cal_seat"; err["seat"]=seatName; err["error"]="bad_seat"; sendAck(err);
     }
 
   } else if (strcmp(cmd,"auto_cal_seat")==0 && msg.containsKey("seat") && msg.containsKey("wref")) {
@@ -174,7 +184,7 @@ void handleIncoming() {
     int idx = (!strcmp(seatName,SEAT_NAMES[0]))?0:(!strcmp(seatName,SEAT_NAMES[1]))?1:-1;
     if (idx<0 || wref<=0.0f) {
       StaticJsonDocument<96> err; err["ack"]="auto_cal_seat"; err["error"]="bad_args";
-      serializeJson(err, Serial); Serial.println(); return;
+      sendAck(err); return;
     }
     
     float counts = measureSeatCounts(idx, 20, 5); 
@@ -183,7 +193,7 @@ void handleIncoming() {
       StaticJsonDocument<160> err;
       err["ack"]="auto_cal_seat"; err["seat"]=SEAT_NAMES[idx];
       err["wref"]=wref; err["error"]="no_load_detected_or_too_small"; err["counts_abs"]=fabs(counts);
-      serializeJson(err, Serial); Serial.println(); return;
+      sendAck(err); return;
     }
     float new_cal = counts / wref;        // 새 보정값 계산
     calibrationSeat[idx] = new_cal;       // RAM에 임시 적용
@@ -193,20 +203,23 @@ void handleIncoming() {
     StaticJsonDocument<200> ack;
     ack["ack"]="auto_cal_seat"; ack["seat"]=SEAT_NAMES[idx]; ack["wref"]=wref;
     ack["counts_total"]=counts; ack["new_cal"]=new_cal;
-    serializeJson(ack, Serial); Serial.println();
+    sendAck(ack);
 
   } else if (strcmp(cmd,"tare_seat")==0 && msg.containsKey("seat")) {
     const char* seatName = msg["seat"];
     int idx = (!strcmp(seatName,SEAT_NAMES[0]))?0:(!strcmp(seatName,SEAT_NAMES[1]))?1:-1;
-    if (idx>=0) { tareSeat(idx); StaticJsonDocument<96> ack; ack["ack"]="tare_seat"; ack["seat"]=SEAT_NAMES[idx]; serializeJson(ack, Serial); Serial.println(); }
+    if (idx>=0) { tareSeat(idx); StaticJsonDocument<96> ack; ack["ack"]="tare_seat"; ack["seat"]=SEAT_NAMES[idx]; sendAck(ack); }
+    else { StaticJsonDocument<96> err; err["ack"]="tare_seat"; err["seat"]=seatName; err["error"]="bad_seat"; sendAck(err); }
 
   } else if (strcmp(cmd,"tare")==0) {
-    tareAll(); StaticJsonDocument<64> ack; ack["ack"]="tare"; serializeJson(ack, Serial); Serial.println();
+    tareAll(); StaticJsonDocument<64> ack; ack["ack"]="tare"; sendAck(ack);
 
   } else if (strcmp(cmd,"set_cal")==0 && msg.containsKey("value")) {
     float v = msg["value"].as<float>();
     calibrationSeat[0]=calibrationSeat[1]=v; applyCalibrationAll();
-    StaticJsonDocument<96> ack; ack["ack"]="set_cal"; ack["value"]=v; serializeJson(ack, Serial); Serial.println();
+    StaticJsonDocument<96> ack; ack["ack"]="set_cal"; ack["value"]=v; sendAck(ack);
+  } else {
+    StaticJsonDocument<96> err; err["ack"]=cmd; err["error"]="unknown_cmd"; sendAck(err);
   }
 }
 
@@ -0,0 +1,193 @@
+# accident_bundle.py
+# One compact binary snapshot per accident, uploaded with the photo. The JSON report only
+# carries derived per-seat fields; the bundle keeps what they were derived from.
+#
+# Contents of <accident_id>.npz (np.savez_compressed, loads with numpy alone):
+#   sensor_t / sensor_seat / sensor_board / sensor_weight / sensor_mpu_g / sensor_cells / sensor_ts_ms
+#                       raw seat samples PRE_S before to POST_S after the trigger, same columns
+#                       as sensor_archive.py (seat indexes SEATS, board indexes meta["boards"])
+#   motion_t / motion_ratio   changed-pixel ratio per frame, columns S1..S4 (motion.last_series)
+#   age_t / age_seat / age_years   raw age estimates before locking (age.last_samples)
+#   meta                JSON bytes: trigger + detector features, pulse features, report, ages,
+#                       UC flags, stored calibration and the live drift offsets
+#
+#   python accident_bundle.py show bundle.npz
+
+import io, sys, json, time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import get_arduino_data
+import metrics
+
+SEATS = ("S1", "S2", "S3", "S4")
+SEAT_INDEX = {s: i for i, s in enumerate(SEATS)}
+PRE_S = 10.0                # sensor context kept before the trigger ...
+POST_S = 20.0               # ... and after it (covers stabilisation + motion analysis)
+RING_S = PRE_S + POST_S + 30.0
+RING_ROWS = 20000           # hard cap; ~330 s of 4 seats at 15 Hz
+SPOOL_DIR = Path("/home/pi/accident_bundles")   # kept here when the upload fails
+UPLOAD_TIMEOUT_S = 15
+VERSION = 1
+
+_M_BYTES = metrics.histogram("accident_bundle_bytes", "Compressed bundle size",
+                             buckets=(16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6))
+_M_UPLOADS = {ok: metrics.counter("accident_bundle_uploads_total", "Bundle uploads", ok=ok) for ok in ("true", "false")}
+
+# (t, seat index, board, weight, mpu_g, c0, c1, c2, c3, ts_ms); appended on the ingest thread
+_ring: deque = deque(maxlen=RING_ROWS)
+_unsubscribe = None
+
+
+def _on_frame(port, alias, frame):
+    seats = frame.get("seats")
+    if not seats: return
+    t = frame.get("_recv_t") or time.time()
+    ts_ms = int(frame.get("ts_ms") or 0) & 0xFFFFFFFF
+    for s in seats:
+        i = SEAT_INDEX.get(s.get("name"))
+        if i is None: continue
+        try:
+            c = (list(s.get("loadCell") or []) + [0.0] * 4)[:4]
+            _ring.append((t, i, alias, float(s.get("Weight", 0.0)), float(s.get("mpu_g", 0.0)),
+                          float(c[0]), float(c[1]), float(c[2]), float(c[3]), ts_ms))
+        except (TypeError, ValueError):
+            continue
+    while _ring and t - _ring[0][0] > RING_S:
+        _ring.popleft()
+
+
+def start():
+    """Subscribes the sensor ring to get_arduino_data's ingest. Call before the readers start."""
+    global _unsubscribe
+    if _unsubscribe is None:
+        _unsubscribe = get_arduino_data.subscribe(_on_frame)
+
+
+def stop():
+    global _unsubscribe
+    if _unsubscribe is not None:
+        _unsubscribe()
+        _unsubscribe = None
+
+
+def reset():
+    _ring.clear()
+
+
+def _sensor_window(t0: float, t1: float) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    rows = [r for r in list(_ring) if t0 <= r[0] <= t1]
+    boards = sorted({r[2] for r in rows})
+    board_ids = {b: i for i, b in enumerate(boards)}
+    return {
+        "sensor_t": np.array([r[0] for r in rows], dtype=np.float64),
+        "sensor_seat": np.array([r[1] for r in rows], dtype=np.uint8),
+        "sensor_board": np.array([board_ids[r[2]] for r in rows], dtype=np.uint8),
+        "sensor_weight": np.array([r[3] for r in rows], dtype=np.float32),
+        "sensor_mpu_g": np.array([r[4] for r in rows], dtype=np.float32),
+        "sensor_cells": np.array([r[5:9] for r in rows], dtype=np.float32).reshape(-1, 4),
+        "sensor_ts_ms": np.array([r[9] for r in rows], dtype=np.uint32),
+    }, boards
+
+
+def _calibration() -> Dict[str, Any]:
+    """Stored scale factors per board (history left out) plus the live empty-seat offsets."""
+    store = {alias: {k: v for k, v in entry.items() if k != "history"}
+             for alias, entry in (get_arduino_data.load_cal_store() or {}).items()}
+    out = {"store": store}
+    try:
+        import calibration
+        out["drift"] = calibration.g_calibrator.status()
+    except Exception:
+        pass
+    return out
+
+
+def build_bundle(t_trigger: Optional[float] = None, trigger: Optional[Dict[str, Any]] = None,
+                 report: Optional[Dict[str, Any]] = None, pulse_features: Optional[Dict[str, Any]] = None,
+                 ages: Optional[Sequence[int]] = None, uc: Optional[Sequence[int]] = None,
+                 motion_series: Optional[Dict[str, list]] = None, age_samples: Optional[list] = None) -> bytes:
+    """Packs everything into compressed .npz bytes. t_trigger defaults to the newest sample."""
+    if t_trigger is None:
+        t_trigger = _ring[-1][0] if _ring else time.time()
+    arrays, boards = _sensor_window(t_trigger - PRE_S, t_trigger + POST_S)
+
+    motion_series = motion_series or {"t": [], "ratio": []}
+    arrays["motion_t"] = np.asarray(motion_series["t"], dtype=np.float64)
+    arrays["motion_ratio"] = np.asarray(motion_series["ratio"], dtype=np.float32).reshape(-1, 4)
+
+    age_samples = age_samples or []
+    arrays["age_t"] = np.array([a[0] for a in age_samples], dtype=np.float64)
+    arrays["age_seat"] = np.array([SEAT_INDEX.get(a[1], 255) for a in age_samples], dtype=np.uint8)
+    arrays["age_years"] = np.array([a[2] for a in age_samples], dtype=np.uint8)
+
+    meta = {"version": VERSION, "created": time.time(), "t_trigger": t_trigger, "pre_s": PRE_S, "post_s": POST_S,
+            "seats": list(SEATS), "boards": boards, "trigger": trigger, "pulse_features": pulse_features,
+            "ages": list(ages) if ages is not None else None, "uc": list(uc) if uc is not None else None,
+            "report": report, "calibration": _calibration()}
+    arrays["meta"] = np.frombuffer(json.dumps(meta, default=float).encode("utf-8"), dtype=np.uint8)
+
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    data = buf.getvalue()
+    _M_BYTES.observe(len(data))
+    return data
+
+
+def load_bundle(src) -> Dict[str, Any]:
+    """Path, bytes or file object -> {name: array, "meta": dict}."""
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    with np.load(src, allow_pickle=False) as z:
+        out = {k: z[k] for k in z.files}
+    out["meta"] = json.loads(out["meta"].tobytes().decode("utf-8"))
+    return out
+
+
+def save_local(name: str, data: bytes) -> Optional[Path]:
+    try:
+        SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        path = SPOOL_DIR / f"{name}.npz"
+        path.write_bytes(data)
+        return path
+    except OSError as e:
+        print(f"[accident_bundle] Failed to spool bundle: {e}")
+        return None
+
+
+def upload(accident_id: str, server_base_url: str, data: bytes) -> bool:
+    import requests   # not at module level: main.py imports this before arming, requests loads in warmup
+    url = f"{server_base_url}/api/upload_bundle/{accident_id}"
+    try:
+        resp = requests.post(url, files={"file": (f"{accident_id}.npz", data, "application/octet-stream")},
+                             timeout=UPLOAD_TIMEOUT_S)
+        ok = resp.status_code == 200
+        if not ok:
+            print(f"[accident_bundle] Server returned {resp.status_code}: {resp.text}")
+    except requests.exceptions.RequestException as e:
+        print(f"[accident_bundle] Upload failed: {e}")
+        ok = False
+    _M_UPLOADS["true" if ok else "false"].inc()
+    if ok:
+        metrics.log("accident_bundle", f"Bundle uploaded ({len(data) / 1024:.1f} KiB)", bytes=len(data))
+    else:
+        path = save_local(accident_id, data)
+        if path: metrics.log("accident_bundle", f"Bundle kept at {path}")
+    return ok
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "show":
+        b = load_bundle(sys.argv[2])
+        for k, v in b.items():
+            if k != "meta": print(f"{k:<14} {v.dtype} {v.shape}")
+        print(json.dumps(b["meta"], indent=2))
+        return
+    print("Usage: python accident_bundle.py show bundle.npz")
+
+
+if __name__ == "__main__":
+    main()
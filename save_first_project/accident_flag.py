@@ -1,55 +1,165 @@
 # accident_flag.py
 
-import json, time
+import json, time, queue, threading
 from pathlib import Path
 from typing import Optional, Dict, Any
 
-try:
-    import get_arduino_data
-except ImportError:
-    print("Error: Could not import get_arduino_data.py.")
-    def get_latest_seat_data():
-        time.sleep(0.1)
-        if time.time() % 10 > 5:
-             return {"S1":{"mpu_g":0.1}, "S2":{"mpu_g":0.2}, "S3":{"mpu_g":0.1}, "S4":{"mpu_g":0.1}}
-        else:
-             return {"S1":{"mpu_g":5.0}, "S2":{"mpu_g":0.2}, "S3":{"mpu_g":0.1}, "S4":{"mpu_g":0.1}}
+# Without Arduinos, drive this module through replay.py (recorded logs or synthetic crashes).
+import get_arduino_data
+import metrics
+from crash_detector import CrashDetector, REARM_S
 
+# "streaming": CrashDetector on every ingested frame (gravity-compensated, jerk, delta-v,
+# seat consensus). "threshold": the original polling test, any seat mpu_g > ACCIDENT_G_THRESH.
+DETECTOR_MODE = "streaming"
 ACCIDENT_G_THRESH = 1.1
 SEATS = ("S1", "S2", "S3", "S4")
 POLL_INTERVAL = 0.01
 
-def wait_accident_flag(timeout_s: Optional[float] = None,
-                       thresh: float = ACCIDENT_G_THRESH) -> Optional[Dict[str, Any]]:
+last_trigger: Optional[Dict[str, Any]] = None   # reason / seats / features of the last streaming trigger
 
-    deadline = (time.time() + timeout_s) if timeout_s is not None else None
+_M_POLLS = metrics.counter("accident_flag_polls_total", "Sensor snapshots checked for a trigger")
+_M_TRIGGERS = metrics.counter("accident_flag_triggers_total", "Accident triggers fired")
+_M_MAX_G = metrics.gauge("accident_flag_last_max_g", "Largest seat mpu_g in the last checked snapshot")
 
-    last_data_ts = None
+# Continuous watch (start / next_trigger / stop): one detector for the whole process, so
+# triggers that fire while an incident is being handled are queued instead of missed.
+# CrashDetector's REARM_S keeps one crash pulse from firing twice.
+_watch_q: "queue.Queue" = queue.Queue()
+_watch_unsubscribe = None
+_watch_stop = threading.Event()
 
-    while True:
-        seats_data = get_arduino_data.get_latest_seat_data()
+def wait_accident_flag(timeout_s: Optional[float] = None,
+                       thresh: float = ACCIDENT_G_THRESH,
+                       mode: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Blocks until a crash is detected and returns the latest seat snapshot (None on timeout)."""
+    if (mode or DETECTOR_MODE) == "streaming":
+        return _wait_streaming(timeout_s)
+    return _wait_threshold(timeout_s, thresh)
+
+
+def _wait_streaming(timeout_s: Optional[float]) -> Optional[Dict[str, Any]]:
+    global last_trigger
+    detector = CrashDetector(SEATS)
+    fired = threading.Event()
+    lock = threading.Lock()   # frames from both boards arrive on the same thread today, but be safe
+
+    def on_frame(port, alias, frame):
+        if fired.is_set(): return
+        _M_POLLS.inc()
+        with lock:
+            trigger = detector.feed_frame(frame, frame.get("_recv_t") or time.time())
+        if trigger:
+            global last_trigger
+            last_trigger = trigger
+            fired.set()
+
+    last_trigger = None
+    unsubscribe = get_arduino_data.subscribe(on_frame)
+    try:
+        if not fired.wait(timeout_s):
+            return None
+    finally:
+        unsubscribe()
 
-        if not seats_data or len(seats_data) < len(SEATS):
-            time.sleep(0.1)
-            continue
+    _M_TRIGGERS.inc()
+    _M_MAX_G.set(max(f["dyn_g"] for f in last_trigger["features"].values()))
+    metrics.log("accident_flag", f"Trigger ({last_trigger['reason']}) on {', '.join(last_trigger['seats'])}",
+                seats=last_trigger["seats"], reason=last_trigger["reason"])
+    return get_arduino_data.get_latest_seat_data()
 
-        try:
-            for seat_name in SEATS:
-                mpu_g = float(seats_data.get(seat_name, {}).get("mpu_g", 0.0))
 
-                if mpu_g > thresh:
-                    return seats_data
+def _wait_threshold(timeout_s: Optional[float], thresh: float) -> Optional[Dict[str, Any]]:
+    deadline = (time.time() + timeout_s) if timeout_s is not None else None
+    table = get_arduino_data.g_seat_table
+    snap = get_arduino_data.SeatSnapshot()   # reused: polling allocates nothing
+    last_version = -1
 
-        except (ValueError, TypeError):
-            pass
+    while True:
+        if table.version != last_version:
+            get_arduino_data.read_seats(snap)
+            last_version = snap.version
+            if all(snap.present):
+                _M_POLLS.inc()
+                _M_MAX_G.set(max(snap.mpu_g))
+                for i, seat_name in enumerate(SEATS):
+                    mpu_g = snap.mpu_g[i]
+                    if mpu_g > thresh:
+                        _M_TRIGGERS.inc()
+                        metrics.log("accident_flag", f"Trigger on {seat_name}: {mpu_g:.2f}g > {thresh}g",
+                                    seat=seat_name, mpu_g=mpu_g)
+                        return get_arduino_data.snapshot_dict(snap)
 
         if deadline is not None and time.time() > deadline:
             return None
 
         time.sleep(POLL_INTERVAL)
 
+def _fired(trigger: Optional[Dict[str, Any]], snapshot: Dict[str, Any]):
+    _M_TRIGGERS.inc()
+    if trigger:
+        _M_MAX_G.set(max(f["dyn_g"] for f in trigger["features"].values()))
+        metrics.log("accident_flag", f"Trigger ({trigger['reason']}) on {', '.join(trigger['seats'])}",
+                    seats=trigger["seats"], reason=trigger["reason"])
+    _watch_q.put((time.monotonic(), trigger, snapshot))
+
+
+def start(mode: Optional[str] = None):
+    """Starts the continuous watch. Each trigger is queued as (monotonic time, trigger info,
+    seat snapshot); trigger info is None in threshold mode."""
+    global _watch_unsubscribe
+    if _watch_unsubscribe is not None:
+        return
+    _watch_stop.clear()
+    if (mode or DETECTOR_MODE) == "streaming":
+        detector = CrashDetector(SEATS)
+
+        def on_frame(port, alias, frame):
+            _M_POLLS.inc()
+            trigger = detector.feed_frame(frame, frame.get("_recv_t") or time.time())
+            if trigger:
+                _fired(trigger, get_arduino_data.get_latest_seat_data())
+
+        _watch_unsubscribe = get_arduino_data.subscribe(on_frame)
+        return
+
+    def poll():
+        while not _watch_stop.is_set():
+            data = _wait_threshold(0.5, ACCIDENT_G_THRESH)
+            if data:
+                _watch_q.put((time.monotonic(), None, data))
+                _watch_stop.wait(REARM_S)   # same quiet period as the streaming detector
+
+    threading.Thread(target=poll, name="accident-watch", daemon=True).start()
+    _watch_unsubscribe = _watch_stop.set
+
+
+def stop():
+    global _watch_unsubscribe
+    if _watch_unsubscribe is not None:
+        _watch_unsubscribe()
+        _watch_unsubscribe = None
+    _watch_stop.set()
+
+
+def reset():
+    while not _watch_q.empty():
+        _watch_q.get_nowait()
+
+
+def next_trigger(timeout_s: Optional[float] = None):
+    """Next queued trigger from the watch: (monotonic time, trigger info, seat snapshot), or
+    None on timeout. Also sets last_trigger, like wait_accident_flag()."""
+    global last_trigger
+    try:
+        item = _watch_q.get(timeout=timeout_s)
+    except queue.Empty:
+        return None
+    last_trigger = item[1]
+    return item
+
 if __name__ == "__main__":
-    print(f"Waiting for accident flag (G > {ACCIDENT_G_THRESH})... (10s timeout)")
+    print(f"Waiting for accident flag ({DETECTOR_MODE} detector)... (10s timeout)")
 
     trigger_data = wait_accident_flag(timeout_s=10)
 
@@ -57,6 +167,8 @@ if __name__ == "__main__":
         print("\n--- ACCIDENT DETECTED ---")
         print("Trigger data:")
         print(json.dumps(trigger_data, indent=2))
+        if last_trigger:
+            print(json.dumps(last_trigger, indent=2))
     else:
         print("\n--- TIMEOUT ---")
         print("No accident detected.")
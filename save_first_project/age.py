@@ -5,24 +5,29 @@
 import cv2
 import time
 import platform
-from collections import Counter
 import threading
-
-try:
-    from facelib import AgeGenderEstimator, FaceDetector
-except ImportError as e:
-    print(f"Error: 'facelib' library not found. Please install it: pip install facelib. Details: {e}")
-    AgeGenderEstimator = None
-    FaceDetector = None
+import metrics
+import profiling
+import seat_regions
+from face_tracker import FaceTracker
 
 WIDTH, HEIGHT = 640, 480
 FPS_TARGET = 30
 CAM_INDEX = 0
 FACELIB_WIDTH = 640
-HOLD_SECONDS = 3.0
-RECENT_FACE_WINDOW = 1.0
+DETECT_INTERVAL_S = 0.2   # face detector runs at most this often; frames in between only advance the tracks
 RUN_DURATION = 10.0
 WARMUP_SECONDS = 2.0
+SHOW_WINDOW = True  # False for headless runs (replay / benchmarks)
+
+_M_FRAMES = metrics.counter("vision_frames_total", "Frames read from the camera", module="age")
+_M_FRAME_MS = metrics.histogram("vision_frame_ms", "Full loop time per frame", module="age")
+_M_INFER_MS = metrics.histogram("age_inference_ms", "Face detection + age estimation per frame")
+_M_FACES = metrics.counter("age_faces_total", "Faces detected")
+
+# Every raw estimate from the last in-process run, before mode/locking, for accident_bundle.py:
+# [(epoch s, seat, age)]. Runs inside vision_pool workers do not fill it.
+last_samples = []
 
 def open_camera(index=0):
     system = platform.system().lower()
@@ -32,11 +37,11 @@ def open_camera(index=0):
         return cv2.VideoCapture(index, cv2.CAP_V4L2)
     return cv2.VideoCapture(index)
 
-def quadrant_index(x, y, mx, my):
-    if x < mx and y < my: return 0
-    if x >= mx and y < my: return 1
-    if x < mx and y >= my: return 2
-    return 3
+def show_frame(window_name, vis):
+    """imshow + waitKey. Returns the pressed key, or -1 when SHOW_WINDOW is off (headless runs)."""
+    if not SHOW_WINDOW: return -1
+    cv2.imshow(window_name, vis)
+    return cv2.waitKey(1) & 0xFF
 
 def put_text(img, text, org, scale=0.6, thickness=2, color=(255,255,255)):
     cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale,
@@ -44,13 +49,6 @@ def put_text(img, text, org, scale=0.6, thickness=2, color=(255,255,255)):
     cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale,
                 color, thickness, cv2.LINE_AA)
 
-def mode_age(ages):
-    if not ages: return None
-    c = Counter(ages)
-    m = max(c.values())
-    cand = [k for k, v in c.items() if v == m]
-    return int(round(sorted(cand)[0]))
-
 def categorize_age_code(age_val):
     if age_val is None: return 2
     elif age_val <= 10: return 1
@@ -58,31 +56,47 @@ def categorize_age_code(age_val):
 
 g_model_load_error = None
 fd, ag = None, None
-
-if FaceDetector is not None and AgeGenderEstimator is not None:
-    print("[age.py] Loading face detection and age estimation models...")
-    try:
-        fd = FaceDetector()
-        ag = AgeGenderEstimator()
-        print("[age.py] Models loaded successfully.")
-        g_model_load_error = None
-    except Exception as e:
-        print(f"[age.py] CRITICAL: Error loading models: {e}")
-        g_model_load_error = e
-        fd, ag = None, None
-else:
-    if 'e' in locals():
-        g_model_load_error = e
-    else:
-        g_model_load_error = "facelib library not found or failed to import."
-    fd, ag = None, None
-
-def age_result(stop_event: threading.Event = None):
+_model_lock = threading.Lock()
+_models_tried = False
+
+def load_models() -> bool:
+    """Imports facelib (and torch with it) and builds the detector and estimator, once.
+    age_result() calls it; main.py calls it on a warmup thread at boot so that neither the
+    import of this module nor arming the crash watch waits for the models."""
+    global fd, ag, g_model_load_error, _models_tried
+    with _model_lock:
+        if _models_tried:
+            return fd is not None and ag is not None
+        _models_tried = True
+        try:
+            from facelib import AgeGenderEstimator, FaceDetector
+        except ImportError as e:
+            print(f"Error: 'facelib' library not found. Please install it: pip install facelib. Details: {e}")
+            g_model_load_error = e
+            return False
+        print("[age.py] Loading face detection and age estimation models...")
+        t0 = time.monotonic()
+        try:
+            fd = FaceDetector()
+            ag = AgeGenderEstimator()
+            print(f"[age.py] Models loaded successfully ({time.monotonic() - t0:.1f}s).")
+            g_model_load_error = None
+        except Exception as e:
+            print(f"[age.py] CRITICAL: Error loading models: {e}")
+            g_model_load_error = e
+            fd, ag = None, None
+        return fd is not None and ag is not None
+
+def age_result(stop_event: threading.Event = None, cam_index=CAM_INDEX, profile=None):
     """
     Runs the age detection process.
     [MODIFIED] Checks stop_event to allow early exit.
+    cam_index selects the camera, so vision_pool can run one worker per camera.
+    profile=True (or RESQ_PROFILE=1) prints a per-frame stage breakdown at the end.
     """
-    if fd is None or ag is None:
+    global last_samples
+    last_samples = []
+    if not load_models():
         print("[age.py ERROR] Models are not loaded. Cannot run age detection.")
         if g_model_load_error:
             print(f"[age.py ERROR] Original cause: {g_model_load_error}")
@@ -92,9 +106,9 @@ def age_result(stop_event: threading.Event = None):
         print("[age.py] Stop event received before starting. Exiting.")
         return (2, 2, 2, 2)
 
-    cap = open_camera(CAM_INDEX)
+    cap = open_camera(cam_index)
     if not cap.isOpened():
-        print("[age.py WARN] Failed to open camera.")
+        print(f"[age.py WARN] Failed to open camera {cam_index}.")
         return (2, 2, 2, 2)
 
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, WIDTH)
@@ -105,133 +119,133 @@ def age_result(stop_event: threading.Event = None):
     except Exception:
         pass
 
-    age_buffer = [[], [], [], []]
-    locked_age = [None]*4
-    face_seen_ts = [0.0]*4
-    S1_age, S2_age, S3_age, S4_age = None, None, None, None
-    labels = ["S4", "S3", "S2", "S1"]
+    # Faces are tracked across frames (face_tracker.py); each track collects its own age
+    # estimates and is assigned to the seat region it stays in, so a face near a boundary
+    # keeps one seat and one age history.
+    tracker = FaceTracker(WIDTH, HEIGHT)
+    locked_age = {}   # seat -> age
+    regions = seat_regions.to_pixels(WIDTH, HEIGHT)
+    last_detect = 0.0
+    window_name = "Age Check" if cam_index == CAM_INDEX else f"Age Check (cam {cam_index})"
 
     script_start_time = time.monotonic()
+    # A camera kept open by warm_camera.py has already settled its exposure.
+    warmup_s = 0.0 if getattr(cap, "warm", False) else WARMUP_SECONDS
     detection_start_time = None
+    prof = profiling.frame_profiler(f"age.py cam {cam_index}", profiling.AGE_STAGES, profile)
 
-    print(f"[{time.strftime('%H:%M:%S')}] Age Check starting: {WARMUP_SECONDS}s stabilization...")
+    metrics.log("age.py", f"Age Check starting: {warmup_s}s stabilization...")
 
     while True:
         if stop_event and stop_event.is_set():
             print("[age.py] Stop event received during analysis. Exiting loop.")
             break
 
+        t_frame = time.perf_counter()
+        prof.start_frame()
         ok, frame_bgr = cap.read()
         if not ok:
             print("[age.py WARN] Failed to read frame.")
             break
+        _M_FRAMES.inc()
+        prof.mark("capture")
 
         frame_bgr = cv2.resize(frame_bgr, (WIDTH, HEIGHT))
         vis = frame_bgr.copy()
+        prof.mark("resize")
         now = time.monotonic()
-        mid_x, mid_y = WIDTH//2, HEIGHT//2
 
         if detection_start_time is None:
-            if (now - script_start_time) < WARMUP_SECONDS:
+            if (now - script_start_time) < warmup_s:
                 warmup_text = f"Stabilizing... {now - script_start_time:.1f}s"
                 put_text(vis, warmup_text, (10, 30), 0.7, 2, (0, 0, 255))
 
-                cv2.imshow("Age Check", vis)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+                if show_frame(window_name, vis) == ord('q'):
                     break
                 continue
             else:
-                print(f"[{time.strftime('%H:%M:%S')}] Stabilization complete. Starting {RUN_DURATION}s detection.")
+                metrics.log("age.py", f"Stabilization complete. Starting {RUN_DURATION}s detection.")
                 detection_start_time = now
 
         elapsed = now - detection_start_time
-        frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-        h, w = frame_rgb.shape[:2]
-        if w != FACELIB_WIDTH:
-            s = FACELIB_WIDTH / float(w)
-            fr_rgb = cv2.resize(frame_rgb, (FACELIB_WIDTH, int(h*s)), interpolation=cv2.INTER_LINEAR)
-            scale_x = WIDTH / float(fr_rgb.shape[1])
-            scale_y = HEIGHT / float(fr_rgb.shape[0])
-        else:
-            fr_rgb = frame_rgb
-            scale_x = 1.0
-            scale_y = 1.0
-
-        faces, boxes, scores, landmarks = fd.detect_align(fr_rgb)
-        genders, ages = (ag.detect(faces) if len(faces) > 0 else ([], []))
-
-        if boxes is not None:
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = [int(v) for v in box]
-                x1d, y1d = int(x1*scale_x), int(y1*scale_y)
-                x2d, y2d = int(x2*scale_x), int(y2*scale_y)
-                cv2.rectangle(vis, (x1d, y1d), (x2d, y2d), (0,255,0), 2)
-                cx, cy = int((x1d+x2d)/2), int((y1d+y2d)/2)
-                q = quadrant_index(cx, cy, mid_x, mid_y)
-                face_seen_ts[q] = now
-                if locked_age[q] is not None:
+        if now - last_detect >= DETECT_INTERVAL_S:
+            last_detect = now
+            frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+            prof.mark("color")
+            h, w = frame_rgb.shape[:2]
+            if w != FACELIB_WIDTH:
+                s = FACELIB_WIDTH / float(w)
+                fr_rgb = cv2.resize(frame_rgb, (FACELIB_WIDTH, int(h*s)), interpolation=cv2.INTER_LINEAR)
+                prof.mark("resize")
+                scale_x = WIDTH / float(fr_rgb.shape[1])
+                scale_y = HEIGHT / float(fr_rgb.shape[0])
+            else:
+                fr_rgb = frame_rgb
+                scale_x = 1.0
+                scale_y = 1.0
+
+            with _M_INFER_MS.time():
+                faces, boxes, scores, landmarks = fd.detect_align(fr_rgb)
+                prof.mark("detect")
+                disp_boxes = [(float(b[0])*scale_x, float(b[1])*scale_y, float(b[2])*scale_x, float(b[3])*scale_y)
+                              for b in (boxes if boxes is not None else [])]
+                tracks = tracker.update(disp_boxes, now)
+                # Age only faces whose track still needs samples for a seat that is not locked yet.
+                need = [i for i, tr in enumerate(tracks)
+                        if tr.locked_age is None and tr.seat is not None and tr.seat not in locked_age]
+                genders, ages = (ag.detect(faces[need]) if need else ([], []))
+                prof.mark("age")
+            _M_FACES.inc(len(disp_boxes))
+
+            for j, i in enumerate(need):
+                if j >= len(ages): break
+                tr = tracks[i]
+                try:
+                    a = int(round(float(ages[j])))
+                except (TypeError, ValueError):
                     continue
-                if i < len(ages):
-                    try:
-                        a = int(round(float(ages[i])))
-                        if 0 <= a <= 120:
-                            age_buffer[q].append((now, a))
-                        put_text(vis, str(a), (x1d, max(0, y1d-8)), 0.6, 2, (255,255,255))
-                    except: pass
-
-        for q in range(4):
-            if locked_age[q] is not None: continue
-            age_buffer[q] = [(t,a) for (t,a) in age_buffer[q] if now - t <= (HOLD_SECONDS + 0.5)]
-            has_recent_face = (now - face_seen_ts[q] <= RECENT_FACE_WINDOW)
-            if has_recent_face:
-                if age_buffer[q] and (now - age_buffer[q][0][0] >= (HOLD_SECONDS - 0.1)):
-                    final_age = mode_age([a for (_,a) in age_buffer[q]])
-                    locked_age[q] = final_age
-                    if q == 0:    S4_age = final_age
-                    elif q == 1: S3_age = final_age
-                    elif q == 2: S2_age = final_age
-                    elif q == 3: S1_age = final_age
-                    print(f"[{time.strftime('%H:%M:%S')}] Quad {q} ({labels[q]}): lock age = {final_age}")
-
-        cv2.line(vis, (mid_x, 0), (mid_x, HEIGHT), (0, 255, 255), 2)
-        cv2.line(vis, (0, mid_y), (WIDTH, mid_y), (0, 255, 255), 2)
-        rois = [
-            (0, 0, mid_x, mid_y), (mid_x, 0, WIDTH, mid_y),
-            (0, mid_y, mid_x, HEIGHT), (mid_x, mid_y, WIDTH, HEIGHT),
-        ]
-        for i, (x1, y1, x2, y2) in enumerate(rois):
-            put_text(vis, labels[i], (x1 + 10, y1 + 25), 0.8, 2, (0,255,255))
-            if locked_age[i] is not None:
-                put_text(vis, f"LOCK {locked_age[i]}", (x1 + 10, y1 + 50), 0.7, 2, (0,200,255))
+                if not 0 <= a <= 120: continue
+                last_samples.append((time.time(), tr.seat, a))
+                if tr.add_age(a) is not None and tr.seat not in locked_age:
+                    locked_age[tr.seat] = tr.locked_age
+                    metrics.log("age.py", f"{tr.seat} (track {tr.id}): lock age = {tr.locked_age} "
+                                          f"after {len(tr.ages)} estimates")
+
+        for seat, (x1, y1, x2, y2) in regions.items():
+            cv2.rectangle(vis, (x1, y1), (x2 - 1, y2 - 1), (0, 255, 255), 1)
+            put_text(vis, seat, (x1 + 10, y1 + 25), 0.8, 2, (0,255,255))
+            if seat in locked_age:
+                put_text(vis, f"LOCK {locked_age[seat]}", (x1 + 10, y1 + 50), 0.7, 2, (0,200,255))
+        for tr, (x1, y1, x2, y2) in tracker.predict(now):
+            cv2.rectangle(vis, (int(x1), int(y1)), (int(x2), int(y2)), (0,255,0), 2)
+            tag = f"#{tr.id} {tr.seat or '-'}" + (f" {tr.ages[-1]}" if tr.ages else "")
+            put_text(vis, tag, (int(x1), max(0, int(y1) - 8)), 0.6, 2, (255,255,255))
         timer_text = f"DETECTING: {elapsed:.1f}s / {RUN_DURATION:.1f}s"
         put_text(vis, timer_text, (10, HEIGHT - 20), 0.7, 2, (0, 255, 0))
 
-        cv2.imshow("Age Check", vis)
-
-        key = cv2.waitKey(1) & 0xFF
+        prof.mark("draw")
+        key = show_frame(window_name, vis)
+        prof.mark("display")
+        prof.end_frame()
+        _M_FRAME_MS.observe((time.perf_counter() - t_frame) * 1000.0)
         if key == ord('q'):
             print("[WARN] User manually quit")
             break
 
         if elapsed >= RUN_DURATION:
-            print(f"[{time.strftime('%H:%M:%S')}] {RUN_DURATION}s detection complete.")
+            metrics.log("age.py", f"{RUN_DURATION}s detection complete.")
             break
 
-        if all(age is not None for age in locked_age):
-            print(f"[{time.strftime('%H:%M:%S')}] All 4 quadrants locked. Exiting early.")
-            time.sleep(0.5)
+        if len(locked_age) == len(seat_regions.SEATS):
+            metrics.log("age.py", f"All {len(locked_age)} seats locked. Exiting early.")
             break
 
     cap.release()
     try:
-        cv2.destroyWindow("Age Check")
+        cv2.destroyWindow(window_name)
     except cv2.error:
         pass
+    prof.report()
 
     # Finalize Values
-    S1_age_code = categorize_age_code(S1_age)
-    S2_age_code = categorize_age_code(S2_age)
-    S3_age_code = categorize_age_code(S3_age)
-    S4_age_code = categorize_age_code(S4_age)
-
-    return (S1_age_code, S2_age_code, S3_age_code, S4_age_code)
+    return tuple(categorize_age_code(locked_age.get(seat)) for seat in seat_regions.SEATS)
@@ -0,0 +1,214 @@
+# bench_latency.py
+# End-to-end latency benchmark: impact -> trigger -> the post-crash task graph (postcrash.py)
+# -> final report visible on the dashboard, plus ingest / vision / server throughput.
+# "trigger" is measured from the crash frame's arrival; the post-crash stages overlap, so each
+# is reported as the time after the trigger at which it finished.
+# Runs on a plain Linux box: replayed synthetic crashes stand in for the Arduinos,
+# FakeCamera for the webcam, and server14 is started locally on a free port.
+#
+#   python bench_latency.py --runs 10 --out bench_results.json
+#   python bench_latency.py --runs 10 --baseline bench_results.json   # exit 1 on p95 regression
+
+import os, sys, json, time, argparse, platform, tempfile, threading
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import cv2
+import requests
+
+import get_arduino_data
+import replay
+from replay import percentile
+
+STAGES = ("trigger", "impact", "report_post", "image_upload", "motion", "final_update",
+          "dashboard_visible", "end_to_end")
+REGRESSION_TOLERANCE = 0.20   # p95 may grow by 20% before --baseline fails
+
+
+class FakeCamera:
+    """cv2.VideoCapture look-alike: a synthetic 640x480 cabin with one blob per quadrant.
+    Blobs in `moving` quadrants oscillate, the rest stay still. Delivered at `fps`."""
+
+    def __init__(self, moving=(0, 1, 2, 3), fps: float = 30.0, width: int = 640, height: int = 480):
+        self.moving = set(moving)
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.width, self.height = width, height
+        self.reads = 0
+        self._next = time.perf_counter()
+        self._t0 = self._next
+        self._opened = True
+        rng = np.random.default_rng(0)
+        self._background = rng.integers(40, 80, (height, width, 3), dtype=np.uint8)
+
+    def isOpened(self): return self._opened
+    def set(self, prop, value): return True
+    def get(self, prop): return 0.0
+    def release(self): self._opened = False
+
+    def read(self):
+        if self.period:
+            delay = self._next - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            self._next = max(self._next + self.period, time.perf_counter())
+        t = time.perf_counter() - self._t0
+        frame = self._background.copy()
+        mx, my = self.width // 2, self.height // 2
+        for q, (cx, cy) in enumerate(((mx // 2, my // 2), (mx + mx // 2, my // 2),
+                                      (mx // 2, my + my // 2), (mx + mx // 2, my + my // 2))):
+            dx = int(40 * np.sin(2 * np.pi * 1.5 * t)) if q in self.moving else 0
+            cv2.circle(frame, (cx + dx, cy), 45, (200, 180, 160), -1)
+        self.reads += 1
+        return True, frame
+
+
+def start_local_server(image_dir: str):
+    """Starts server14 on 127.0.0.1:<free port>; returns (base_url, shutdown)."""
+    from werkzeug.serving import make_server
+    import server14
+    server14.init_storage(image_dir, os.path.join(image_dir, "bundles"))
+    server14.logger.setLevel("WARNING")
+    srv = make_server("127.0.0.1", 0, server14.app, threaded=True)
+    threading.Thread(target=srv.serve_forever, name="bench-server14", daemon=True).start()
+    return f"http://127.0.0.1:{srv.server_port}", srv.shutdown
+
+
+def _dist(values: List[float]) -> Dict[str, Any]:
+    return {"n": len(values),
+            "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+            "max": max(values) if values else None}
+
+
+def run_once(base_url: str, stabilise_s: float, seed: int) -> Optional[Dict[str, float]]:
+    """One synthetic crash through the same calls main.main makes. Returns per-stage ms or None."""
+    import accident_flag, postcrash
+
+    frames = replay.synth_crash_frames(duration_s=8.0, crash_at_s=4.0, bump_rate_hz=0.0, seed=seed)
+    get_arduino_data.reset_store()
+    src = replay.ReplaySource(frames, speed=1.0)
+    src.start()
+    trigger_data = accident_flag.wait_accident_flag(timeout_s=10.0)
+    t_trigger = time.monotonic()
+    if not trigger_data or replay.CRASH_MARK not in src.marks:
+        src.stop()
+        print("[bench] No trigger or trigger before the crash; skipping run.")
+        return None
+    # ReplaySource marks use perf_counter; move the arrival onto the monotonic clock postcrash uses.
+    t_arrival = t_trigger - (time.perf_counter() - src.marks[replay.CRASH_MARK][0])
+
+    # The replay keeps feeding frames so impact scoring sees the whole pulse window.
+    outcome = postcrash.run(trigger_data, (0, 0, 0, 0), (1, 1, 1, 1), None, base_url,
+                            stabilise_s=stabilise_s, t0=t_trigger)
+    src.stop()
+    accident_id = outcome["accident_id"]
+    if not accident_id or not outcome["image"]:
+        return None
+    while True:
+        entry = next((e for e in requests.get(f"{base_url}/accidents", timeout=5).json() if e["id"] == accident_id), None)
+        if entry and entry.get("image_url") and not entry.get("preliminary"): break
+        time.sleep(0.01)
+    t_visible = time.monotonic()
+
+    out = {"trigger": (t_trigger - t_arrival) * 1000.0}
+    for stage in STAGES[1:-2]:
+        out[stage] = outcome["timings"][stage][1] * 1000.0
+    out["dashboard_visible"] = (t_visible - t_trigger) * 1000.0
+    out["end_to_end"] = (t_visible - t_arrival) * 1000.0
+    return out
+
+
+def vision_throughput(seconds: float = 3.0) -> Dict[str, Any]:
+    import motion
+    cam = FakeCamera(fps=0)
+    replay.install_camera(lambda index=0: cam)
+    saved = motion.RUN_DURATION, motion.WARMUP_SECONDS
+    motion.RUN_DURATION, motion.WARMUP_SECONDS = seconds, 0.0
+    t0 = time.perf_counter()
+    motion.motion_result()
+    elapsed = time.perf_counter() - t0
+    motion.RUN_DURATION, motion.WARMUP_SECONDS = saved
+    return {"frames": cam.reads, "seconds": round(elapsed, 3), "fps": round(cam.reads / elapsed, 1)}
+
+
+def server_throughput(base_url: str, n: int = 200) -> Dict[str, Any]:
+    import jsondata
+    report = jsondata.get_all_seats_dict((0, 0, 20, 1), (1, 1, 35, 1), (0, 0, 0, 0), (0, 0, 10, 1))
+    session = requests.Session()
+    post_ms, get_ms = [], []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        session.post(f"{base_url}/api/accident_trigger", json=report, timeout=10)
+        post_ms.append((time.perf_counter() - t) * 1000.0)
+    post_elapsed = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        session.get(f"{base_url}/accidents", timeout=10)
+        get_ms.append((time.perf_counter() - t) * 1000.0)
+    get_elapsed = time.perf_counter() - t0
+    return {"accident_trigger": {"req_per_s": round(n / post_elapsed, 1), "latency_ms": _dist(post_ms)},
+            "accidents_list": {"req_per_s": round(n / get_elapsed, 1), "latency_ms": _dist(get_ms)}}
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for stage, dist in results["stages_ms"].items():
+        old = baseline.get("stages_ms", {}).get(stage, {}).get("p95")
+        new = dist.get("p95")
+        if old and new and new > old * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {old:.1f}ms -> {new:.1f}ms")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="End-to-end latency benchmark (impact -> dashboard).")
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--stabilise", type=float, default=0.0, help="post-crash wait; main.py uses 5.0")
+    ap.add_argument("--motion-duration", type=float, default=2.0, help="motion.RUN_DURATION for the bench")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--baseline", default=None)
+    ap.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = ap.parse_args()
+
+    import motion
+    motion.RUN_DURATION, motion.WARMUP_SECONDS = args.motion_duration, 0.5
+    replay.install_camera(lambda index=0: FakeCamera())
+
+    image_dir = tempfile.mkdtemp(prefix="bench_images_")
+    base_url, shutdown = start_local_server(image_dir)
+    print(f"[bench] server14 at {base_url}, images in {image_dir}")
+
+    per_stage: Dict[str, List[float]] = {s: [] for s in STAGES}
+    for i in range(args.runs):
+        r = run_once(base_url, args.stabilise, seed=i)
+        if r is None: continue
+        for stage, ms in r.items(): per_stage[stage].append(ms)
+        print(f"[bench] run {i + 1}/{args.runs}: end_to_end={r['end_to_end']:.0f}ms")
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(), "python": platform.python_version(),
+        "config": {"runs": args.runs, "stabilise_s": args.stabilise, "motion_duration_s": args.motion_duration},
+        "stages_ms": {stage: _dist(v) for stage, v in per_stage.items()},
+        "throughput": {"ingest": replay.bench_ingest(600.0),
+                       "vision": vision_throughput(),
+                       "server": server_throughput(base_url)},
+    }
+    shutdown()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results["stages_ms"], indent=2))
+    print(f"[bench] Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("[bench] REGRESSION:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("[bench] No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
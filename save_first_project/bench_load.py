@@ -0,0 +1,348 @@
+# bench_load.py
+# Load / soak test for server14 with synthetic fleet traffic.
+#  * N vehicles: every crash posts a preliminary report, uploads a cabin JPEG and posts the final
+#    update, in the same order and formats as postcrash.py (report_schema.py; --v1-share of the
+#    fleet sends the old v1 JSON). Crashes per vehicle arrive as a Poisson process.
+#  * M dashboards: poll /accidents every POLL_S with If-None-Match like dashboard.js, and now and
+#    then open the player page and image of a recent accident.
+# Every --report-s it prints, for that window, throughput / latency percentiles / errors per
+# endpoint and the server's RSS, open file descriptors, threads and ACCIDENT_LOG size. The
+# summary has whole-run percentiles and growth rates per hour, which is what a soak of a few
+# hours is for (ACCIDENT_LOG and the page cache are only bounded by memory).
+# Without --url a fresh server14 is started in a child process in a temp dir, so its /proc
+# entries can be read; with --url only the client side and the /accidents size are known.
+#
+#   python bench_load.py --vehicles 50 --dashboards 20 --duration 10m
+#   python bench_load.py --vehicles 200 --dashboards 50 --duration 4h --out soak.json --max-rss-growth 50
+#   python bench_load.py --url http://192.168.0.10:5000 --vehicles 20 --duration 5m
+
+import os, sys, json, time, random, argparse, platform, tempfile, threading, subprocess
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import cv2
+import requests
+
+import jsondata
+import report_schema
+from replay import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+POLL_S = 5.0              # dashboard.js POLL_MS
+PLAYER_P = 0.1            # chance per poll that a dashboard opens a recent accident
+CRASH_INTERVAL_S = 60.0   # mean time between crashes per simulated vehicle
+REQUEST_TIMEOUT_S = 30.0
+RESERVOIR = 20000         # latency samples kept per endpoint for the whole-run percentiles
+RECENT_IDS = 200
+JPEG_VARIANTS = 8
+ENDPOINTS = ("trigger", "upload_image", "update", "accidents", "accidents_304", "player", "image")
+
+SERVER_CODE = """
+import sys, logging
+from werkzeug.serving import make_server
+import server14
+server14.init_storage()   # images/ and bundles/ under the temp working dir
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+server14.logger.setLevel('WARNING')
+srv = make_server('127.0.0.1', 0, server14.app, threaded=True)
+print('ready', srv.server_port, flush=True)
+srv.serve_forever()
+"""
+
+
+def parse_duration(text: str) -> float:
+    """'90', '90s', '15m', '4h' -> seconds."""
+    units = {"s": 1, "m": 60, "h": 3600}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def cabin_jpegs(n: int = JPEG_VARIANTS, quality: int = 90) -> List[bytes]:
+    """640x480 cabin-like frames (gradient, sensor noise, four occupants) as JPEG, like capture.py sends."""
+    rng = np.random.default_rng(0)
+    out = []
+    for k in range(n):
+        y, x = np.mgrid[0:480, 0:640]
+        base = (40 + 60 * x / 640 + 30 * y / 480 + k * 5).astype(np.int16)
+        frame = np.stack([base, base + 10, base + 20], axis=-1) + rng.integers(-12, 12, (480, 640, 3))
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+        for cx, cy in ((160, 120), (480, 120), (160, 360), (480, 360)):
+            if rng.random() < 0.7:
+                cv2.circle(frame, (cx + int(rng.integers(-30, 30)), cy), 55, tuple(int(c) for c in rng.integers(90, 220, 3)), -1)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        out.append(buf.tobytes())
+    return out
+
+
+def random_seats(rng: random.Random) -> Dict[str, Dict[str, Any]]:
+    seats = []
+    for i in range(4):
+        sit = 1 if i == 0 or rng.random() < 0.5 else 0   # the driver is always there
+        age = 1 if rng.random() < 0.2 else 0
+        uc = rng.choice((0, 0, 1, 2))
+        seats.append((age, uc, round(rng.uniform(0, 50), 2), sit))
+    return jsondata.get_all_seats_dict(*seats)
+
+
+class Stats:
+    """Per-endpoint latencies for the current report window, plus a reservoir for the whole run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.window: Dict[str, List[float]] = {e: [] for e in ENDPOINTS}
+        self.errors: Dict[str, int] = {e: 0 for e in ENDPOINTS}
+        self.total: Dict[str, int] = {e: 0 for e in ENDPOINTS}
+        self.total_errors: Dict[str, int] = {e: 0 for e in ENDPOINTS}
+        self.reservoir: Dict[str, List[float]] = {e: [] for e in ENDPOINTS}
+        self._rng = random.Random(0)
+
+    def add(self, endpoint: str, ms: float, ok: bool):
+        with self.lock:
+            self.window[endpoint].append(ms)
+            self.total[endpoint] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+                self.total_errors[endpoint] += 1
+            res = self.reservoir[endpoint]
+            if len(res) < RESERVOIR:
+                res.append(ms)
+            else:
+                j = self._rng.randrange(self.total[endpoint])
+                if j < RESERVOIR: res[j] = ms
+
+    def swap(self):
+        with self.lock:
+            window, errors = self.window, self.errors
+            self.window = {e: [] for e in ENDPOINTS}
+            self.errors = {e: 0 for e in ENDPOINTS}
+        return window, errors
+
+
+def _dist(values: List[float]) -> Dict[str, Any]:
+    return {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+            "p99": percentile(values, 99), "max": max(values) if values else None}
+
+
+class Fleet:
+    def __init__(self, base_url: str, vehicles: int, dashboards: int, crash_interval_s: float,
+                 v1_share: float, seed: int = 0):
+        self.base_url = base_url
+        self.stats = Stats()
+        self.stop = threading.Event()
+        self.recent = deque(maxlen=RECENT_IDS)   # (id, has image)
+        self.jpegs = cabin_jpegs()
+        self.crash_interval_s = crash_interval_s
+        self.threads = [threading.Thread(target=self._vehicle, args=(i, i < v1_share * vehicles, seed),
+                                         name=f"vehicle-{i}", daemon=True) for i in range(vehicles)]
+        self.threads += [threading.Thread(target=self._dashboard, args=(i, seed), name=f"dashboard-{i}",
+                                          daemon=True) for i in range(dashboards)]
+
+    def start(self):
+        for t in self.threads: t.start()
+
+    def join(self, timeout_s: float = REQUEST_TIMEOUT_S):
+        self.stop.set()
+        deadline = time.monotonic() + timeout_s
+        for t in self.threads: t.join(max(0.0, deadline - time.monotonic()))
+
+    def _call(self, endpoint: str, fn, ok_status=(200,)):
+        t = time.perf_counter()
+        try:
+            resp = fn()
+        except requests.exceptions.RequestException:
+            self.stats.add(endpoint, (time.perf_counter() - t) * 1000.0, False)
+            return None
+        self.stats.add(endpoint, (time.perf_counter() - t) * 1000.0, resp.status_code in ok_status)
+        return resp
+
+    def _post_report(self, session, endpoint: str, path: str, seats, v1: bool, **meta):
+        if v1:   # an old Pi: plain JSON, the way it always posted
+            body = dict(seats)
+            body.update((k, v) for k, v in meta.items() if v is not None)
+            return self._call(endpoint, lambda: session.post(self.base_url + path, json=body, timeout=REQUEST_TIMEOUT_S))
+        data, headers = report_schema.encode_request(self.base_url, seats, **meta)
+        return self._call(endpoint, lambda: session.post(self.base_url + path, data=data, headers=headers,
+                                                         timeout=REQUEST_TIMEOUT_S))
+
+    def _vehicle(self, index: int, v1: bool, seed: int):
+        rng = random.Random(seed * 100003 + index)
+        session = requests.Session()
+        while not self.stop.wait(rng.expovariate(1.0 / self.crash_interval_s)):
+            resp = self._post_report(session, "trigger", "/api/accident_trigger", random_seats(rng), v1, preliminary=True)
+            accident_id = resp.json().get("id") if resp is not None and resp.status_code == 200 else None
+            if not accident_id: continue
+            jpeg = rng.choice(self.jpegs)
+            up = self._call("upload_image", lambda: session.post(
+                f"{self.base_url}/api/upload_image/{accident_id}",
+                files={"file": ("capture.jpg", jpeg, "image/jpeg")}, timeout=REQUEST_TIMEOUT_S))
+            self.recent.append((accident_id, up is not None and up.status_code == 200))
+            self._post_report(session, "update", f"/api/accident_update/{accident_id}", random_seats(rng), v1,
+                              impact_count=1)
+
+    def _dashboard(self, index: int, seed: int):
+        rng = random.Random(seed * 100003 + 50000 + index)
+        session = requests.Session()
+        etag = None
+        if self.stop.wait(rng.uniform(0, POLL_S)): return   # dashboards were not all opened at once
+        while True:
+            headers = {"If-None-Match": etag} if etag else {}
+            t = time.perf_counter()
+            try:
+                resp = session.get(f"{self.base_url}/accidents", headers=headers, timeout=REQUEST_TIMEOUT_S)
+                ms = (time.perf_counter() - t) * 1000.0
+                if resp.status_code == 304:
+                    self.stats.add("accidents_304", ms, True)
+                else:
+                    self.stats.add("accidents", ms, resp.status_code == 200)
+                    etag = resp.headers.get("ETag") or etag
+            except requests.exceptions.RequestException:
+                self.stats.add("accidents", (time.perf_counter() - t) * 1000.0, False)
+            if self.recent and rng.random() < PLAYER_P:
+                accident_id, has_image = rng.choice(list(self.recent))
+                self._call("player", lambda: session.get(f"{self.base_url}/player/{accident_id}", timeout=REQUEST_TIMEOUT_S))
+                if has_image:
+                    self._call("image", lambda: session.get(f"{self.base_url}/image/{accident_id}.jpg",
+                                                            timeout=REQUEST_TIMEOUT_S), ok_status=(200, 304))
+            if self.stop.wait(POLL_S): return
+
+
+def start_server_process():
+    """server14 in a child process with a temp working dir (its images/ go there).
+    Returns (base_url, Popen, workdir)."""
+    workdir = tempfile.mkdtemp(prefix="load_server14_")
+    env = dict(os.environ, PYTHONPATH=HERE + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.Popen([sys.executable, "-c", SERVER_CODE], cwd=workdir, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = proc.stdout.readline().split()
+    if len(line) != 2 or line[0] != "ready":
+        proc.kill()
+        raise RuntimeError("server14 did not start")
+    return f"http://127.0.0.1:{line[1]}", proc, workdir
+
+
+def proc_usage(pid: int) -> Dict[str, Any]:
+    """RSS (MB), open fds and threads of a local process, from /proc (Linux only)."""
+    out: Dict[str, Any] = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): out["rss_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+                elif line.startswith("Threads:"): out["threads"] = int(line.split()[1])
+        out["fds"] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        pass
+    return out
+
+
+def store_size(base_url: str) -> Dict[str, Any]:
+    """ACCIDENT_LOG entries and the size of its serialised form (one uncached /accidents read)."""
+    try:
+        resp = requests.get(f"{base_url}/accidents", headers={"Accept-Encoding": "identity"}, timeout=REQUEST_TIMEOUT_S)
+        return {"accidents": len(resp.json()), "accidents_mb": round(len(resp.content) / 1048576.0, 2)}
+    except (requests.exceptions.RequestException, ValueError):
+        return {}
+
+
+def slope_per_hour(samples: List[Dict[str, Any]], key: str) -> Optional[float]:
+    """Least-squares growth of samples[key] per hour (None with fewer than 3 samples)."""
+    pts = [(s["t"], s[key]) for s in samples if key in s]
+    if len(pts) < 3: return None
+    t = np.array([p[0] for p in pts]); v = np.array([p[1] for p in pts], dtype=float)
+    if np.ptp(t) <= 0: return None
+    return round(float(np.polyfit(t, v, 1)[0]) * 3600.0, 2)
+
+
+def _fmt(d: Dict[str, Any]) -> str:
+    if not d["n"]: return "-"
+    return f"{d['p50']:.0f}/{d['p95']:.0f}/{d['p99']:.0f}ms"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load / soak test for server14 with synthetic fleet traffic.")
+    ap.add_argument("--url", default=None, help="existing server; default: start server14 locally")
+    ap.add_argument("--vehicles", type=int, default=50)
+    ap.add_argument("--dashboards", type=int, default=20)
+    ap.add_argument("--duration", default="10m", help="seconds, or with s/m/h")
+    ap.add_argument("--crash-interval", type=float, default=CRASH_INTERVAL_S, help="mean seconds between crashes per vehicle")
+    ap.add_argument("--v1-share", type=float, default=0.25, help="fraction of vehicles sending the old v1 JSON")
+    ap.add_argument("--report-s", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=None, help="write the summary and the samples as JSON")
+    ap.add_argument("--max-rss-growth", type=float, default=None, help="MB per hour; exit 1 above it (local server)")
+    args = ap.parse_args()
+    duration_s = parse_duration(args.duration)
+
+    proc = workdir = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        base_url, proc, workdir = start_server_process()
+        print(f"[load] server14 at {base_url} (pid {proc.pid}, images in {workdir})")
+
+    fleet = Fleet(base_url, args.vehicles, args.dashboards, args.crash_interval, args.v1_share, args.seed)
+    print(f"[load] {args.vehicles} vehicles (1 crash / {args.crash_interval:.0f}s each, {args.v1_share:.0%} v1), "
+          f"{args.dashboards} dashboards (poll {POLL_S:.0f}s), {duration_s:.0f}s; "
+          f"JPEG {sum(map(len, fleet.jpegs)) // len(fleet.jpegs) // 1024} KiB avg")
+
+    samples: List[Dict[str, Any]] = []
+    t0 = time.monotonic()
+    fleet.start()
+    try:
+        while True:
+            now = time.monotonic() - t0
+            if fleet.stop.wait(min(args.report_s, max(0.0, duration_s - now))): break
+            elapsed = time.monotonic() - t0
+            window, errors = fleet.stats.swap()
+            sample = {"t": round(elapsed, 1)}
+            if proc is not None: sample.update(proc_usage(proc.pid))
+            sample.update(store_size(base_url))
+            samples.append(sample)
+            n = sum(len(v) for v in window.values())
+            parts = [f"{e} {_fmt(_dist(window[e]))}" + (f" ERR {errors[e]}" if errors[e] else "")
+                     for e in ENDPOINTS if window[e]]
+            usage = "  ".join(f"{k} {v}" for k, v in sample.items() if k != "t")
+            print(f"[load] t={elapsed:.0f}s {n / args.report_s:.1f} req/s | " + " | ".join(parts) + f" | {usage}")
+            if proc is not None and proc.poll() is not None:
+                print(f"[load] server14 exited with code {proc.returncode}")
+                break
+            if elapsed >= duration_s: break
+    except KeyboardInterrupt:
+        print("\n[load] Interrupted.")
+    fleet.join()
+    elapsed = time.monotonic() - t0
+
+    st = fleet.stats
+    summary = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": platform.node(), "python": platform.python_version(),
+        "config": {"url": args.url, "vehicles": args.vehicles, "dashboards": args.dashboards, "duration_s": round(elapsed, 1),
+                   "crash_interval_s": args.crash_interval, "v1_share": args.v1_share},
+        "endpoints": {e: {"requests": st.total[e], "req_per_s": round(st.total[e] / elapsed, 2),
+                          "errors": st.total_errors[e], "latency_ms": _dist(st.reservoir[e])}
+                      for e in ENDPOINTS if st.total[e]},
+        "growth_per_hour": {k: slope_per_hour(samples, k) for k in ("rss_mb", "fds", "threads", "accidents", "accidents_mb")},
+        "final": samples[-1] if samples else {},
+        "samples": samples,
+    }
+    if proc is not None:
+        proc.terminate()
+        try: proc.wait(5.0)
+        except subprocess.TimeoutExpired: proc.kill()
+
+    print(json.dumps({k: summary[k] for k in ("endpoints", "growth_per_hour", "final")}, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"[load] Results written to {args.out}")
+    if workdir:
+        print(f"[load] Server images left in {workdir} (delete when done)")
+
+    growth = summary["growth_per_hour"]["rss_mb"]
+    if args.max_rss_growth is not None and growth is not None and growth > args.max_rss_growth:
+        print(f"[load] FAIL: server RSS grows {growth} MB/h (limit {args.max_rss_growth})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# bench_startup.py
+# Boot-time benchmark for the Pi entry point.
+#  * armed: starts main.py in a fresh interpreter (through replay.py main, so synthetic sensor
+#    frames stand in for the Arduinos) and measures process start -> "SYSTEM ARMED", and when
+#    each background warmup task (models / pipeline / camera) finished.
+#  * imports: import cost of main.py and of each heavy module, each in a fresh interpreter,
+#    plus the slowest entries of `python -X importtime -c "import main"`.
+# Stop the resqseat service first on the car: the benchmark opens the same camera.
+#
+#   python bench_startup.py armed --runs 5              # exit 1 if p95 time-to-armed > --target
+#   python bench_startup.py imports --top 15
+
+import os, re, sys, json, time, queue, argparse, platform, threading, subprocess
+from typing import Dict, Any, List, Optional
+
+from replay import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TARGET_ARMED_S = 3.0      # ignition -> crash watch armed
+WARMUP_WAIT_S = 60.0      # how long to wait for the warmup tasks after arming
+HEAVY_MODULES = ("main", "age", "motion", "capture", "postcrash", "vision_pool",
+                 "cv2", "numpy", "requests", "serial", "facelib", "torch")
+
+_ARMED = re.compile(r"SYSTEM ARMED === \(")
+_WARMUP = re.compile(r"Warmup: (\w+) (ready|failed)")
+_WARMUP_TASKS = ("models", "pipeline", "camera")
+
+
+def _pump(stream, out: "queue.Queue"):
+    for line in iter(stream.readline, ""):
+        out.put((time.monotonic(), line))
+    out.put((time.monotonic(), None))
+
+
+def run_once(timeout_s: float = WARMUP_WAIT_S) -> Optional[Dict[str, Any]]:
+    """One boot. Returns {"armed_s", "warmup_s": {task: s}, "failed": [...]} or None if it never armed."""
+    t0 = time.monotonic()
+    proc = subprocess.Popen([sys.executable, "-u", "replay.py", "main", "--incidents", "0"], cwd=HERE,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    lines: "queue.Queue" = queue.Queue()
+    threading.Thread(target=_pump, args=(proc.stdout, lines), daemon=True).start()
+
+    armed_s, warmup, failed = None, {}, []
+    deadline = t0 + timeout_s
+    try:
+        while len(warmup) < len(_WARMUP_TASKS) or armed_s is None:
+            try:
+                t, line = lines.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if line is None:
+                break
+            if armed_s is None and _ARMED.search(line):
+                armed_s = t - t0
+            m = _WARMUP.search(line)
+            if m:
+                warmup[m.group(1)] = t - t0
+                if m.group(2) == "failed": failed.append(m.group(1))
+    finally:
+        proc.terminate()
+        try: proc.wait(5.0)
+        except subprocess.TimeoutExpired: proc.kill()
+    if armed_s is None:
+        return None
+    return {"armed_s": armed_s, "warmup_s": warmup, "failed": failed}
+
+
+def import_cost(module: str) -> Optional[float]:
+    """Seconds to import module in a fresh interpreter (None if it is not installed)."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    r = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True)
+    if r.returncode != 0:
+        return None
+    try: return float(r.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError): return None
+
+
+def importtime_top(module: str = "main", top: int = 15) -> List[Dict[str, Any]]:
+    """Slowest imports (cumulative us) under python -X importtime."""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=HERE,
+                       capture_output=True, text=True)
+    rows = []
+    for line in r.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if m:
+            rows.append({"module": m.group(4), "self_us": int(m.group(1)), "cumulative_us": int(m.group(2)),
+                         "depth": len(m.group(3)) // 2})
+    return sorted(rows, key=lambda row: row["cumulative_us"], reverse=True)[:top]
+
+
+def _dist(values: List[float]) -> Dict[str, Any]:
+    return {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+            "max": max(values) if values else None}
+
+
+def bench_armed(runs: int) -> Dict[str, Any]:
+    armed: List[float] = []
+    warmup: Dict[str, List[float]] = {task: [] for task in _WARMUP_TASKS}
+    for i in range(runs):
+        r = run_once()
+        if r is None:
+            print(f"[bench_startup] run {i + 1}/{runs}: never armed")
+            continue
+        armed.append(r["armed_s"])
+        for task, s in r["warmup_s"].items():
+            warmup.setdefault(task, []).append(s)
+        done = ", ".join(f"{task} {s:.1f}s" + (" (failed)" if task in r["failed"] else "")
+                         for task, s in sorted(r["warmup_s"].items(), key=lambda kv: kv[1]))
+        print(f"[bench_startup] run {i + 1}/{runs}: armed {r['armed_s']:.2f}s; warmup: {done or 'none'}")
+    return {"armed_s": _dist(armed), "warmup_s": {task: _dist(v) for task, v in warmup.items()}}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Startup time of main.py (time-to-armed) and import costs.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    a = sub.add_parser("armed", help="process start -> SYSTEM ARMED, and warmup completion times")
+    a.add_argument("--runs", type=int, default=5)
+    a.add_argument("--target", type=float, default=TARGET_ARMED_S, help="p95 seconds; exit 1 above it")
+    a.add_argument("--out", default=None, help="also write the results as JSON")
+    im = sub.add_parser("imports", help="per-module import cost in a fresh interpreter")
+    im.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    if args.command == "imports":
+        for module in HEAVY_MODULES:
+            s = import_cost(module)
+            print(f"  {module:<12} {'not installed' if s is None else f'{s * 1000:8.1f} ms'}")
+        print(f"[bench_startup] Slowest imports under 'import main' (cumulative):")
+        for row in importtime_top("main", args.top):
+            print(f"  {row['cumulative_us'] / 1000:8.1f} ms  {'  ' * row['depth']}{row['module']}")
+        return
+
+    results = bench_armed(args.runs)
+    results.update({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": platform.node(),
+                    "python": platform.python_version(), "target_s": args.target})
+    print(json.dumps({"armed_s": results["armed_s"], "warmup_s": results["warmup_s"]}, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[bench_startup] Results written to {args.out}")
+
+    p95 = results["armed_s"]["p95"]
+    if p95 is None or p95 > args.target:
+        print(f"[bench_startup] FAIL: p95 time-to-armed {p95 if p95 is None else round(p95, 2)}s "
+              f"(target {args.target}s)")
+        sys.exit(1)
+    print(f"[bench_startup] OK: p95 time-to-armed {p95:.2f}s (target {args.target}s)")
+
+
+if __name__ == "__main__":
+    main()
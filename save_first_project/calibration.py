@@ -0,0 +1,239 @@
+# calibration.py
+# Unattended load-cell calibration on the live serial connection.
+#  * On each board handshake the stored scale factors are pushed (set_cal_seat / set_cal)
+#    and confirmed by the board's ack.
+#  * Each seat's weight stream is watched for empty periods: stable (small spread) and within
+#    MAX_TARE_STEP_KG of zero. If the empty reading has drifted past DRIFT_TARE_KG the seat is
+#    re-tared with tare_seat. A stable 1-3 kg reading is a bag, baby carrier or pet, not drift, so
+#    it is never tared away; a large negative reading (someone was seated when the board tared
+#    itself at power-up) is logged for a manual tare instead of being applied. At most
+#    DRIFT_BUDGET_KG of automatic correction is applied per seat per DRIFT_BUDGET_WINDOW_S.
+#  * Every tare / cal is appended to the board's history in cal_store.json; auto_cal_seat
+#    results reported by the board are saved as that seat's new scale.
+#
+#   python calibration.py status          # stored cal + drift history
+#   python calibration.py tare            # acked tare of every connected board
+
+import sys, time, queue, threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+import get_arduino_data
+from get_arduino_data import load_cal_store, save_cal_store
+from serial_manager import ack_ok
+import metrics
+
+SEATS = ("S1", "S2", "S3", "S4")
+
+EMPTY_WINDOW_S = 8.0        # how long a seat must look empty and stable
+STABLE_SPREAD_KG = 0.6      # max - min over the window
+DRIFT_TARE_KG = 0.5         # re-tare when the empty reading is this far from zero
+MAX_TARE_STEP_KG = 1.0      # larger positive readings are a load; larger negative ones are logged, not tared
+DRIFT_BUDGET_KG = 1.5       # total automatic correction per seat ...
+DRIFT_BUDGET_WINDOW_S = 24 * 3600.0   # ... over this long
+MIN_TARE_INTERVAL_S = 120.0
+HISTORY_MAX = 200           # entries kept per board in cal_store.json
+
+_M_TARES = metrics.counter("calibration_tares_total", "Acked tare_seat commands")
+_M_REJECTED = metrics.counter("calibration_tares_rejected_total", "Drift corrections logged instead of applied")
+
+
+class _SeatWatch:
+    __slots__ = ("samples", "last_tare_t", "last_reject_t", "offset_kg", "tares")
+
+    def __init__(self):
+        self.samples: deque = deque()    # (t, weight) over EMPTY_WINDOW_S
+        self.last_tare_t = 0.0
+        self.last_reject_t = 0.0
+        self.offset_kg: Optional[float] = None   # latest empty-seat reading (drift)
+        self.tares: deque = deque()      # (t, |correction|) over DRIFT_BUDGET_WINDOW_S
+
+    def drift_used(self, t: float) -> float:
+        """Automatic correction already applied within DRIFT_BUDGET_WINDOW_S of t."""
+        while self.tares and t - self.tares[0][0] > DRIFT_BUDGET_WINDOW_S:
+            self.tares.popleft()
+        return sum(kg for _, kg in self.tares)
+
+    def update(self, t: float, w: float) -> Optional[float]:
+        """Returns the mean reading once the seat has been stable for the window and is not
+        holding anything (at most MAX_TARE_STEP_KG; negative readings are returned as they are)."""
+        self.samples.append((t, w))
+        while self.samples and t - self.samples[0][0] > EMPTY_WINDOW_S:
+            self.samples.popleft()
+        if t - self.samples[0][0] < EMPTY_WINDOW_S * 0.9:
+            return None
+        ws = [x for _, x in self.samples]
+        mean = sum(ws) / len(ws)
+        if mean > MAX_TARE_STEP_KG or max(ws) - min(ws) > STABLE_SPREAD_KG:
+            return None
+        if mean >= -MAX_TARE_STEP_KG:
+            self.offset_kg = mean
+        return mean
+
+
+class Calibrator:
+    """Runs commands on its own worker thread (requests block until the board acks)."""
+
+    def __init__(self):
+        self.watch: Dict[str, _SeatWatch] = {s: _SeatWatch() for s in SEATS}
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._busy = set()      # seats with a tare queued or in flight
+        self._thread: Optional[threading.Thread] = None
+        self._unsubscribe = None
+
+    # ---------- wiring ----------
+
+    def start(self):
+        if self._thread: return self
+        self._unsubscribe = get_arduino_data.subscribe(self._on_frame)
+        get_arduino_data.on_identify(self._on_identify)
+        self._thread = threading.Thread(target=self._worker, name="calibration", daemon=True)
+        self._thread.start()
+        return self
+
+    def _on_identify(self, port, alias, device_id):
+        self._jobs.put(("apply_cal", port, alias))
+
+    def _on_frame(self, port, alias, frame):
+        if frame.get("ack"):
+            if frame["ack"] == "auto_cal_seat" and "new_cal" in frame:   # started from the CLI / serial monitor
+                self._jobs.put(("save_auto_cal", alias, frame.get("seat"), frame))
+            return
+        t = frame.get("_recv_t") or time.time()
+        for s in frame.get("seats", ()):
+            name = s.get("name")
+            w = self.watch.get(name)
+            if w is None: continue
+            try: mean = w.update(t, float(s.get("Weight", 0.0)))
+            except (TypeError, ValueError): continue
+            if (mean is None or abs(mean) < DRIFT_TARE_KG or name in self._busy
+                    or t - w.last_tare_t < MIN_TARE_INTERVAL_S):
+                continue
+            # frame time base throughout, so replayed logs behave the same
+            if mean < -MAX_TARE_STEP_KG:
+                self._reject(w, t, alias, name, f"empty reading {mean:+.2f} kg is more than "
+                             f"{MAX_TARE_STEP_KG:g} kg off; run 'python calibration.py tare' with the seats empty")
+            elif w.drift_used(t) + abs(mean) > DRIFT_BUDGET_KG:
+                self._reject(w, t, alias, name, f"drift {mean:+.2f} kg would exceed {DRIFT_BUDGET_KG:g} kg of "
+                             f"automatic correction in {DRIFT_BUDGET_WINDOW_S / 3600:g} h; check the load cell")
+            else:
+                self._busy.add(name)
+                w.last_tare_t = t
+                w.tares.append((t, abs(mean)))
+                self._jobs.put(("tare_seat", port, alias, name, mean))
+
+    def _reject(self, w: _SeatWatch, t: float, alias: str, seat: str, why: str):
+        if t - w.last_reject_t < MIN_TARE_INTERVAL_S:
+            return
+        w.last_reject_t = t
+        _M_REJECTED.inc()
+        metrics.log("calibration", f"[{alias}] {seat} not re-tared: {why}", seat=seat)
+
+    # ---------- commands ----------
+
+    def request(self, port: str, cmd: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The board's ack for cmd (request id, timeout and retries in SerialManager.request)."""
+        return get_arduino_data.g_manager.request(port, cmd)
+
+    def tare_seat(self, port: str, alias: str, seat: str, offset_kg: Optional[float] = None) -> bool:
+        ack = self.request(port, {"cmd": "tare_seat", "seat": seat})
+        w = self.watch.get(seat)
+        if w is not None:
+            w.samples.clear()
+        _record(alias, {"event": "tare_seat", "seat": seat, "offset_kg": _r(offset_kg), "acked": ack_ok(ack)})
+        if not ack_ok(ack):
+            metrics.log("calibration", f"[{alias}] tare_seat {seat} failed: {ack.get('error') if ack else 'no ack'}", seat=seat)
+            return False
+        _M_TARES.inc()
+        metrics.log("calibration", f"[{alias}] {seat} re-tared (empty reading {offset_kg:+.2f} kg)"
+                    if offset_kg is not None else f"[{alias}] {seat} tared", seat=seat, offset_kg=offset_kg)
+        return True
+
+    def tare_all(self) -> Dict[str, bool]:
+        """Acked 'tare' on every identified board at once. Only call with all seats empty."""
+        results = {}
+        for device_id, ack in get_arduino_data.g_manager.request_all({"cmd": "tare"}).items():
+            alias = get_arduino_data.alias_for_device(device_id)
+            _record(alias, {"event": "tare", "acked": ack_ok(ack)})
+            results[alias] = ack_ok(ack)
+        return results
+
+    def apply_cal(self, port: str, alias: str) -> bool:
+        """Pushes the stored scale factors to a board that just identified itself."""
+        entry = load_cal_store().get(alias) or {}
+        ok, sent = True, False
+        if "cal" in entry:   # board-wide scale first, per-seat scales (auto_cal_seat) override it
+            ok = ack_ok(self.request(port, {"cmd": "set_cal", "value": entry["cal"]}))
+            sent = True
+        for seat, cfg in (entry.get("seats") or {}).items():
+            if "cal" in cfg:
+                ack = self.request(port, {"cmd": "set_cal_seat", "seat": seat, "value": cfg["cal"]})
+                ok, sent = ok and ack_ok(ack), True
+        if sent:
+            metrics.log("calibration", f"[{alias}] stored calibration {'confirmed' if ok else 'NOT acked'}")
+        return ok
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job[0] == "apply_cal":
+                    self.apply_cal(job[1], job[2])
+                elif job[0] == "tare_seat":
+                    try: self.tare_seat(*job[1:])
+                    finally: self._busy.discard(job[3])
+                elif job[0] == "save_auto_cal":
+                    _, alias, seat, frame = job
+                    store = load_cal_store()
+                    store.setdefault(alias, {}).setdefault("seats", {}).setdefault(seat, {})["cal"] = frame["new_cal"]
+                    save_cal_store(store)
+                    _record(alias, {"event": "auto_cal_seat", "seat": seat, "cal": frame["new_cal"],
+                                    "wref": frame.get("wref")})
+            except Exception as e:
+                print(f"[calibration] {job[0]} failed: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        return {s: {"empty_offset_kg": _r(w.offset_kg), "last_tare_t": w.last_tare_t or None}
+                for s, w in self.watch.items()}
+
+
+def _r(x):
+    return None if x is None else round(x, 3)
+
+
+def _record(alias: str, entry: Dict[str, Any]):
+    store = load_cal_store()
+    board = store.setdefault(alias, {})
+    entry = {"ts": int(time.time()), **entry}
+    board["history"] = (board.get("history") or [])[-(HISTORY_MAX - 1):] + [entry]
+    if entry.get("event") == "tare_seat" and entry.get("acked"):
+        seat = board.setdefault("seats", {}).setdefault(entry["seat"], {})
+        seat["tared_at"], seat["drift_kg"] = entry["ts"], entry.get("offset_kg")
+    save_cal_store(store)
+
+
+g_calibrator = Calibrator()
+
+def start() -> Calibrator:
+    """Call before get_arduino_data.start_reader_threads() so no handshake is missed."""
+    return g_calibrator.start()
+
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == "status":
+        import json
+        print(json.dumps(load_cal_store(), indent=2))
+        return
+    if len(sys.argv) == 2 and sys.argv[1] == "tare":
+        start()
+        get_arduino_data.start_reader_threads()
+        deadline = time.monotonic() + get_arduino_data.HANDSHAKE_TIMEOUT_S
+        while not get_arduino_data.g_manager.devices() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        print(f"[calibration] tare: {g_calibrator.tare_all()}")
+        return
+    print("Usage: python calibration.py status|tare")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# crash_detector.py
+# Streaming crash detector fed one seat sample at a time, O(1) state per seat.
+#
+# readG() on the boards reports the total acceleration magnitude, gravity included
+# (~1 g at rest), so the old "mpu_g > 1.1" test fires on road bumps. Per seat we:
+#   * track the resting gravity baseline with a slow EMA (only while quiet) and subtract it
+#   * compute jerk (g/s) between consecutive samples
+#   * integrate delta-v (m/s) over a sliding window with a running sum
+#   * measure how long the seat has stayed above HIT_G (sample-and-hold)
+# A seat "hits" when all of those agree; a crash needs CONSENSUS_SEATS seats hitting within
+# CONSENSUS_WINDOW_S, or a single seat above SEVERE_G (side impacts load one seat).
+#
+#   python crash_detector.py eval --synth 40            # precision / latency on synthetic drives
+#   python crash_detector.py eval logs/*.ndjson --labels labels.json
+
+import json, math, argparse
+from collections import deque
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+SEATS = ("S1", "S2", "S3", "S4")
+G_MS2 = 9.80665
+
+GRAVITY_INIT_G = 1.0
+GRAVITY_ALPHA = 0.02        # EMA weight per quiet sample
+QUIET_BAND_G = 0.15         # only learn gravity while within this band of the baseline
+HIT_G = 1.0                 # dynamic (gravity-free) acceleration for a seat hit
+SEVERE_G = 3.0              # one seat alone is enough above this
+JERK_MIN_G_S = 5.0          # onset must be sharp (braking ramps up slowly)
+DV_WINDOW_S = 0.6
+DV_MIN_MS = 1.0             # delta-v over the window
+MIN_DURATION_S = 0.05       # one 200 ms firmware sample satisfies this; glitches at higher rates do not
+CONSENSUS_SEATS = 2
+CONSENSUS_WINDOW_S = 0.5
+REARM_S = 3.0               # quiet period before the detector can fire again
+MAX_DT_S = 1.0              # larger gaps (reconnects) reset the per-seat integrators
+DV_SLOTS = 64               # ring size; DV_WINDOW_S at up to ~100 Hz
+
+
+class SeatState:
+    __slots__ = ("gravity", "last_t", "last_dyn", "dv_ring", "dv_sum", "above_s", "hit_t",
+                 "dyn", "jerk", "dv")
+
+    def __init__(self):
+        self.gravity = GRAVITY_INIT_G
+        self.last_t: Optional[float] = None
+        self.last_dyn = 0.0
+        self.dv_ring: deque = deque(maxlen=DV_SLOTS)   # (t, dv contribution)
+        self.dv_sum = 0.0
+        self.above_s = 0.0
+        self.hit_t = -math.inf
+        self.dyn = self.jerk = self.dv = 0.0
+
+    def features(self) -> Dict[str, float]:
+        return {"dyn_g": round(self.dyn, 3), "jerk_g_s": round(self.jerk, 2),
+                "dv_ms": round(self.dv, 3), "above_s": round(self.above_s, 3),
+                "gravity_g": round(self.gravity, 4)}
+
+
+class CrashDetector:
+    def __init__(self, seats: Sequence[str] = SEATS):
+        self.seats = tuple(seats)
+        self.state: Dict[str, SeatState] = {s: SeatState() for s in self.seats}
+        self.last_fire_t = -math.inf
+
+    def reset(self):
+        self.__init__(self.seats)
+
+    def update(self, seat: str, t: float, g: float) -> Optional[Dict[str, Any]]:
+        """Feeds one sample (t in seconds, g = total magnitude). Returns trigger info once per crash."""
+        st = self.state.get(seat)
+        if st is None:
+            return None
+        dyn = abs(g - st.gravity)
+        if dyn < QUIET_BAND_G:
+            st.gravity += GRAVITY_ALPHA * (g - st.gravity)
+
+        dt = (t - st.last_t) if st.last_t is not None else 0.0
+        if dt <= 0.0 or dt > MAX_DT_S:
+            st.dv_ring.clear()
+            st.dv_sum = st.above_s = st.jerk = 0.0
+            dt = 0.0
+        else:
+            st.jerk = (dyn - st.last_dyn) / dt
+            inc = dyn * G_MS2 * dt
+            if len(st.dv_ring) == st.dv_ring.maxlen:
+                st.dv_sum -= st.dv_ring[0][1]
+            st.dv_ring.append((t, inc))
+            st.dv_sum += inc
+            while st.dv_ring and t - st.dv_ring[0][0] > DV_WINDOW_S:
+                st.dv_sum -= st.dv_ring.popleft()[1]
+        # Sample-and-hold: the interval leading up to a sample above HIT_G counts as above.
+        if dyn < HIT_G:
+            st.above_s = 0.0
+        elif st.last_dyn >= HIT_G:
+            st.above_s += dt
+        else:
+            st.above_s = dt
+
+        st.last_t, st.last_dyn = t, dyn
+        st.dyn, st.dv = dyn, max(0.0, st.dv_sum)
+
+        if t - self.last_fire_t < REARM_S:
+            return None
+
+        hit = (dyn >= HIT_G and st.jerk >= JERK_MIN_G_S and st.dv >= DV_MIN_MS and st.above_s >= MIN_DURATION_S)
+        if not hit and not (dyn >= SEVERE_G and dt > 0.0):
+            return None
+        st.hit_t = t
+
+        hit_seats = [s for s, o in self.state.items() if t - o.hit_t <= CONSENSUS_WINDOW_S]
+        severe = dyn >= SEVERE_G
+        if not severe and len(hit_seats) < CONSENSUS_SEATS:
+            return None
+
+        self.last_fire_t = t
+        return {"t": t, "seat": seat, "seats": hit_seats,
+                "reason": "severe" if severe and len(hit_seats) < CONSENSUS_SEATS else "consensus",
+                "features": {s: self.state[s].features() for s in self.seats}}
+
+    def feed_frame(self, frame: Dict[str, Any], t: float) -> Optional[Dict[str, Any]]:
+        trigger = None
+        for s in frame.get("seats", ()):
+            try:
+                r = self.update(s.get("name"), t, float(s.get("mpu_g", 0.0)))
+            except (TypeError, ValueError):
+                continue
+            trigger = trigger or r
+        return trigger
+
+
+class ThresholdDetector:
+    """The original rule (any seat mpu_g > thresh), kept for comparison in evaluate()."""
+
+    def __init__(self, thresh: float = 1.1):
+        self.thresh = thresh
+        self.last_fire_t = -math.inf
+
+    def feed_frame(self, frame: Dict[str, Any], t: float) -> Optional[Dict[str, Any]]:
+        if t - self.last_fire_t < REARM_S: return None
+        for s in frame.get("seats", ()):
+            if float(s.get("mpu_g", 0.0)) > self.thresh:
+                self.last_fire_t = t
+                return {"t": t, "seat": s.get("name"), "reason": "threshold"}
+        return None
+
+
+# ---------- evaluation ----------
+
+MATCH_BEFORE_S = 0.3    # triggers this close before a labelled crash still count (sample phase)
+MATCH_AFTER_S = 2.0
+
+
+def evaluate(drives: Iterable[Tuple[List[Tuple[float, Dict[str, Any]]], List[float]]], make_detector) -> Dict[str, Any]:
+    """drives: (frames [(t, frame)], crash times). Each drive gets a fresh detector."""
+    tp = fp = fn = 0
+    latencies_ms: List[float] = []
+    for frames, crashes in drives:
+        det = make_detector()
+        triggers = [r["t"] for t, f in frames for r in [det.feed_frame(f, t)] if r]
+        matched = set()
+        for c in crashes:
+            hit = next((x for x in triggers if c - MATCH_BEFORE_S <= x <= c + MATCH_AFTER_S and x not in matched), None)
+            if hit is None:
+                fn += 1
+            else:
+                tp += 1
+                matched.add(hit)
+                latencies_ms.append(max(0.0, hit - c) * 1000.0)
+        fp += len([x for x in triggers if x not in matched])
+    lat = sorted(latencies_ms)
+    return {"tp": tp, "fp": fp, "fn": fn,
+            "precision": round(tp / (tp + fp), 3) if tp + fp else None,
+            "recall": round(tp / (tp + fn), 3) if tp + fn else None,
+            "latency_ms_p50": lat[len(lat) // 2] if lat else None,
+            "latency_ms_max": lat[-1] if lat else None}
+
+
+def _synthetic_drives(n: int, seed: int = 0):
+    import random, replay
+    rng = random.Random(seed)
+    for i in range(n):
+        crash = None if i % 2 else round(rng.uniform(5, 25) * replay.SAMPLE_HZ) / replay.SAMPLE_HZ
+        frames = replay.synth_crash_frames(duration_s=30.0, crash_at_s=crash, peak_g=rng.uniform(2.0, 6.0),
+                                           bump_rate_hz=0.5, seed=seed + i)
+        yield frames, ([frames[0][0] + crash] if crash is not None else [])
+
+
+def _logged_drives(paths, labels_path):
+    import replay
+    labels = json.load(open(labels_path, encoding="utf-8")) if labels_path else {}
+    for p in paths:
+        frames = list(replay.read_ndjson(p))
+        crashes = labels.get(p) or labels.get(p.rsplit("/", 1)[-1])
+        if crashes is None:   # synthetic logs carry their own marks
+            crashes = [t for t, f in frames if f.get("_mark") == "crash"][:1]
+        yield frames, crashes
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluate the streaming crash detector.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    ep = sub.add_parser("eval")
+    ep.add_argument("logs", nargs="*", help=".ndjson logs (one drive each)")
+    ep.add_argument("--labels", default=None, help='JSON {"file.ndjson": [crash_epoch_s, ...]}')
+    ep.add_argument("--synth", type=int, default=0, help="evaluate on N synthetic drives instead")
+    ep.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    def drives():
+        return _synthetic_drives(args.synth, args.seed) if args.synth else _logged_drives(args.logs, args.labels)
+
+    print(json.dumps({"streaming": evaluate(drives(), CrashDetector),
+                      "threshold_1.1g": evaluate(drives(), ThresholdDetector)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# face_tracker.py
+# Lightweight multi-face tracker for age.py: IoU matching against a constant-velocity
+# prediction of every track, so a face keeps the same id across frames (and across frames
+# where the detector did not run). Each track accumulates its own age estimates and votes
+# for the seat region (seat_regions.py) its centre falls in, so a face near a midline does
+# not flip between seats from one frame to the next.
+#
+#   python face_tracker.py      # synthetic check: two faces, one drifting across a midline
+
+import itertools
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import seat_regions
+
+Box = Tuple[float, float, float, float]
+
+IOU_MATCH = 0.3          # minimum IoU between a predicted track box and a detection
+MAX_MISSES = 3           # detector runs without a match before a track is dropped
+MIN_HITS = 2             # matched detections before a track counts as confirmed
+VELOCITY_GAIN = 0.5      # smoothing of the per-second centre velocity (0 = ignore motion)
+SEAT_VOTES = 15          # recent centre positions used for the seat vote
+AGE_MIN_SAMPLES = 4      # estimates a track needs before its age can lock
+AGE_MAX_SPREAD = 12      # lock only when those estimates agree within this many years
+
+
+def iou(a: Box, b: Box) -> float:
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    if inter <= 0.0: return 0.0
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _median(vals: Sequence[int]) -> int:
+    v = sorted(vals)
+    mid = len(v) // 2
+    return v[mid] if len(v) % 2 else int(round((v[mid - 1] + v[mid]) / 2.0))
+
+
+class Track:
+    __slots__ = ("id", "box", "vx", "vy", "t", "hits", "misses", "ages", "votes", "locked_age")
+
+    def __init__(self, track_id: int, box: Box, t: float):
+        self.id = track_id
+        self.box = tuple(box)
+        self.vx = self.vy = 0.0
+        self.t = t
+        self.hits = 1
+        self.misses = 0
+        self.ages: List[int] = []
+        self.votes: List[str] = []
+        self.locked_age: Optional[int] = None
+
+    @property
+    def confirmed(self) -> bool:
+        return self.hits >= MIN_HITS
+
+    @property
+    def seat(self) -> Optional[str]:
+        """Majority seat over the last SEAT_VOTES positions (None while outside every region)."""
+        if not self.votes: return None
+        return Counter(self.votes).most_common(1)[0][0]
+
+    def predict(self, t: float) -> Box:
+        dt = t - self.t
+        x1, y1, x2, y2 = self.box
+        return (x1 + self.vx * dt, y1 + self.vy * dt, x2 + self.vx * dt, y2 + self.vy * dt)
+
+    def update(self, box: Box, t: float):
+        dt = t - self.t
+        if dt > 0:
+            cx0, cy0 = (self.box[0] + self.box[2]) / 2.0, (self.box[1] + self.box[3]) / 2.0
+            cx1, cy1 = (box[0] + box[2]) / 2.0, (box[1] + box[3]) / 2.0
+            self.vx += VELOCITY_GAIN * ((cx1 - cx0) / dt - self.vx)
+            self.vy += VELOCITY_GAIN * ((cy1 - cy0) / dt - self.vy)
+        self.box = tuple(box)
+        self.t = t
+        self.hits += 1
+        self.misses = 0
+
+    def add_age(self, age: int) -> Optional[int]:
+        """Adds one estimate; returns the locked age once enough consistent samples exist."""
+        if self.locked_age is not None: return self.locked_age
+        self.ages.append(age)
+        recent = self.ages[-AGE_MIN_SAMPLES:]
+        if self.confirmed and len(recent) >= AGE_MIN_SAMPLES and max(recent) - min(recent) <= AGE_MAX_SPREAD:
+            self.locked_age = _median(self.ages)
+        return self.locked_age
+
+
+class FaceTracker:
+    """update(boxes, t) once per detector run; predict(t) for frames in between."""
+
+    def __init__(self, width: int, height: int, regions=None):
+        self.width, self.height = width, height
+        self.regions = regions
+        self.tracks: List[Track] = []
+        self._ids = itertools.count(1)
+
+    def predict(self, t: float) -> List[Tuple[Track, Box]]:
+        return [(tr, tr.predict(t)) for tr in self.tracks]
+
+    def update(self, boxes: Sequence[Box], t: float) -> List[Track]:
+        """Matches detections to tracks (greedy, highest IoU first) and returns the track for
+        each detection, in the same order as boxes."""
+        predicted = [tr.predict(t) for tr in self.tracks]
+        pairs = sorted(((iou(p, b), ti, di) for ti, p in enumerate(predicted) for di, b in enumerate(boxes)),
+                       reverse=True)
+        out: List[Optional[Track]] = [None] * len(boxes)
+        used = set()
+        for score, ti, di in pairs:
+            if score < IOU_MATCH: break
+            if ti in used or out[di] is not None: continue
+            used.add(ti)
+            self.tracks[ti].update(boxes[di], t)
+            out[di] = self.tracks[ti]
+
+        for ti, tr in enumerate(self.tracks):
+            if ti not in used: tr.misses += 1
+        self.tracks = [tr for tr in self.tracks if tr.misses <= MAX_MISSES]
+
+        for di, box in enumerate(boxes):
+            if out[di] is None:
+                tr = Track(next(self._ids), box, t)
+                self.tracks.append(tr)
+                out[di] = tr
+
+        for tr in out:
+            cx, cy = (tr.box[0] + tr.box[2]) / 2.0, (tr.box[1] + tr.box[3]) / 2.0
+            seat = seat_regions.seat_at(cx, cy, self.width, self.height, self.regions)
+            if seat is not None:
+                tr.votes.append(seat)
+                del tr.votes[:-SEAT_VOTES]
+        return out
+
+    def seat_ages(self) -> Dict[str, int]:
+        """Locked age per seat. If two tracks claim a seat, the one seen most often wins."""
+        best: Dict[str, Track] = {}
+        for tr in self.tracks:
+            seat = tr.seat
+            if tr.locked_age is None or seat is None: continue
+            if seat not in best or tr.hits > best[seat].hits:
+                best[seat] = tr
+        return {seat: tr.locked_age for seat, tr in best.items()}
+
+
+if __name__ == "__main__":
+    # Face A sits in S1 and leans over the S1/S2 midline (x = 320) and back; face B sits in S3.
+    W, H = 640, 480
+    tracker = FaceTracker(W, H)
+    for k in range(12):
+        t = k * 0.2
+        ax = 380 - 30 * min(k, 12 - k) / 2.0   # centre crosses to x = 290 mid-run
+        boxes = [(ax - 40, 300, ax + 40, 380), (420, 60, 500, 140)]
+        for tr, age in zip(tracker.update(boxes, t), (34, 7)):
+            tr.add_age(age + (k % 3) - 1)
+        print(f"t={t:.1f}s " + "  ".join(f"id{tr.id}:{tr.seat}" for tr in tracker.tracks))
+    print("locked:", tracker.seat_ages())
@@ -1,27 +1,96 @@
 # get_arduino_data.py
 
-import os, sys, json, time, glob, threading
-from datetime import datetime
+import os, sys, json, time, glob, atexit, threading
+from array import array
+from collections import deque
+from datetime import datetime, timezone
 from pathlib import Path
 import serial
 from typing import Dict, Any, Optional
+from serial_manager import SerialManager, ack_ok
+import metrics
 
-STATIC_PORTS = [
-    "/dev/serial/by-id/usb-FTDI_FT232R_USB_UART_B0012UVW-if00-port0",
-    "/dev/serial/by-id/usb-FTDI_FT232R_USB_UART_B0012SAU-if00-port0",
-]
+# Boards are discovered under DISCOVERY_GLOB and identified by the "device_id" in their frames.
+# STATIC_PORTS is only for pinning a port that does not show up under /dev/serial/by-id.
+DISCOVERY_GLOB = "/dev/serial/by-id/*"
+STATIC_PORTS = []
 BAUD = 115200
 LOG_DIR = Path("/home/pi/weight_logs")
 LOG_DIR.mkdir(parents=True, exist_ok=True)
+ARCHIVE_DIR = Path("/home/pi/sensor_archive")   # columnar copy, see sensor_archive.py
+LOG_FORMATS = ("ndjson", "archive")
 
-PORT_ALIAS = {
-    "/dev/serial/by-id/usb-FTDI_FT232R_USB_UART_B0012UVW-if00-port0": "Arduino A",
-    "/dev/serial/by-id/usb-FTDI_FT232R_USB_UART_B0012SAU-if00-port0": "Arduino B",
+# device_id (from firmware DEVICE_ID) -> alias used in logs and cal_store.json
+DEVICE_ALIAS = {
+    "arduino_A": "Arduino A",
+    "arduino_B": "Arduino B",
 }
+HANDSHAKE_TIMEOUT_S = 5.0
+HISTORY_SAMPLES = 512                # per seat; ~100 s at the firmware's 5 Hz, ~5 s at 100 Hz
 CAL_STORE_PATH = Path("/home/pi/cal_store.json")
 
-g_latest_seat_data: Dict[str, Dict[str, Any]] = {}
-g_data_lock = threading.Lock()
+SEATS = ("S1", "S2", "S3", "S4")
+SEAT_INDEX = {name: i for i, name in enumerate(SEATS)}
+
+
+class SeatSnapshot:
+    """Fixed arrays indexed like SEATS. Reuse one instance per reader: read() fills it in place."""
+    __slots__ = ("version", "weight", "mpu_g", "mono", "wall", "present")
+
+    def __init__(self):
+        n = len(SEATS)
+        self.version = 0
+        self.weight = array("d", [0.0] * n)
+        self.mpu_g = array("d", [0.0] * n)
+        self.mono = array("d", [0.0] * n)      # time.monotonic() at ingest
+        self.wall = array("d", [0.0] * n)      # _recv_t (epoch s; the recorded time when replayed)
+        self.present = array("b", [0] * n)
+
+
+class SeatTable(SeatSnapshot):
+    """Latest value per seat behind a seqlock: the single writer (ingest, under g_data_lock) makes
+    `version` odd while it updates, readers copy without a lock and retry if it changed."""
+
+    def begin_write(self):
+        self.version += 1
+
+    def end_write(self):
+        self.version += 1
+
+    def read(self, out: Optional[SeatSnapshot] = None) -> SeatSnapshot:
+        if out is None: out = SeatSnapshot()
+        while True:
+            v = self.version
+            if v & 1:
+                time.sleep(0)
+                continue
+            out.weight[:] = self.weight
+            out.mpu_g[:] = self.mpu_g
+            out.mono[:] = self.mono
+            out.wall[:] = self.wall
+            out.present[:] = self.present
+            if self.version == v:
+                out.version = v
+                return out
+
+    def clear(self):
+        self.begin_write()
+        for i in range(len(SEATS)):
+            self.weight[i] = self.mpu_g[i] = self.mono[i] = self.wall[i] = 0.0
+            self.present[i] = 0
+        self.end_write()
+
+
+g_seat_table = SeatTable()
+g_data_lock = threading.Lock()          # serialises writers (and the history / owner maps)
+g_seat_owner: Dict[str, str] = {}   # seat name -> alias of the board reporting it
+g_seat_history: Dict[str, deque] = {}   # seat name -> recent (t, mpu_g) for impact_score's pulse mode
+g_subscribers = []                  # callback(port, alias, frame) after each ingested frame
+g_identify_hooks = []               # callback(port, alias, device_id); replaces _reapply_cal when set
+g_source = None                     # replaces the serial manager when set (see replay.py)
+
+_M_FRAMES = metrics.counter("ingest_frames_total", "Frames applied to the latest-value store")
+_M_SUBSCRIBER_ERRORS = metrics.counter("ingest_subscriber_errors_total", "Exceptions raised by ingest subscribers")
 
 def load_cal_store():
     if CAL_STORE_PATH.exists():
@@ -37,6 +106,10 @@ def save_cal_store(store: dict):
 def now_utc():
     return datetime.utcnow().isoformat() + "Z"
 
+def iso_utc(t: float) -> str:
+    """Epoch seconds -> the ISO string used in the logs; only formatted when something is written."""
+    return datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
 def open_serial(port):
     while True:
         try:
@@ -50,93 +123,125 @@ def open_serial(port):
             time.sleep(1)
 
 
-def reader(port):
-    alias = PORT_ALIAS.get(port, Path(port).name)
-    log_path = LOG_DIR / (port.replace("/", "_") + ".ndjson")
-    ser = None
-    while ser is None:
-        try:
-            ser = serial.Serial(port, BAUD, timeout=1)
-            print(f"[{alias}] Serial port opened successfully.")
-        except serial.SerialException as e:
-             print(f"[{alias}] Failed to open serial port: {e}. Retrying in 2s...")
-             time.sleep(2)
-        except Exception as e:
-            print(f"[{alias}] Unexpected error opening serial port: {e}. Retrying in 2s...")
-            time.sleep(2)
-
+def alias_for_device(device_id):
+    return DEVICE_ALIAS.get(device_id, device_id)
 
+def _reapply_cal(port, alias, device_id=None):
+    """on_identify hook: pushes the stored calibration once the board has said who it is."""
     try:
         store = load_cal_store()
         cal_data = store.get(alias)
         if cal_data and "cal" in cal_data:
-            cal_val = cal_data["cal"]
-            cmd = {"cmd": "set_cal", "value": cal_val}
-            ser.write((json.dumps(cmd) + "\n").encode("utf-8"))
-            ser.flush()
+            g_manager.send(port, {"cmd": "set_cal", "value": cal_data["cal"]})
     except Exception as e:
         print(f"[{alias}] Error reapplying set_cal: {e}")
 
-    last_print = 0
-    with open(log_path, "a") as fout:
-        while True:
+def on_identify(callback):
+    """Registers callback(port, alias, device_id) for each board handshake (calibration.py)."""
+    g_identify_hooks.append(callback)
+
+def _identified(port, alias, device_id):
+    if not g_identify_hooks:
+        _reapply_cal(port, alias, device_id)
+    for cb in g_identify_hooks:
+        cb(port, alias, device_id)
+
+_log_files: Dict[str, Any] = {}
+
+_archive_writer = None
+
+def _archive():
+    global _archive_writer
+    if _archive_writer is None:
+        from sensor_archive import ArchiveWriter
+        _archive_writer = ArchiveWriter(ARCHIVE_DIR)
+        atexit.register(_archive_writer.close)
+    return _archive_writer
+
+def _log_file(port):
+    fout = _log_files.get(port)
+    if fout is None:
+        fout = open(LOG_DIR / (port.replace("/", "_") + ".ndjson"), "a")
+        _log_files[port] = fout
+    return fout
+
+def subscribe(callback):
+    """Registers callback(port, alias, frame) for every ingested frame, live or replayed.
+    Runs on the ingest thread, so it must be cheap. Returns an unsubscribe function."""
+    global g_subscribers
+    g_subscribers = g_subscribers + [callback]
+    def unsubscribe():
+        global g_subscribers
+        g_subscribers = [cb for cb in g_subscribers if cb is not callback]
+    return unsubscribe
+
+def set_source(source):
+    """Feeds ingest from another source (an object with start() -> Thread) instead of serial ports."""
+    global g_source
+    g_source = source
+
+def ingest_frame(port, alias, data, log=True):
+    """Stamps one decoded Arduino frame, updates the latest-value table and logs it.
+    Subscribed to the serial manager (runs on its thread); replay.py calls it with log=False."""
+    data.setdefault("_recv_t", time.time())
+    data["_alias"] = alias
+    data["_port"] = port
+
+    seats_data_in_json = data.get("seats", [])
+    if seats_data_in_json:
+        mono, wall, tbl = time.monotonic(), data["_recv_t"], g_seat_table
+        with g_data_lock:
+            tbl.begin_write()
             try:
-                line = ser.readline().decode("utf-8", errors="ignore").strip()
-                if not line: continue
-                try: data = json.loads(line)
-                except Exception: continue
-
-                data["_recv_ts"] = now_utc()
-                data["_alias"] = alias
-                data["_port"] = port
-
-                seats_data_in_json = data.get("seats", [])
-                if seats_data_in_json:
-                    with g_data_lock:
-                        for s in seats_data_in_json:
-                            seat_name = s.get("name")
-                            if seat_name:
-                                g_latest_seat_data[seat_name] = {
-                                    "Weight": float(s.get("Weight", 0.0)),
-                                    "mpu_g": float(s.get("mpu_g", 0.0)),
-                                    "_recv_ts_utc": data.get("_recv_ts")
-                                }
-
-                fout.write(json.dumps(data) + "\n")
-                fout.flush()
-
-            except serial.SerialException as e:
-                print(f"[{alias}] Serial error: {e}. Reopening port...")
-                try: ser.close()
-                except: pass
-                ser = None
-                while ser is None:
+                for s in seats_data_in_json:
+                    seat_name = s.get("name")
+                    i = SEAT_INDEX.get(seat_name)
+                    if i is None: continue
+                    if g_seat_owner.get(seat_name) != alias:
+                        g_seat_owner[seat_name] = alias
                     try:
-                        ser = serial.Serial(port, BAUD, timeout=1)
-                        print(f"[{alias}] Serial port reopened successfully.")
-                        try:
-                            store = load_cal_store()
-                            cal_data = store.get(alias)
-                            if cal_data and "cal" in cal_data:
-                                cal_val = cal_data["cal"]
-                                cmd = {"cmd": "set_cal", "value": cal_val}
-                                ser.write((json.dumps(cmd) + "\n").encode("utf-8"))
-                                ser.flush()
-                        except Exception as e2:
-                             print(f"[{alias}] Error reapplying set_cal after reconnect: {e2}")
-                    except serial.SerialException as e_reopen:
-                         print(f"[{alias}] Failed to reopen serial port: {e_reopen}. Retrying in 2s...")
-                         time.sleep(2)
-                    except Exception as e_reopen:
-                         print(f"[{alias}] Unexpected error reopening serial port: {e_reopen}. Retrying in 2s...")
-                         time.sleep(2)
-
-            except Exception as e:
-                print(f"[{alias}] Unexpected error in reader loop: {e}")
-                time.sleep(0.2)
+                        w, g = float(s.get("Weight", 0.0)), float(s.get("mpu_g", 0.0))
+                    except (TypeError, ValueError):
+                        continue
+                    tbl.weight[i], tbl.mpu_g[i], tbl.mono[i], tbl.wall[i], tbl.present[i] = w, g, mono, wall, 1
+                    hist = g_seat_history.get(seat_name)
+                    if hist is None:
+                        hist = g_seat_history[seat_name] = deque(maxlen=HISTORY_SAMPLES)
+                    hist.append((wall, g))
+            finally:
+                tbl.end_write()
+
+    _M_FRAMES.inc()
+    for cb in g_subscribers:
+        try: cb(port, alias, data)
+        except Exception as e:
+            _M_SUBSCRIBER_ERRORS.inc()
+            print(f"[{alias}] Ingest subscriber error: {e}")
+
+    if not log: return
+    if "archive" in LOG_FORMATS:
+        try: _archive().add_frame(data)
+        except Exception as e: print(f"[{alias}] Failed to archive frame: {e}")
+    if "ndjson" not in LOG_FORMATS: return
+    try:
+        data.setdefault("_recv_ts", iso_utc(data["_recv_t"]))
+        fout = _log_file(port)
+        fout.write(json.dumps(data) + "\n")
+        fout.flush()
+    except OSError as e:
+        print(f"[{alias}] Failed to write log: {e}")
+
+g_manager = SerialManager(BAUD, on_identify=_identified, alias_for=alias_for_device)
+g_manager.subscribe(ingest_frame)
 
 def send_cmd(port, obj):
-    """Sends a JSON command to a specific port."""
+    """Sends a JSON command to a specific port without waiting for the board (fire and forget).
+    Uses the reader's open handle when the manager owns the port, otherwise opens it once (CLI mode).
+    Use g_manager.request() / request_all() when the result matters."""
+    if g_manager.is_open(port):
+        ok = g_manager.send(port, obj)
+        if ok: print(f"Command {obj} sent to {port}")
+        return ok
     s = None
     try:
         s = open_serial(port)
@@ -150,71 +255,101 @@ def send_cmd(port, obj):
             print(f"Failed to open port {port} to send command.")
             return False
     except Exception as e:
-        print(f"ERROR sending command {obj} to {PORT_ALIAS.get(port, port)}: {e}")
+        print(f"ERROR sending command {obj} to {g_manager.ports().get(port, port)}: {e}")
         if s and s.is_open:
             s.close()
         return False
 
 
-def send_tare_command_to_all():
-    """Sends the 'tare' command to all connected Arduinos."""
-    print("[get_arduino_data] Sending 'tare' command to all Arduinos...")
-    tare_cmd = {"cmd": "tare"}
-    success_count = 0
-    total_ports = len(STATIC_PORTS)
-
-    for port in STATIC_PORTS:
-        if send_cmd(port, tare_cmd):
-            success_count += 1
-        time.sleep(0.2)
-
-    if success_count == total_ports:
-        print("[get_arduino_data] Tare command sent successfully to all Arduinos.")
-        time.sleep(2.0)
-        print("[get_arduino_data] Assumed tare complete.")
-    elif success_count > 0:
-        print(f"[get_arduino_data] WARNING: Tare command sent to {success_count}/{total_ports} Arduinos.")
-        time.sleep(2.0)
-    else:
-        print("[get_arduino_data] CRITICAL: Failed to send tare command to any Arduino.")
-
 def start_reader_threads():
-    print("[get_arduino_data] Starting reader threads...")
-    threads = []
+    """Starts the single serial manager thread: discovered boards plus any STATIC_PORTS pins."""
+    if g_source is not None:
+        print(f"[get_arduino_data] Starting {type(g_source).__name__} instead of serial ports...")
+        return [g_source.start()]
+    print("[get_arduino_data] Starting serial manager...")
+    g_manager.enable_discovery(DISCOVERY_GLOB)
     for p in STATIC_PORTS:
-        t = threading.Thread(target=reader, args=(p,), daemon=True)
-        t.start()
-        threads.append(t)
-    if not threads:
-        print("[get_arduino_data] WARNING: No ports defined.")
-    time.sleep(1.0)
-    return threads
+        g_manager.add_port(p, Path(p).name)
+    # No settling sleep: ports open on the manager thread and callers wait for data instead
+    # (wait_for_seat_data()).
+    return [g_manager.start()]
+
+def read_seats(out: Optional[SeatSnapshot] = None) -> SeatSnapshot:
+    """Consistent, allocation-free read of the latest values (pass the same `out` every time)."""
+    return g_seat_table.read(out)
 
 def get_latest_seat_data() -> Dict[str, Dict[str, Any]]:
+    """Dict view {seat: {Weight, mpu_g, _recv_ts_utc}} for reports and logs. Builds new dicts;
+    hot loops should use read_seats() instead."""
+    return snapshot_dict(g_seat_table.read())
+
+def snapshot_dict(snap: SeatSnapshot) -> Dict[str, Dict[str, Any]]:
+    return {seat: {"Weight": snap.weight[i], "mpu_g": snap.mpu_g[i], "_recv_ts_utc": iso_utc(snap.wall[i])}
+            for i, seat in enumerate(SEATS) if snap.present[i]}
+
+def has_seat_data() -> bool:
+    return g_seat_table.version > 0 and any(g_seat_table.present)
+
+def wait_for_seat_data(timeout_s: Optional[float] = None) -> bool:
+    """Blocks until the first seat frame is in the table (woken by the frame itself, not a poll)."""
+    ev = threading.Event()
+    unsubscribe = subscribe(lambda port, alias, frame: ev.set())
+    deadline = None if timeout_s is None else time.monotonic() + timeout_s
+    try:
+        while not has_seat_data():
+            if not ev.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                return False
+            ev.clear()
+        return True
+    finally:
+        unsubscribe()
+
+def reset_store():
+    """Forgets latest values and history (replay / bench runs)."""
     with g_data_lock:
-        return g_latest_seat_data.copy()
+        g_seat_table.clear()
+        g_seat_history.clear()
+
+def get_seat_history(since: Optional[float] = None) -> Dict[str, list]:
+    """Recent (t, mpu_g) samples per seat, oldest first; t is the _recv_t time base."""
+    with g_data_lock:
+        return {seat: [x for x in hist if since is None or x[0] >= since]
+                for seat, hist in g_seat_history.items()}
+
+def get_seat_map() -> Dict[str, str]:
+    """Which board currently reports each seat, learned from the frames themselves."""
+    with g_data_lock:
+        return dict(g_seat_owner)
+
+def wait_for_alias(alias, timeout_s=HANDSHAKE_TIMEOUT_S) -> Optional[str]:
+    """Returns the port of the board with this alias once it has handshaked, or None."""
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        port = g_manager.port_for_alias(alias)
+        if port: return port
+        time.sleep(0.05)
+    return None
 
 def main():
     if len(sys.argv) == 4 and sys.argv[1] == "set_cal":
         try:
             alias = sys.argv[2]
             cal_val = float(sys.argv[3])
-            port_to_use = None
-            for p, a in PORT_ALIAS.items():
-                if a == alias:
-                    port_to_use = p
-                    break
+            g_manager.enable_discovery(DISCOVERY_GLOB)
+            g_manager.start()
+            port_to_use = wait_for_alias(alias)
             if not port_to_use:
-                print(f"Error: Alias '{alias}' not found.")
+                print(f"Error: No board identified as '{alias}' within {HANDSHAKE_TIMEOUT_S}s. Known: {list(DEVICE_ALIAS.values())}")
                 return
-            if send_cmd(port_to_use, {"cmd": "set_cal", "value": cal_val}):
+            ack = g_manager.request(port_to_use, {"cmd": "set_cal", "value": cal_val})
+            if ack_ok(ack):
                 store = load_cal_store()
                 store.setdefault(alias, {})["cal"] = cal_val
                 store[alias]["updated_at"] = int(time.time())
                 save_cal_store(store)
                 print(f"Successfully set_cal {cal_val} for {alias} and saved.")
             else:
-                 print(f"Failed to send set_cal command for {alias}.")
+                 print(f"set_cal not confirmed by {alias}: {ack.get('error') if ack else 'no ack'}.")
         except Exception as e:
             print(f"Error processing set_cal: {e}")
         return
@@ -222,7 +357,7 @@ def main():
         print(f"Unknown command: {' '.join(sys.argv[1:])}")
         return
 
-    print("[get_arduino_data] Running in Service Mode (for testing reader threads).")
+    print("[get_arduino_data] Running in Service Mode (for testing the serial manager).")
     start_reader_threads()
     print("Reading... (Ctrl+C to stop)")
     try:
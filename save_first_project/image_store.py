@@ -0,0 +1,320 @@
+# image_store.py
+# Accident images for server14, kept in retention tiers with an on-disk index:
+#   hot  : the uploaded JPEG, untouched, for HOT_DAYS
+#   warm : recompressed (WARM_QUALITY, at most WARM_MAX_WIDTH px wide) until WARM_DAYS
+#   cold : moved into one uncompressed zip per month (archive/YYYY-MM.zip)
+# Files live in hashed shard directories (<tier>/<ab>/<id>.jpg), so no directory grows
+# with the fleet, and every lookup is one sqlite primary-key read instead of a path probe.
+# run_maintenance() moves images down the tiers in batches, recompressing on a process pool;
+# start_maintenance() runs it every MAINTENANCE_INTERVAL_S on a daemon thread.
+#
+#   python image_store.py stats [--root images]
+#   python image_store.py maintain [--root images] [--age-offset-days 0]
+#   python image_store.py reindex [--root images]    # adopt loose files, drop rows whose file is gone
+
+import os, json, time, zipfile, sqlite3, hashlib, argparse, threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import metrics
+
+TIERS = ("hot", "warm", "cold")
+HOT_DAYS = 7
+WARM_DAYS = 90
+EXPIRE_DAYS = None          # days after which archived images are deleted (None = keep forever)
+WARM_QUALITY = 60
+WARM_MAX_WIDTH = 1280
+BATCH = 64                  # images per maintenance step, so one run never stalls the server
+POOL_WORKERS = 2
+MAINTENANCE_INTERVAL_S = 3600
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")   # uploads are always stored as <id>.jpg
+DB_NAME = "images.db"
+ARCHIVE_DIR = "archive"
+ARCHIVE_MEMBER_SEP = "!"    # cold row path "archive/YYYY-MM.zip!<member>" when the member was renamed
+DAY = 86400.0
+
+_M_MOVED = {tier: metrics.counter("image_tier_moves_total", "Images moved into a retention tier", tier=tier)
+            for tier in TIERS + ("expired",)}
+_M_SAVED = metrics.counter("image_recompress_saved_bytes_total", "Bytes saved by warm-tier recompression")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    filename   TEXT PRIMARY KEY,
+    tier       TEXT NOT NULL,
+    path       TEXT NOT NULL,     -- relative to root; the zip for cold images (zip!member if renamed)
+    bytes      INTEGER NOT NULL,
+    orig_bytes INTEGER NOT NULL,
+    width      INTEGER,
+    height     INTEGER,
+    created    REAL NOT NULL,
+    updated    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_tier_created ON images (tier, created);
+"""
+
+
+def shard(filename: str) -> str:
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:2]
+
+
+def _recompress(src: str, quality: int, max_width: int) -> Tuple[Optional[bytes], int, int]:
+    """Process-pool worker: decoded and re-encoded JPEG bytes (None when it would not shrink)."""
+    import cv2
+    img = cv2.imread(src, cv2.IMREAD_COLOR)
+    if img is None:
+        return None, 0, 0
+    h, w = img.shape[:2]
+    if w > max_width:
+        img = cv2.resize(img, (max_width, int(round(h * max_width / float(w)))), interpolation=cv2.INTER_AREA)
+        h, w = img.shape[:2]
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok or buf.nbytes >= os.path.getsize(src):
+        return None, w, h
+    return buf.tobytes(), w, h
+
+
+class ImageStore:
+    def __init__(self, root: str = "images"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(root, DB_NAME), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- paths / index ----------
+    def _rel(self, tier: str, filename: str) -> str:
+        return os.path.join(tier, shard(filename), filename)
+
+    def _abs(self, rel: str) -> str:
+        return os.path.join(self.root, rel)
+
+    @staticmethod
+    def _member(row) -> Tuple[str, str]:
+        """(file, zip member) of an index row; member is the filename unless _to_cold renamed it."""
+        rel, _, member = row["path"].partition(ARCHIVE_MEMBER_SEP)
+        return rel, member or row["filename"]
+
+    def lookup(self, filename: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute("SELECT * FROM images WHERE filename = ?", (filename,)).fetchone()
+
+    def _upsert(self, filename, tier, rel, size, orig_bytes, width, height, created):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(filename) DO UPDATE SET "
+                "tier=excluded.tier, path=excluded.path, bytes=excluded.bytes, orig_bytes=excluded.orig_bytes, "
+                "width=excluded.width, height=excluded.height, created=excluded.created, updated=excluded.updated",
+                (filename, tier, rel, size, orig_bytes, width, height, created, time.time()))
+
+    # ---------- write / read ----------
+    def put(self, filename: str, src) -> str:
+        """Stores an upload (bytes, or anything with .save(path) such as a werkzeug FileStorage)
+        in the hot tier, replacing any earlier copy of the same filename. Returns the path."""
+        old = self.lookup(filename)
+        rel = self._rel("hot", filename)
+        path = self._abs(rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".part"
+        if isinstance(src, (bytes, bytearray)):
+            with open(tmp, "wb") as f:
+                f.write(src)
+        else:
+            src.save(tmp)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        self._upsert(filename, "hot", rel, size, size, None, None, time.time())
+        if old is not None and old["tier"] != "cold" and old["path"] != rel:
+            self._remove_file(old["path"])
+        return path
+
+    def open(self, filename: str) -> Optional[Tuple[str, object]]:
+        """("path", abs path) for hot/warm images, ("bytes", data) for archived ones, None if unknown."""
+        row = self.lookup(filename)
+        if row is None:
+            return None
+        if row["tier"] == "cold":
+            try:   # under the lock: maintenance may be appending to the same archive
+                rel, member = self._member(row)
+                with self._lock, zipfile.ZipFile(self._abs(rel)) as zf:
+                    return "bytes", zf.read(member)
+            except (OSError, KeyError, zipfile.BadZipFile):
+                return None
+        path = self._abs(row["path"])
+        return ("path", path) if os.path.isfile(path) else None
+
+    def _remove_file(self, rel: str):
+        try:
+            os.remove(self._abs(rel))
+        except FileNotFoundError:
+            pass
+
+    # ---------- maintenance ----------
+    def _batch(self, tier: str, older_than: float):
+        with self._lock:
+            return self._db.execute("SELECT * FROM images WHERE tier = ? AND created < ? ORDER BY created LIMIT ?",
+                                    (tier, older_than, BATCH)).fetchall()
+
+    def _to_warm(self, now: float, pool: ProcessPoolExecutor) -> int:
+        rows = self._batch("hot", now - HOT_DAYS * DAY)
+        jobs = [(row, pool.submit(_recompress, self._abs(row["path"]), WARM_QUALITY, WARM_MAX_WIDTH)) for row in rows]
+        for row, job in jobs:
+            try:
+                data, w, h = job.result()
+            except Exception as e:
+                metrics.log("image_store", f"recompress failed for {row['filename']}: {e}")
+                data, w, h = None, 0, 0
+            src = self._abs(row["path"])
+            if not os.path.isfile(src):   # deleted behind our back: forget it
+                with self._lock, self._db:
+                    self._db.execute("DELETE FROM images WHERE filename = ?", (row["filename"],))
+                continue
+            rel = self._rel("warm", row["filename"])
+            path = self._abs(rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if data is None:   # already small, or unreadable: keep the original bytes
+                os.replace(src, path)
+            else:
+                with open(path + ".part", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".part", path)
+                self._remove_file(row["path"])
+                _M_SAVED.inc(row["bytes"] - len(data))
+            self._upsert(row["filename"], "warm", rel, os.path.getsize(path), row["orig_bytes"],
+                         w or None, h or None, row["created"])
+            _M_MOVED["warm"].inc()
+        return len(jobs)
+
+    def _to_cold(self, now: float) -> int:
+        rows = self._batch("warm", now - WARM_DAYS * DAY)
+        by_month: Dict[str, list] = {}
+        for row in rows:
+            by_month.setdefault(time.strftime("%Y-%m", time.localtime(row["created"])), []).append(row)
+        for month, month_rows in by_month.items():
+            rel = os.path.join(ARCHIVE_DIR, f"{month}.zip")
+            os.makedirs(self._abs(ARCHIVE_DIR), exist_ok=True)
+            paths = {}
+            with self._lock, zipfile.ZipFile(self._abs(rel), "a", compression=zipfile.ZIP_STORED) as zf:
+                names = set(zf.namelist())
+                for row in month_rows:
+                    # Zip members cannot be replaced; a re-uploaded image whose older copy is
+                    # already in this month's archive goes in under a suffixed name.
+                    member, n = row["filename"], 1
+                    stem, ext = os.path.splitext(member)
+                    while member in names:
+                        member, n = f"{stem}~{n}{ext}", n + 1
+                    zf.write(self._abs(row["path"]), member)
+                    names.add(member)
+                    paths[row["filename"]] = rel if member == row["filename"] else f"{rel}{ARCHIVE_MEMBER_SEP}{member}"
+            for row in month_rows:
+                self._remove_file(row["path"])
+                self._upsert(row["filename"], "cold", paths[row["filename"]], row["bytes"], row["orig_bytes"],
+                             row["width"], row["height"], row["created"])
+                _M_MOVED["cold"].inc()
+        return len(rows)
+
+    def _expire(self, now: float) -> int:
+        if EXPIRE_DAYS is None:
+            return 0
+        rows = self._batch("cold", now - EXPIRE_DAYS * DAY)
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM images WHERE filename = ?", [(r["filename"],) for r in rows])
+        # Zip members cannot be removed in place; a month's archive goes once nothing references it.
+        for rel in {self._member(r)[0] for r in rows}:
+            with self._lock:
+                if self._db.execute("SELECT 1 FROM images WHERE path = ? OR path LIKE ? LIMIT 1",
+                                    (rel, rel + ARCHIVE_MEMBER_SEP + "%")).fetchone() is None:
+                    self._remove_file(rel)
+        _M_MOVED["expired"].inc(len(rows))
+        return len(rows)
+
+    def run_maintenance(self, now: Optional[float] = None, max_batches: int = 1000) -> Dict[str, int]:
+        """Moves everything that is due down one or more tiers. Returns counts per step."""
+        now = time.time() if now is None else now
+        done = {"warm": 0, "cold": 0, "expired": 0}
+        t0 = time.monotonic()
+        with ProcessPoolExecutor(max_workers=POOL_WORKERS) as pool:
+            for _ in range(max_batches):
+                moved = self._to_warm(now, pool)
+                done["warm"] += moved
+                if moved < BATCH: break
+        for step, fn in (("cold", self._to_cold), ("expired", self._expire)):
+            for _ in range(max_batches):
+                moved = fn(now)
+                done[step] += moved
+                if moved < BATCH: break
+        if any(done.values()):
+            metrics.log("image_store", f"maintenance: {done} in {time.monotonic() - t0:.1f}s")
+        return done
+
+    def start_maintenance(self, interval: float = MAINTENANCE_INTERVAL_S):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_maintenance()
+                except Exception as e:
+                    metrics.log("image_store", f"maintenance failed: {e}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name="image-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop_maintenance(self):
+        self._stop.set()
+
+    # ---------- housekeeping ----------
+    def reindex(self) -> Dict[str, int]:
+        """Adopts image files left directly in root (the old flat layout) into the hot tier,
+        keeping their mtime as the upload time, and drops index rows whose file is gone."""
+        adopted = dropped = 0
+        for name in sorted(os.listdir(self.root)):
+            src = os.path.join(self.root, name)
+            if not (os.path.isfile(src) and name.lower().endswith(IMAGE_EXTENSIONS)):
+                continue
+            rel = self._rel("hot", name)
+            os.makedirs(os.path.dirname(self._abs(rel)), exist_ok=True)
+            created = os.path.getmtime(src)
+            os.replace(src, self._abs(rel))
+            size = os.path.getsize(self._abs(rel))
+            self._upsert(name, "hot", rel, size, size, None, None, created)
+            adopted += 1
+        with self._lock:
+            rows = self._db.execute("SELECT filename, path FROM images").fetchall()
+        for row in rows:
+            if not os.path.isfile(self._abs(self._member(row)[0])):
+                with self._lock, self._db:
+                    self._db.execute("DELETE FROM images WHERE filename = ?", (row["filename"],))
+                dropped += 1
+        return {"adopted": adopted, "dropped": dropped}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            rows = self._db.execute("SELECT tier, COUNT(*) AS n, SUM(bytes) AS b, SUM(orig_bytes) AS ob "
+                                    "FROM images GROUP BY tier").fetchall()
+        return {r["tier"]: {"images": r["n"], "bytes": r["b"] or 0, "orig_bytes": r["ob"] or 0} for r in rows}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="server14 image retention tiers.")
+    ap.add_argument("command", choices=("stats", "maintain", "reindex"))
+    ap.add_argument("--root", default="images")
+    ap.add_argument("--age-offset-days", type=float, default=0.0,
+                    help="maintain as if this many days had passed (dry-run the schedule)")
+    args = ap.parse_args()
+    store = ImageStore(args.root)
+    if args.command == "maintain":
+        print(json.dumps(store.run_maintenance(now=time.time() + args.age_offset_days * DAY)))
+    elif args.command == "reindex":
+        print(json.dumps(store.reindex()))
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,39 @@
 # impact_score.py
+# Per-seat impact score 0..50 from the seat accelerometers (mpu_g).
+# Pulse mode scores the samples the boards actually sent; nothing is interpolated between them.
+# At the current 5 Hz frame rate a crash pulse (~100 ms) is one or two samples, so only peak g
+# and delta-v mean anything (delta-v is the rectangle rule over the real sample spacing, an upper
+# bound at 5 Hz where one sample stands for 200 ms). Pulse duration and HIC15 need ms-scale
+# samples: they are left out of the score (weight 0, reported as None) unless the sensor rate
+# is at least MIN_PULSE_RATE_HZ.
 
 import json, time
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
+
+import numpy as np
 
 SEATS = ("S1", "S2", "S3", "S4")
 
+# "pulse": score the whole crash pulse from get_arduino_data.get_seat_history() (falls back
+# to "peak" when no history is passed). "peak": the original single-sample mpu_g mapping.
+IMPACT_MODE = "pulse"
+
+G_MS2 = 9.80665
+MIN_PULSE_RATE_HZ = 100.0   # below this, duration and HIC15 are not computed
+PRE_S, POST_S = 0.5, 1.5    # pulse window around the trigger
+PULSE_FLOOR_G = 0.5         # dynamic g counted as "in the pulse" for duration
+HIC_WINDOW_S = 0.015        # HIC15
+
+# (low, high) ramps mapped to 0..1; the score is their weighted sum times 50.
+PEAK_G_RANGE = (0.5, 5.0)
+DV_MS_RANGE = (1.0, 8.0)         # ~4 km/h to ~29 km/h, where serious-injury risk climbs
+HIC_RANGE = (0.0, 700.0)         # 700 = FMVSS 208 HIC15 limit
+DURATION_S_RANGE = (0.03, 0.15)
+SCORE_WEIGHTS = {"dv_ms": 0.4, "peak_g": 0.3, "hic15": 0.2, "duration_s": 0.1}
+
+last_pulse_features: Optional[Dict[str, Dict[str, float]]] = None   # per seat, from the last pulse score
+
 W = {
     "S1": [1.00, 0.60, 0.40, 0.20],
     "S2": [0.60, 1.00, 0.20, 0.40],
@@ -32,7 +60,102 @@ def _compute_impacts_from_sg_list(Sg: list) -> Tuple[float, float, float, float]
 
     return tuple(impacts)
 
-def calculate_impact_scores(seat_data_dict: Dict[str, Dict[str, Any]]) -> Tuple[float, float, float, float]:
+# Rows normalised so the coupled series stays in g (a weighted mix of the seats' pulses);
+# the raw rows sum to 2.2 and would more than double delta-v and HIC.
+_W_MATRIX = np.array([W[s] for s in SEATS], dtype=np.float64)
+_W_MATRIX /= _W_MATRIX.sum(axis=1, keepdims=True)
+
+
+def _hic(a: np.ndarray, dt: float, window_s: float = HIC_WINDOW_S) -> np.ndarray:
+    """HIC over windows up to window_s for each row of a (g): max (t2-t1) * mean(a)^2.5."""
+    csum = np.concatenate([np.zeros((a.shape[0], 1)), np.cumsum(a, axis=1) * dt], axis=1)
+    best = np.zeros(a.shape[0])
+    for k in range(1, max(1, int(window_s / dt + 1e-9)) + 1):
+        if k >= csum.shape[1]: break
+        span = k * dt
+        mean = (csum[:, k:] - csum[:, :-k]) / span
+        best = np.maximum(best, (span * mean ** 2.5).max(axis=1))
+    return best
+
+
+def pulse_features(history: Dict[str, List[Tuple[float, float]]],
+                   t_trigger: Optional[float] = None) -> Optional[Dict[str, Dict[str, float]]]:
+    """history: seat -> [(t, mpu_g)] (get_arduino_data.get_seat_history()). Takes the real samples
+    in the window around the trigger, removes each seat's gravity baseline, applies W across seats
+    sample by sample and returns peak_g, dv_ms, duration_s, hic15 and rate_hz per seat
+    (duration_s / hic15 are None below MIN_PULSE_RATE_HZ). None if there is nothing to score."""
+    series = {s: np.asarray(history.get(s) or [], dtype=np.float64).reshape(-1, 2) for s in SEATS}
+    if not any(len(v) >= 2 for v in series.values()):
+        return None
+
+    if t_trigger is None:   # centre on the largest deviation from 1 g
+        t_trigger = max(((v[np.argmax(np.abs(v[:, 1] - 1.0)), 0], np.abs(v[:, 1] - 1.0).max())
+                         for v in series.values() if len(v)), key=lambda x: x[1])[0]
+    t0, t1 = t_trigger - PRE_S, t_trigger + POST_S
+
+    # Sample spacing the boards actually delivered in the window.
+    gaps = np.concatenate([np.diff(v[(v[:, 0] >= t0) & (v[:, 0] <= t1), 0]) for v in series.values()])
+    gaps = gaps[gaps > 0]
+    if not gaps.size:
+        return None
+    dt = float(np.median(gaps))
+    rate_hz = 1.0 / dt
+
+    # One slot per sample period; each seat fills the slots it has a sample in (frames from the
+    # same board share a slot, so W mixes readings taken together). Empty slots stay 0.
+    n = int(np.floor((t1 - t0) / dt)) + 1
+    A = np.zeros((len(SEATS), n))
+    for i, s in enumerate(SEATS):
+        v = series[s]
+        if len(v) < 2: continue
+        before = v[v[:, 0] < t0, 1]
+        baseline = float(np.median(before)) if before.size else 1.0
+        inside = v[(v[:, 0] >= t0) & (v[:, 0] <= t1)]
+        slot = np.clip(np.rint((inside[:, 0] - t0) / dt).astype(int), 0, n - 1)
+        np.maximum.at(A[i], slot, np.abs(inside[:, 1] - baseline))
+
+    I = _W_MATRIX @ A                      # coupled seat load
+    peak = I.max(axis=1)
+    dv = I.sum(axis=1) * dt * G_MS2      # rectangle rule over the real sample spacing
+    fine = rate_hz >= MIN_PULSE_RATE_HZ
+    duration = (I >= PULSE_FLOOR_G).sum(axis=1) * dt if fine else None
+    hic = _hic(I, dt) if fine else None
+    return {s: {"peak_g": round(float(peak[i]), 3), "dv_ms": round(float(dv[i]), 3),
+                "duration_s": round(float(duration[i]), 3) if fine else None,
+                "hic15": round(float(hic[i]), 2) if fine else None,
+                "rate_hz": round(rate_hz, 1)}
+            for i, s in enumerate(SEATS)}
+
+
+def _ramp(x: float, lo_hi: Tuple[float, float]) -> float:
+    lo, hi = lo_hi
+    return min(1.0, max(0.0, (x - lo) / (hi - lo)))
+
+
+def pulse_score_0_50(f: Dict[str, Any]) -> float:
+    """Weighted ramps of the features; features that are None (sensor too slow) get weight 0 and
+    the remaining weights are scaled back up so the score still spans 0..50."""
+    ranges = {"dv_ms": DV_MS_RANGE, "peak_g": PEAK_G_RANGE, "hic15": HIC_RANGE, "duration_s": DURATION_S_RANGE}
+    parts = {k: _ramp(f[k], r) for k, r in ranges.items() if f.get(k) is not None}
+    total = sum(SCORE_WEIGHTS[k] for k in parts)
+    if total <= 0: return 0.0
+    return round(50.0 * sum(SCORE_WEIGHTS[k] * v for k, v in parts.items()) / total, 2)
+
+
+def calculate_impact_scores(seat_data_dict: Dict[str, Dict[str, Any]],
+                            history: Optional[Dict[str, List[Tuple[float, float]]]] = None,
+                            t_trigger: Optional[float] = None) -> Tuple[float, float, float, float]:
+    global last_pulse_features
+    if IMPACT_MODE == "pulse" and history:
+        try:
+            feats = pulse_features(history, t_trigger)
+        except Exception as e:
+            print(f"[impact_score] Pulse scoring failed, using peak mode: {e}")
+            feats = None
+        last_pulse_features = feats
+        if feats:
+            return tuple(pulse_score_0_50(feats[s]) for s in SEATS)
+
     Sg = []
     try:
         for seat in SEATS:
@@ -67,3 +190,17 @@ if __name__ == "__main__":
     print(f"S2_impact: {s2_imp:.2f}")
     print(f"S3_impact: {s3_imp:.2f}")
     print(f"S4_impact: {s4_imp:.2f}")
+
+    # Pulse mode on a synthetic 5 Hz crash (replay.py), as main.py passes it after stabilisation.
+    import replay
+    history: Dict[str, list] = {s: [] for s in SEATS}
+    for t, frame in replay.synth_crash_frames(duration_s=12.0, crash_at_s=8.0, peak_g=4.0, bump_rate_hz=0.0):
+        for seat in frame["seats"]:
+            history[seat["name"]].append((t, seat["mpu_g"]))
+    t0 = time.perf_counter()
+    scores = calculate_impact_scores(mock_trigger_data, history)
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    print("\n--- Pulse-mode Impact Scores (0-50) ---")
+    for seat, score in zip(SEATS, scores):
+        print(f"{seat}_impact: {score:.2f}  {(last_pulse_features or {}).get(seat)}")
+    print(f"(scored in {elapsed_ms:.1f} ms)")
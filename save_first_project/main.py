@@ -1,20 +1,22 @@
 #main.py
 
-import threading
 import time
+BOOT_T0 = time.monotonic()   # time-to-armed is measured from here (bench_startup.py)
+
+import sys
 import json
-import requests
-from typing import Tuple, Dict, Any
+import threading
 
+# Only what the crash watch needs is imported up front. The vision and upload modules (cv2,
+# facelib/torch, requests) are loaded by warmup() on background threads while the serial
+# ports open; age / vision_pool / postcrash / warm_camera are imported where they are used.
 try:
-    from get_arduino_data import start_reader_threads, get_latest_seat_data, send_tare_command_to_all
-    import age
+    from get_arduino_data import start_reader_threads, wait_for_seat_data
+    import calibration
     import seat_status
+    import accident_bundle
     import accident_flag
-    import motion
-    import impact_score
-    import jsondata
-    import capture
+    import metrics
 except ImportError as e:
     print(f"CRITICAL ERROR: Failed to import module. {e}")
     print("Please ensure all .py files are in the same directory.")
@@ -22,113 +24,236 @@ except ImportError as e:
 
 SERVER_BASE_URL = "http://127.0.0.1:5000"
 POST_ACCIDENT_WAIT_S = 5.0
+INCIDENT_LINK_S = 120.0   # a trigger this soon after the previous impact is a secondary impact (pile-up, rollover)
+MAX_INCIDENTS = None      # None: re-arm forever; 1: handle one accident and exit (python main.py --once)
+PROVISIONAL_AGES = (0, 0, 0, 0)   # seats the age check has not decided when a crash comes: adult if weight-occupied
+AGE_STOP_WAIT_S = 1.0     # how long a trigger waits for a running age check to stop and free the camera
+IDLE_POLL_S = 1.0         # while armed and idle, how often occupancy is compared with the last age check
 
-def main():
+_M_ARMED_S = metrics.gauge("boot_time_to_armed_seconds", "Process start to crash watch armed")
+
+def log(msg: str):
+    metrics.log("Main", msg)
+
+
+def warmup():
+    """Boot work the crash watch does not need, started in parallel: the age models, the
+    post-crash modules, and the camera (kept open by warm_camera.py and pre-read so its
+    exposure has settled). Returns the threads; the first age check joins them."""
+    def models():
+        import age
+        if not age.load_models():
+            raise RuntimeError(age.g_model_load_error)
+
+    def pipeline():
+        import postcrash   # noqa: F401  (motion, capture, impact_score, requests)
+        import motion, motion_engines
+        if motion.MOTION_ENGINE == "auto":   # measured now, while the CPU is idle, and reused after a crash
+            log(f"Motion engine: {motion_engines.select_tier(motion.WIDTH, motion.HEIGHT)}")
+        import report_schema
+        report_schema.negotiate(SERVER_BASE_URL)   # the report format, so the first POST does not ask
+
+    def camera():
+        import vision_pool, warm_camera
+        warm_camera.install()
+        index = vision_pool.CAMERAS[0]["index"]
+        if len(vision_pool.CAMERAS) == 1 and not warm_camera.prewarm(index):   # pool workers open their own
+            raise RuntimeError(f"camera {index} did not open")
+
+    def timed(name, fn):
+        try:
+            fn()
+            log(f"Warmup: {name} ready ({time.monotonic() - BOOT_T0:.1f}s after start)")
+        except Exception as e:
+            log(f"Warmup: {name} failed: {e}")
+
+    threads = [threading.Thread(target=timed, args=(name, fn), name=f"warmup-{name}", daemon=True)
+               for name, fn in (("models", models), ("pipeline", pipeline), ("camera", camera))]
+    for t in threads:
+        t.start()
+    return threads
+
+
+class AgeCheck:
+    """One age analysis on a background thread, so the crash watch stays armed while it runs.
+    result() is called on a trigger: it stops a run still in progress so the camera is free
+    for the post-crash tasks."""
+
+    def __init__(self, occupancy, wait_for=()):
+        self.occupancy = occupancy
+        self.ages = None
+        self.stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(wait_for,), name="age-check", daemon=True)
+        self._thread.start()
+
+    def _run(self, wait_for):
+        for t in wait_for:
+            t.join()
+        if self.stop_event.is_set():   # superseded while the warmup was still running
+            return
+        try:
+            import age, vision_pool
+            log(f"Starting {age.RUN_DURATION}s age analysis (occupancy: {self.occupancy})...")
+            self.ages = vision_pool.age_result(stop_event=self.stop_event)
+        except Exception as e:
+            log(f"ERROR: Age analysis failed: {e}")
+            return
+        if not self.stop_event.is_set():
+            log(f"Age analysis complete: {self.ages} -> sit status {seat_status.get_seat_status(self.ages)} "
+                f"(filtered kg: {seat_status.get_filtered_weights()})")
+
+    def done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def result(self):
+        """(ages, complete). An interrupted or failed run keeps the seats it had locked; the
+        rest fall back to PROVISIONAL_AGES."""
+        if self._thread.is_alive():
+            self.stop_event.set()
+            self._thread.join(AGE_STOP_WAIT_S)
+        complete = self.ages is not None and not self.stop_event.is_set()
+        if complete:
+            return self.ages, True
+        partial = self.ages or (2, 2, 2, 2)
+        ages = tuple(p if a == 2 else a for a, p in zip(partial, PROVISIONAL_AGES))
+        log(f"Age analysis {'interrupted' if self.stop_event.is_set() else 'failed'}; using {ages} "
+            f"(unknown seats counted as adult when occupied)")
+        return ages, False
 
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] --- System Ignition ---")
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Starting Arduino data readers (Thread-1)...")
-    start_reader_threads()
 
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Waiting for initial sensor data...")
-    while not get_latest_seat_data():
-        time.sleep(0.2)
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Initial sensor data received.")
-
-
-    print("\n" + "="*50)
-    input("IMPORTANT: Ensure all seats are EMPTY, then press Enter to calibrate weights...")
-    send_tare_command_to_all()
-    print("="*50 + "\n")
-
-    input("Please have occupants take their seats, then press Enter to start monitoring...")
-    print("="*50 + "\n")
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Starting initial {age.RUN_DURATION}s age analysis...")
-    initial_ages = age.age_result()
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Initial age analysis complete: {initial_ages}")
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Performing initial seat status check...")
-    current_arduino_data = get_latest_seat_data()
-    initial_sits = seat_status.get_seat_status(initial_ages, current_arduino_data)
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Initial sit status determined: {initial_sits}")
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] === SYSTEM ARMED ===\n[{time.strftime('%H:%M:%S')}] [Main] Waiting for accident trigger...")
-
-    trigger_data = accident_flag.wait_accident_flag()
-
-    if not trigger_data:
-        print(f"[{time.strftime('%H:%M:%S')}] [Main] wait_accident_flag returned None (timeout?). Exiting.")
-        return
-
-    print(f"\n[{time.strftime('%H:%M:%S')}] [Main] !!! === ACCIDENT DETECTED === !!!")
-
-    final_ages = initial_ages
-    final_sits = initial_sits
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Impact Data: {trigger_data}")
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Occupant Age (at startup): {final_ages}")
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Occupant Sit (at startup): {final_sits}")
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Waiting {POST_ACCIDENT_WAIT_S}s for stabilization...")
-    time.sleep(POST_ACCIDENT_WAIT_S)
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Starting post-accident motion analysis...")
-    final_uc = motion.motion_result()
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Motion analysis complete. UC Status: {final_uc}")
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Calculating impact scores...")
-    final_impacts = impact_score.calculate_impact_scores(trigger_data)
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Impact scores calculated: {final_impacts}")
-
-    print(f"[{time.strftime('%H:%M:%S')}] [Main] Assembling final JSON report...")
-
-    s1_data = (final_ages[0], final_uc[0], final_impacts[0], final_sits[0])
-    s2_data = (final_ages[1], final_uc[1], final_impacts[1], final_sits[1])
-    s3_data = (final_ages[2], final_uc[2], final_impacts[2], final_sits[2])
-    s4_data = (final_ages[3], final_uc[3], final_impacts[3], final_sits[3])
-
-    report_dict = jsondata.get_all_seats_dict(s1_data, s2_data, s3_data, s4_data)
-
-    print(f"\n[{time.strftime('%H:%M:%S')}] [Main] --- FINAL ACCIDENT REPORT ---")
-    print(json.dumps(report_dict, indent=4))
-
-    accident_id = None
-    try:
-        print(f"[{time.strftime('%H:%M:%S')}] [Main] Sending JSON report to {SERVER_BASE_URL}...")
-        resp = requests.post(
-            f"{SERVER_BASE_URL}/api/accident_trigger",
-            json=report_dict,
-            timeout=10
-        )
-
-        if resp.status_code == 200:
-            response_data = resp.json()
-            accident_id = response_data.get('id')
-            if accident_id:
-                print(f"[{time.strftime('%H:%M:%S')}] [Main] Server ACCEPTED report. Accident ID: {accident_id}")
-            else:
-                print(f"[{time.strftime('%H:%M:%S')}] [Main] ERROR: Server responded OK (200) but did not return an 'id'. Response: {response_data}")
-        else:
-            print(f"[{time.strftime('%H:%M:%S')}] [Main] ERROR: Server returned status code {resp.status_code}")
-            print(f"[{time.strftime('%H:%M:%S')}] [Main] Server Response Text: {resp.text}")
-
-    except requests.exceptions.Timeout:
-        print(f"[{time.strftime('%H:%M:%S')}] [Main] CRITICAL: Connection to server timed out after 10 seconds.")
-    except requests.exceptions.RequestException as e:
-        print(f"[{time.strftime('%H:%M:%S')}] [Main] CRITICAL: Failed to send JSON report. Error: {e}")
-
-    if accident_id:
-        print(f"[{time.strftime('%H:%M:%S')}] [Main] Capturing and uploading incident photo for ID: {accident_id}...")
-        # Call the function from the imported capture module
-        upload_success = capture.capture_and_upload(accident_id, SERVER_BASE_URL)
-        if upload_success:
-            print(f"[{time.strftime('%H:%M:%S')}] [Main] Photo upload successful.")
-        else:
-            print(f"[{time.strftime('%H:%M:%S')}] [Main] ERROR: Photo upload failed. Check capture.py logs and server status.")
+def handle_impact(trigger_data, t0, ages, incident=None):
+    """One impact through the post-crash task graph. incident is the previous outcome of the
+    same accident for a secondary impact; returns the outcome to pass for the next one."""
+    # Debounced occupancy just before the impact; the crash pulse itself cannot flip it.
+    sits = seat_status.get_seat_status(ages)
+    count = incident["impact_count"] + 1 if incident else 1
+
+    log(f"Impact Data: {trigger_data}")
+    log(f"Occupant Age: {ages}")
+    log(f"Occupant Sit (at trigger): {sits}")
+
+    # Only seats with an occupant are analysed: loaded by weight, or seated per the age check
+    # (a face can be missed at startup). The camera stops once every one of them has moved.
+    occupancy = seat_status.get_occupancy()
+    occupied = {seat: bool(occupancy[seat] or sits[i]) for i, seat in enumerate(seat_status.SEATS)}
+
+    # Impact scoring, the preliminary report POST and the photo run while the cabin settles;
+    # the motion verdicts follow as an update to the same accident (postcrash.py).
+    log(f"Post-crash tasks starting ({POST_ACCIDENT_WAIT_S}s stabilization before motion, "
+        f"occupied: {[s for s, o in occupied.items() if o]})...")
+    import postcrash
+    outcome = postcrash.run(trigger_data, ages, sits, occupied, SERVER_BASE_URL,
+                            stabilise_s=POST_ACCIDENT_WAIT_S, t0=t0,
+                            accident_id=incident and incident["accident_id"],
+                            prior_impacts=incident and incident["impacts"], impact_count=count)
+    log(f"Impact scores: {outcome['impacts']}  UC Status: {outcome['uc']}")
+
+    print()
+    log(f"--- FINAL ACCIDENT REPORT (impact {count}) ---")
+    print(json.dumps(outcome["report"], indent=4))
+
+    if outcome["accident_id"] and count > 1:
+        log(f"Accident ID: {outcome['accident_id']} updated with impact {count} (bundle kept locally)")
+    elif outcome["accident_id"]:
+        log(f"Accident ID: {outcome['accident_id']} (photo {'uploaded' if outcome['image'] else 'NOT uploaded'}, "
+            f"bundle {'uploaded' if outcome['bundle'] else 'kept locally'})")
     else:
-        print(f"[{time.strftime('%H:%M:%S')}] [Main] Skipping photo upload because no valid accident_id was received from the server.")
+        log("ERROR: The server never accepted the report; bundle kept locally.")
+    log(f"--- Impact {count} processed ({time.monotonic() - t0:.1f}s after trigger) ---")
+    outcome["impact_count"] = count
+    return outcome
+
+
+def main(max_incidents=MAX_INCIDENTS):
+    metrics.serve()
+
+    log("--- System Ignition ---")
+    log("Starting Arduino data readers (Thread-1)...")
+    seat_status.start()
+    accident_bundle.start()
+    calibration.start()
+    start_reader_threads()
+    warm = warmup()
+
+    log("Waiting for initial sensor data...")
+    wait_for_seat_data()
+    log("Initial sensor data received.")
+
+    # No calibration prompt: calibration.py re-applies the stored scales on handshake and
+    # re-tares seats in the background whenever they sit empty with a drifted reading.
+
+    # Armed before the first age check: the watch stays subscribed from here on, and impacts
+    # during an age check or an incident are queued, not lost.
+    accident_flag.start()
+    armed_s = time.monotonic() - BOOT_T0
+    _M_ARMED_S.set(armed_s)
+    log(f"=== SYSTEM ARMED === ({armed_s:.1f}s after start)")
+    # The age check follows occupancy: it re-runs whenever the seats' weight occupancy differs
+    # from the one it last ran on (a new trip, someone got in or out), before the first
+    # incident too, so people who sit down after boot are not left with the boot check's
+    # "empty" codes. A check whose occupancy changed mid-run is restarted.
+    check = AgeCheck(seat_status.get_occupancy(), wait_for=warm)
+    ages, aged_occupancy = PROVISIONAL_AGES, None   # aged_occupancy: what the last finished check saw
+
+    def follow_occupancy():
+        nonlocal check, ages, aged_occupancy
+        occupancy = seat_status.get_occupancy()
+        if check is not None and (check.done() or check.occupancy != occupancy):
+            ages, _ = check.result()
+            # A failed run is not retried until occupancy changes; a superseded one is.
+            aged_occupancy = None if check.stop_event.is_set() else check.occupancy
+            check = None
+        if check is None and occupancy != aged_occupancy:
+            check = AgeCheck(occupancy, wait_for=warm)
+
+    incidents = 0
+    pending = None
+    while max_incidents is None or incidents < max_incidents:
+        if pending is None:
+            if incidents:
+                log("=== SYSTEM ARMED ===")
+            log("Waiting for accident trigger...")
+            while pending is None:
+                follow_occupancy()
+                pending = accident_flag.next_trigger(timeout_s=IDLE_POLL_S)
+        t0, _, trigger_data = pending
+        pending = None
+        incidents += 1
+        if check is not None:
+            ages, _ = check.result()
+            aged_occupancy = None if check.stop_event.is_set() else check.occupancy
+            check = None
+
+        print()
+        log(f"!!! === ACCIDENT DETECTED (incident {incidents}) === !!!")
+        incident, last_impact = None, t0
+        while True:
+            try:
+                incident = handle_impact(trigger_data, t0, ages, incident)
+            except Exception as e:   # never leave the car unwatched because one incident failed
+                log(f"ERROR: Incident handling failed: {e}")
+            # Secondary impacts: triggers within INCIDENT_LINK_S of the last impact of this
+            # accident (queued while it was being handled, or still to come).
+            more = max_incidents is None or incidents < max_incidents
+            wait = max(0.0, last_impact + INCIDENT_LINK_S - time.monotonic()) if more else 0.0
+            item = accident_flag.next_trigger(timeout_s=wait)
+            if item is None:
+                break
+            if item[0] - last_impact > INCIDENT_LINK_S:
+                pending = item   # a new accident after all
+                break
+            t0, _, trigger_data = item
+            last_impact = t0
+            print()
+            log(f"!!! === SECONDARY IMPACT ({(incident or {}).get('accident_id') or 'no accident id'}) === !!!")
+
+        log(f"--- Incident {incidents} closed ---")
 
-    print(f"\n[{time.strftime('%H:%M:%S')}] [Main] --- Processing Complete ---")
+    accident_flag.stop()
+    import warm_camera
+    warm_camera.release_all()
+    print()
+    log("--- Processing Complete ---")
 
 if __name__ == "__main__":
     print("="*50)
@@ -136,9 +261,10 @@ if __name__ == "__main__":
     print(f"INFO: Attempting to send data to {SERVER_BASE_URL}")
     if SERVER_BASE_URL == "http://127.0.0.1:5000":
         print("WARNING: SERVER_BASE_URL is localhost. Ensure server is running locally or change the URL.")
-    print("INFO: Age/Seat check runs only ONCE after user prompt.")
-    print("INFO: Weight calibration will occur first.")
+    once = "--once" in sys.argv
+    print("INFO: Handling ONE accident, then exiting." if once else
+          f"INFO: Supervisor mode: re-arms after every accident; impacts within {INCIDENT_LINK_S:.0f}s are linked.")
+    print("INFO: Age/Seat check re-runs whenever weight occupancy changes between incidents.")
     print("="*50)
-    time.sleep(3)
 
-    main()
+    main(max_incidents=1 if once else MAX_INCIDENTS)
@@ -0,0 +1,200 @@
+# metrics.py
+# Lightweight counters / gauges / histograms / timers for the hot paths, a Prometheus
+# text exporter, and one log() helper that prints either the usual "[HH:MM:SS] [Module] msg"
+# line or a structured JSON line.
+#
+# Disabled by default: every factory then returns one shared no-op object, so an
+# instrumented call costs a single method call. Turn on before the modules are imported:
+#   RESQ_METRICS=1 RESQ_METRICS_PORT=9108 RESQ_JSON_LOGS=1 python main.py
+
+import os, sys, json, time, threading
+from typing import Dict, Any, Optional, Tuple
+
+ENABLED = os.environ.get("RESQ_METRICS", "0") == "1"
+JSON_LOGS = os.environ.get("RESQ_JSON_LOGS", "0") == "1"
+METRICS_PORT = int(os.environ.get("RESQ_METRICS_PORT", "9108"))
+
+# Milliseconds; covers a 1 ms parse up to a 10 s vision pass.
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_registry: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Any] = {}
+_help: Dict[str, Tuple[str, str]] = {}   # name -> (type, help)
+_registry_lock = threading.Lock()
+
+
+class _Noop:
+    __slots__ = ()
+    def inc(self, n=1): pass
+    def dec(self, n=1): pass
+    def set(self, v): pass
+    def observe(self, v): pass
+    def time(self): return self
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+NOOP = _Noop()
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+class Gauge:
+    __slots__ = ("value",)
+    def __init__(self):
+        self.value = 0.0
+    def set(self, v):
+        self.value = float(v)
+    def inc(self, n=1):
+        self.value += n
+    def dec(self, n=1):
+        self.value -= n
+
+
+class _Timer:
+    __slots__ = ("hist", "t0")
+    def __init__(self, hist):
+        self.hist = hist
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        self.hist.observe((time.perf_counter() - self.t0) * 1000.0)
+        return False
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+    def observe(self, v):
+        i = 0
+        for b in self.buckets:
+            if v <= b: break
+            i += 1
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+    def time(self):
+        """with hist.time(): ...  -> observes elapsed milliseconds."""
+        return _Timer(self)
+
+
+def _get(kind, cls, name, help_text, labels, *args):
+    if not ENABLED:
+        return NOOP
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _registry_lock:
+        m = _registry.get(key)
+        if m is None:
+            m = _registry[key] = cls(*args)
+            _help.setdefault(name, (kind, help_text))
+        return m
+
+
+def counter(name: str, help_text: str = "", **labels) -> Counter:
+    return _get("counter", Counter, name, help_text, labels)
+
+
+def gauge(name: str, help_text: str = "", **labels) -> Gauge:
+    return _get("gauge", Gauge, name, help_text, labels)
+
+
+def histogram(name: str, help_text: str = "", buckets=DEFAULT_BUCKETS_MS, **labels) -> Histogram:
+    return _get("histogram", Histogram, name, help_text, labels, buckets)
+
+
+# ---------- export ----------
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    with _registry_lock:
+        items = sorted(_registry.items(), key=lambda kv: kv[0])
+    lines, seen = [], set()
+    for (name, labels), m in items:
+        kind, help_text = _help[name]
+        if name not in seen:
+            seen.add(name)
+            if help_text: lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        if isinstance(m, Histogram):
+            cum = 0
+            for b, c in zip(m.buckets, m.counts):
+                cum += c
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', b)])} {cum}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {m.count}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {m.sum}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {m.count}")
+        else:
+            lines.append(f"{name}{_fmt_labels(labels)} {m.value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port: int = METRICS_PORT, host: str = "0.0.0.0") -> Optional[threading.Thread]:
+    """Serves GET /metrics on a daemon thread (Pi side; server14 exposes its own /metrics)."""
+    if not ENABLED:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args): pass
+
+    try:
+        srv = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"[metrics] Could not bind :{port}: {e}")
+        return None
+    t = threading.Thread(target=srv.serve_forever, name="metrics-http", daemon=True)
+    t.start()
+    log("metrics", f"Prometheus endpoint on :{port}/metrics")
+    return t
+
+
+# ---------- logging ----------
+
+_clock_sec = -1
+_clock_str = ""
+
+def _clock() -> str:
+    # strftime once per second instead of once per line
+    global _clock_sec, _clock_str
+    now = int(time.time())
+    if now != _clock_sec:
+        _clock_sec, _clock_str = now, time.strftime("%H:%M:%S", time.localtime(now))
+    return _clock_str
+
+
+def log(component: str, msg: str, **fields):
+    """'[HH:MM:SS] [component] msg', or one JSON object per line when JSON_LOGS is set."""
+    if JSON_LOGS:
+        sys.stdout.write(json.dumps({"ts": round(time.time(), 3), "component": component,
+                                     "msg": msg, **fields}, default=str) + "\n")
+        sys.stdout.flush()
+    else:
+        print(f"[{_clock()}] [{component}] {msg}")
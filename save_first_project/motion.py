@@ -4,14 +4,27 @@ import cv2
 import numpy as np
 import time
 import platform
+import metrics
+import profiling
+import seat_regions
+import motion_engines
 
+CAM_INDEX = 0
 WIDTH, HEIGHT = 640, 480
 BLUR_KSIZE = (5, 5)
-DIFF_THRESH = 25
-DILATE_ITERS = 2
-MOTION_RATIO = 0.05
+MOTION_ENGINE = "diff"   # "diff" | "sparse" | "dense" | "auto" (best tier that fits the CPU budget), see motion_engines.py
 RUN_DURATION = 10.0
 WARMUP_SECONDS = 2.0
+SHOW_WINDOW = True  # False for headless runs (replay / benchmarks)
+SEATS = ("S1", "S2", "S3", "S4")
+UC_CONSCIOUS, UC_UNCONSCIOUS = 0, 1
+
+_M_FRAMES = metrics.counter("vision_frames_total", "Frames read from the camera", module="motion")
+_M_FRAME_MS = metrics.histogram("vision_frame_ms", "Full loop time per frame", module="motion")
+
+# Changed-pixel ratio per detection frame from the last in-process run, for accident_bundle.py:
+# {"t": [epoch s], "ratio": [[S1, S2, S3, S4]]}. Runs inside vision_pool workers do not fill it.
+last_series = {"t": [], "ratio": []}
 
 def open_camera(index=0):
     system = platform.system().lower()
@@ -28,114 +41,173 @@ def open_camera(index=0):
         cap = cv2.VideoCapture(index)
     return cap
 
-def motion_result():
-    cap = open_camera(0)
+def show_frame(window_name, vis):
+    """imshow + waitKey. Returns the pressed key, or -1 when SHOW_WINDOW is off (headless runs)."""
+    if not SHOW_WINDOW: return -1
+    cv2.imshow(window_name, vis)
+    return cv2.waitKey(1) & 0xFF
+
+def _occupied_mask(occupied):
+    """{seat: truthy} or an (S1, S2, S3, S4) sequence -> set of seats to analyse (None = all)."""
+    if occupied is None:
+        return set(SEATS)
+    if isinstance(occupied, dict):
+        return {seat for seat in SEATS if occupied.get(seat, True)}
+    return {seat for seat, occ in zip(SEATS, occupied) if occ}
+
+def iter_motion(occupied=None, cam_index=CAM_INDEX, profile=None, engine=None):
+    """
+    Yields (seat, uc) as soon as each seat is decided: 0 (conscious) on the first frame with
+    movement in its quadrant, 1 (unconscious) for seats still static when RUN_DURATION ends.
+    occupied: {seat: bool} or an (S1, S2, S3, S4) tuple; empty seats are neither analysed nor
+    yielded. The camera is released as soon as every occupied seat is decided (or the caller
+    stops iterating). engine overrides MOTION_ENGINE for this run.
+    profile=True (or RESQ_PROFILE=1) prints a per-frame stage breakdown at the end.
+    """
+    global last_series
+    last_series = {"t": [], "ratio": []}
+    pending = _occupied_mask(occupied)
+    if not pending:
+        metrics.log("motion.py", "No occupied seats; skipping motion check.")
+        return
+
+    cap = open_camera(cam_index)
     if not cap.isOpened():
-        print("[motion.py WARN] Failed to open camera.")
-        return (1, 1, 1, 1)
+        print(f"[motion.py WARN] Failed to open camera {cam_index}.")
+        for seat in SEATS:
+            if seat in pending: yield seat, UC_UNCONSCIOUS
+        return
 
-    prev_gray = None
-    motion_ever_detected = [False, False, False, False]
-    labels = ["S4", "S3", "S2", "S1"]
-
-    mid_x, mid_y = WIDTH // 2, HEIGHT // 2
-    rois = [
-        (0, 0, mid_x, mid_y), (mid_x, 0, WIDTH, mid_y),
-        (0, mid_y, mid_x, HEIGHT), (mid_x, mid_y, WIDTH, HEIGHT),
-    ]
+    engine = motion_engines.make_engine(engine or MOTION_ENGINE, WIDTH, HEIGHT)
+    moved = set()
+    streak = dict.fromkeys(SEATS, 0)
+    boxes = seat_regions.to_pixels(WIDTH, HEIGHT)
+    window_name = "Motion Check" if cam_index == CAM_INDEX else f"Motion Check (cam {cam_index})"
 
     script_start_time = time.monotonic()
     detection_start_time = None
+    prof = profiling.frame_profiler(f"motion.py cam {cam_index}", profiling.MOTION_STAGES, profile)
 
-    print(f"[{time.strftime('%H:%M:%S')}] Motion Check module starting: {WARMUP_SECONDS}s stabilization...")
-
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            print("[motion.py WARN] Failed to read frame.")
-            break
-
-        frame = cv2.resize(frame, (WIDTH, HEIGHT))
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, BLUR_KSIZE, 0)
-        now = time.monotonic()
-
-        vis = frame.copy()
-
-        if detection_start_time is None:
-            if (now - script_start_time) < WARMUP_SECONDS:
-                prev_gray = gray
-
-                warmup_text = f"Stabilizing... {now - script_start_time:.1f}s"
-                cv2.putText(vis, warmup_text, (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-                time.sleep(0.01)
-                continue
-            else:
-                print(f"[{time.strftime('%H:%M:%S')}] Stabilization complete. Starting {RUN_DURATION}s detection.")
-                detection_start_time = now
-                prev_gray = gray
-
-        elapsed = now - detection_start_time
-
-        diff = cv2.absdiff(prev_gray, gray)
-        _, mask = cv2.threshold(diff, DIFF_THRESH, 255, cv2.THRESH_BINARY)
-        mask = cv2.dilate(mask, None, iterations=DILATE_ITERS)
-
-        for i, (x1, y1, x2, y2) in enumerate(rois):
-            roi_mask = mask[y1:y2, x1:x2]
-            area = roi_mask.size
-            if area > 0:
-                white = cv2.countNonZero(roi_mask)
-                motion_pct = white / float(area)
-            else:
-                motion_pct = 0
-
-            if motion_pct >= MOTION_RATIO:
-                motion_ever_detected[i] = True
+    metrics.log("motion.py", f"Motion Check module starting ({engine.name} engine): {WARMUP_SECONDS}s stabilization "
+                             f"(seats: {', '.join(s for s in SEATS if s in pending)})...")
 
-        cv2.line(vis, (mid_x, 0), (mid_x, HEIGHT), (0, 255, 255), 2)
-        cv2.line(vis, (0, mid_y), (WIDTH, mid_y), (0, 255, 255), 2)
-
-        for i, (x1, y1, x2, y2) in enumerate(rois):
-            cv2.putText(vis, labels[i], (x1 + 10, y1 + 25), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
-            status_text = "MOVED" if motion_ever_detected[i] else "STATIC"
-            color = (0, 255, 0) if motion_ever_detected[i] else (0, 0, 255)
-            cv2.putText(vis, status_text, (x1 + 10, y1 + 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-
-        timer_text = f"DETECTING: {elapsed:.1f}s / {RUN_DURATION:.1f}s"
-        cv2.putText(vis, timer_text, (10, HEIGHT - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-        cv2.imshow("Motion Check", vis)
-
-        prev_gray = gray
-
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            print("[WARN] User manually quit")
-            break
-
-        if elapsed >= RUN_DURATION:
-            print(f"[{time.strftime('%H:%M:%S')}] {RUN_DURATION}s detection complete.")
-            break
-
-    cap.release()
     try:
-        cv2.destroyWindow("Motion Check")
-    except cv2.error:
-        pass
-
-    S4_UC = int(not motion_ever_detected[0])
-    S3_UC = int(not motion_ever_detected[1])
-    S2_UC = int(not motion_ever_detected[2])
-    S1_UC = int(not motion_ever_detected[3])
-
-    return (S1_UC, S2_UC, S3_UC, S4_UC)
+        while True:
+            t_frame = time.perf_counter()
+            prof.start_frame()
+            ok, frame = cap.read()
+            if not ok:
+                print("[motion.py WARN] Failed to read frame.")
+                break
+            _M_FRAMES.inc()
+            prof.mark("capture")
+
+            frame = cv2.resize(frame, (WIDTH, HEIGHT))
+            prof.mark("resize")
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            gray = cv2.GaussianBlur(gray, BLUR_KSIZE, 0)
+            now = time.monotonic()
+            prof.mark("color")
+
+            vis = frame.copy() if SHOW_WINDOW else None
+            prof.mark("draw")
+
+            if detection_start_time is None:
+                if (now - script_start_time) < WARMUP_SECONDS:
+
+                    if vis is not None:
+                        warmup_text = f"Stabilizing... {now - script_start_time:.1f}s"
+                        cv2.putText(vis, warmup_text, (10, 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+                    time.sleep(0.01)
+                    continue
+                else:
+                    metrics.log("motion.py", f"Stabilization complete. Starting {RUN_DURATION}s detection.")
+                    detection_start_time = now
+                    engine.reset(gray)
+                    continue
+
+            elapsed = now - detection_start_time
+
+            # Only seats still undecided are scored; a seat moves once its score has held
+            # for engine.persist frames.
+            scores = engine.update(gray, [seat for seat in SEATS if seat in pending])
+            decided = []
+            for seat, score in scores.items():
+                streak[seat] = streak[seat] + 1 if score >= engine.threshold else 0
+                if streak[seat] >= engine.persist:
+                    moved.add(seat)
+                    decided.append(seat)
+            last_series["t"].append(time.time())
+            last_series["ratio"].append([scores.get(seat, 0.0) for seat in SEATS])
+            prof.mark("detect")
+
+            if vis is not None:
+                for seat, (x1, y1, x2, y2) in boxes.items():
+                    cv2.rectangle(vis, (x1, y1), (x2 - 1, y2 - 1), (0, 255, 255), 1)
+                    cv2.putText(vis, seat, (x1 + 10, y1 + 25), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+                    if seat not in pending and seat not in moved:
+                        status_text, color = "EMPTY", (160, 160, 160)
+                    elif seat in moved:
+                        status_text, color = "MOVED", (0, 255, 0)
+                    else:
+                        status_text, color = "STATIC", (0, 0, 255)
+                    cv2.putText(vis, status_text, (x1 + 10, y1 + 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                cv2.putText(vis, engine.name, (WIDTH - 90, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+
+                timer_text = f"DETECTING: {elapsed:.1f}s / {RUN_DURATION:.1f}s"
+                cv2.putText(vis, timer_text, (10, HEIGHT - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+            prof.mark("draw")
+            key = show_frame(window_name, vis)
+            prof.mark("display")
+            prof.end_frame()
+            _M_FRAME_MS.observe((time.perf_counter() - t_frame) * 1000.0)
+
+            for seat in decided:
+                pending.discard(seat)
+                yield seat, UC_CONSCIOUS
+
+            if key == ord('q'):
+                print("[WARN] User manually quit")
+                break
+
+            if not pending:
+                metrics.log("motion.py", f"All occupied seats moved after {elapsed:.1f}s. Ending early.")
+                break
+
+            if elapsed >= RUN_DURATION:
+                metrics.log("motion.py", f"{RUN_DURATION}s detection complete.")
+                break
+    finally:
+        cap.release()
+        try:
+            cv2.destroyWindow(window_name)
+        except cv2.error:
+            pass
+        prof.report()
+
+    for seat in SEATS:
+        if seat in pending:
+            yield seat, UC_UNCONSCIOUS
+
+def motion_result(cam_index=CAM_INDEX, profile=None, occupied=None, on_result=None):
+    """
+    Blocking wrapper around iter_motion(): (S1_UC, S2_UC, S3_UC, S4_UC).
+    on_result(seat, uc) is called the moment each seat is decided. Seats skipped by the
+    occupied mask report UC_UNCONSCIOUS, the same default as a failed camera.
+    """
+    results = dict.fromkeys(SEATS, UC_UNCONSCIOUS)
+    for seat, uc in iter_motion(occupied, cam_index, profile):
+        results[seat] = uc
+        if on_result is not None:
+            on_result(seat, uc)
+    return tuple(results[seat] for seat in SEATS)
 
 if __name__ == "__main__":
     print("Running motion.py directly (Test Mode)")
-    s1, s2, s3, s4 = motion_result()
+    s1, s2, s3, s4 = motion_result(on_result=lambda seat, uc: print(f"[motion.py] {seat} decided: UC={uc}"))
     print("\n--- Motion Analysis Final Results (0=Conscious, 1=Unconscious) ---")
     print(f"S1_UC: {s1}")
     print(f"S2_UC: {s2}")
@@ -0,0 +1,381 @@
+# motion_engines.py
+# Per-seat movement scoring for motion.py, in three cost tiers:
+#   diff    frame difference + threshold + dilate over each seat region (the original check)
+#   sparse  Lucas-Kanade flow of corner features tracked inside each seat region
+#   dense   Farneback flow on a downscaled frame, fraction of moving pixels per seat region
+# The flow tiers subtract the frame's median flow, which cancels camera shake. They ignore
+# uniform brightness changes (lighting flicker), and they trim REGION_MARGIN off every region
+# edge so a neighbour leaning across a boundary does not count. A seat only "moves" once
+# its score has stayed above the threshold for `persist` frames in a row, which rejects
+# airbag dust drifting through.
+# motion.MOTION_ENGINE stays "diff" by default. "auto" picks the most accurate tier whose measured
+# cost per frame fits the CPU budget; main.py makes that choice during boot warmup (select_tier)
+# and every later run reuses it, so nothing is calibrated after a crash.
+#
+#   python motion_engines.py bench --synth               # fps + accuracy per tier on generated clips
+#   python motion_engines.py bench clips/*.mp4 --labels labels.json
+#   python motion_engines.py select                       # which tier "auto" picks on this machine
+
+import os, json, time, argparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import seat_regions
+
+TIERS = ("diff", "sparse", "dense")   # cheapest first
+FRAME_BUDGET_MS = 33.0                # one frame at 30 fps ...
+CPU_SHARE = 0.5                       # ... of which motion analysis may use this share
+MIN_HEADROOM = 0.25                   # budget floor when the machine is already loaded
+
+# diff (unchanged from motion.py)
+DIFF_THRESH = 25
+DILATE_ITERS = 2
+MOTION_RATIO = 0.05
+
+# flow tiers
+REGION_MARGIN = 0.12                  # fraction of each region cut from every side
+SPARSE_WIDTH = 320                    # working resolution
+SPARSE_MAX_CORNERS = 40               # per seat
+SPARSE_REDETECT_FRAMES = 15
+SPARSE_MIN_PX = 0.8                   # residual displacement counted as movement (working px)
+SPARSE_RATIO = 0.2                    # fraction of a seat's tracked points that must move
+DENSE_WIDTH = 160
+DENSE_MIN_PX = 0.35
+DENSE_RATIO = 0.25                    # of the region's textured pixels
+DENSE_TEXTURE_GRAD = 40.0             # Sobel magnitude of the pixels flow is trusted on
+DENSE_MIN_TEXTURED = 20               # fewer textured pixels in a region -> score 0
+FLOW_PERSIST_FRAMES = 2
+DUST_KSIZE = 5                        # median filter at working resolution; erases specks smaller than this
+
+
+class DiffEngine:
+    """Changed-pixel ratio per region. score >= threshold means movement in this frame."""
+    name = "diff"
+    threshold = MOTION_RATIO
+    persist = 1
+
+    def __init__(self, width: int, height: int, regions=None):
+        self.boxes = seat_regions.to_pixels(width, height, 0.0, regions)
+        self.prev = None
+
+    def reset(self, gray: np.ndarray):
+        self.prev = gray
+
+    def update(self, gray: np.ndarray, seats: Iterable[str]) -> Dict[str, float]:
+        diff = cv2.absdiff(self.prev, gray)
+        self.prev = gray
+        _, mask = cv2.threshold(diff, DIFF_THRESH, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=DILATE_ITERS)
+        scores = {}
+        for seat in seats:
+            x1, y1, x2, y2 = self.boxes[seat]
+            roi = mask[y1:y2, x1:x2]
+            scores[seat] = cv2.countNonZero(roi) / float(roi.size) if roi.size else 0.0
+        return scores
+
+
+def _flow_input(gray: np.ndarray, width: int) -> np.ndarray:
+    """Downscale, median-filter away dust specks and normalise brightness (lighting flicker)."""
+    h, w = gray.shape[:2]
+    if w != width:
+        gray = cv2.resize(gray, (width, int(round(h * width / float(w)))), interpolation=cv2.INTER_AREA)
+    gray = cv2.medianBlur(gray, DUST_KSIZE)
+    mean, std = cv2.meanStdDev(gray)   # not min/max: a few bright specks would rescale the whole frame
+    alpha = 48.0 / max(float(std[0, 0]), 1.0)
+    return cv2.convertScaleAbs(gray, alpha=alpha, beta=128.0 - alpha * float(mean[0, 0]))
+
+
+class SparseFlowEngine:
+    """Fraction of each seat's tracked corners whose motion differs from the frame's median."""
+    name = "sparse"
+    threshold = SPARSE_RATIO
+    persist = FLOW_PERSIST_FRAMES
+
+    def __init__(self, width: int, height: int, regions=None):
+        self.sw = SPARSE_WIDTH
+        self.sh = int(round(height * SPARSE_WIDTH / float(width)))
+        self.boxes = seat_regions.to_pixels(self.sw, self.sh, REGION_MARGIN, regions)
+        self.prev = None
+        self.points: Dict[str, np.ndarray] = {}
+        self.age = 0
+
+    def _detect(self, small: np.ndarray, seats: Iterable[str]):
+        for seat in seats:
+            x1, y1, x2, y2 = self.boxes[seat]
+            pts = cv2.goodFeaturesToTrack(small[y1:y2, x1:x2], SPARSE_MAX_CORNERS, 0.01, 5)
+            self.points[seat] = (pts.reshape(-1, 2) + (x1, y1)).astype(np.float32) if pts is not None \
+                else np.empty((0, 2), np.float32)
+        self.age = 0
+
+    def reset(self, gray: np.ndarray):
+        self.prev = _flow_input(gray, self.sw)
+        self.points = {}
+
+    def update(self, gray: np.ndarray, seats: Iterable[str]) -> Dict[str, float]:
+        seats = list(seats)
+        small = _flow_input(gray, self.sw)
+        if (self.age >= SPARSE_REDETECT_FRAMES or any(s not in self.points for s in seats)
+                or any(len(self.points[s]) < SPARSE_MAX_CORNERS // 4 for s in seats)):
+            self._detect(self.prev, seats)
+        self.age += 1
+
+        counts = [len(self.points[s]) for s in seats]
+        scores = dict.fromkeys(seats, 0.0)
+        if sum(counts):
+            p0 = np.concatenate([self.points[s] for s in seats]).reshape(-1, 1, 2)
+            p1, st, _ = cv2.calcOpticalFlowPyrLK(self.prev, small, p0, None, winSize=(15, 15), maxLevel=2)
+            ok = st.reshape(-1) == 1
+            d = (p1 - p0).reshape(-1, 2)
+            residual = np.linalg.norm(d - (np.median(d[ok], axis=0) if ok.any() else 0.0), axis=1)
+            moving = ok & (residual > SPARSE_MIN_PX)
+            start = 0
+            for seat, n in zip(seats, counts):
+                sl = slice(start, start + n)
+                tracked = int(ok[sl].sum())
+                scores[seat] = float(moving[sl].sum()) / tracked if tracked else 0.0
+                self.points[seat] = p1.reshape(-1, 2)[sl][ok[sl]]
+                start += n
+        self.prev = small
+        return scores
+
+
+class DenseFlowEngine:
+    """Fraction of each seat region's pixels whose Farneback flow differs from the frame's median."""
+    name = "dense"
+    threshold = DENSE_RATIO
+    persist = FLOW_PERSIST_FRAMES
+
+    def __init__(self, width: int, height: int, regions=None):
+        self.dw = DENSE_WIDTH
+        self.dh = int(round(height * DENSE_WIDTH / float(width)))
+        self.boxes = seat_regions.to_pixels(self.dw, self.dh, REGION_MARGIN, regions)
+        self.prev = None
+
+    def reset(self, gray: np.ndarray):
+        self.prev = _flow_input(gray, self.dw)
+
+    def update(self, gray: np.ndarray, seats: Iterable[str]) -> Dict[str, float]:
+        small = _flow_input(gray, self.dw)
+        flow = cv2.calcOpticalFlowFarneback(self.prev, small, None, 0.5, 2, 9, 2, 5, 1.1, 0)
+        # Flow is only meaningful where there is texture: flat areas report ~0 whatever happens,
+        # so both the camera-shake estimate and the per-seat score use textured pixels only.
+        gx, gy = cv2.Sobel(self.prev, cv2.CV_32F, 1, 0), cv2.Sobel(self.prev, cv2.CV_32F, 0, 1)
+        textured = cv2.magnitude(gx, gy) > DENSE_TEXTURE_GRAD
+        self.prev = small
+        sample = flow[textured] if textured.sum() >= 100 else flow.reshape(-1, 2)
+        flow -= np.median(sample, axis=0)
+        moving = (cv2.magnitude(flow[..., 0], flow[..., 1]) > DENSE_MIN_PX) & textured
+        scores = {}
+        for seat in seats:
+            x1, y1, x2, y2 = self.boxes[seat]
+            n = int(textured[y1:y2, x1:x2].sum())
+            scores[seat] = float(moving[y1:y2, x1:x2].sum()) / n if n >= DENSE_MIN_TEXTURED else 0.0
+        return scores
+
+
+ENGINES = {"diff": DiffEngine, "sparse": SparseFlowEngine, "dense": DenseFlowEngine}
+
+
+# ---------- tier selection ----------
+
+_costs_ms: Dict[Tuple[int, int], Dict[str, float]] = {}
+_selected: Dict[Tuple[int, int], str] = {}   # tier chosen by select_tier() with the live CPU budget
+
+
+def measure_costs(width: int, height: int, frames: int = 8) -> Dict[str, float]:
+    """Median ms per update() for each tier on textured, moving synthetic frames (cached)."""
+    key = (width, height)
+    if key in _costs_ms:
+        return _costs_ms[key]
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (height, width), dtype=np.uint8), (5, 5), 0)
+    seq = [np.roll(base, i, axis=1) for i in range(frames + 1)]
+    costs = {}
+    for name, cls in ENGINES.items():
+        eng = cls(width, height)
+        eng.reset(seq[0])
+        times = []
+        for g in seq[1:]:
+            t0 = time.perf_counter()
+            eng.update(g, seat_regions.SEATS)
+            times.append((time.perf_counter() - t0) * 1000.0)
+        costs[name] = sorted(times)[len(times) // 2]
+    _costs_ms[key] = costs
+    return costs
+
+
+def cpu_budget_ms() -> float:
+    try:
+        load = os.getloadavg()[0] / float(os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        load = 0.0
+    return FRAME_BUDGET_MS * CPU_SHARE * max(MIN_HEADROOM, 1.0 - load)
+
+
+def select_tier(width: int, height: int, budget_ms: Optional[float] = None, refresh: bool = False) -> str:
+    """Most accurate tier whose measured cost fits the budget; diff if none does. With the live
+    budget (budget_ms None) the choice is cached: call it while the machine is idle (boot)."""
+    key = (width, height)
+    if budget_ms is None and key in _selected and not refresh:
+        return _selected[key]
+    live = budget_ms is None
+    budget_ms = cpu_budget_ms() if live else budget_ms
+    costs = measure_costs(width, height)
+    fitting = [t for t in TIERS if costs[t] <= budget_ms]
+    tier = fitting[-1] if fitting else TIERS[0]
+    if live:
+        _selected[key] = tier
+    return tier
+
+
+def make_engine(name: str, width: int, height: int, regions=None):
+    if name == "auto":
+        # Normally chosen at boot; a process that skipped that (a vision_pool worker, a test)
+        # falls back to diff rather than calibrating while a crash is being handled.
+        name = _selected.get((width, height), TIERS[0])
+    return ENGINES[name](width, height, regions)
+
+
+# ---------- benchmark ----------
+
+def _prep(frame: np.ndarray, width: int, height: int) -> np.ndarray:
+    # Same preprocessing as motion.iter_motion
+    gray = cv2.cvtColor(cv2.resize(frame, (width, height)), cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
+def run_clip(frames: Sequence[np.ndarray], tier: str, width: int = 640, height: int = 480,
+             seats: Sequence[str] = seat_regions.SEATS) -> Tuple[Dict[str, int], float, int]:
+    """Runs one tier over preprocessed gray frames. Returns ({seat: uc}, engine seconds, frames)."""
+    eng = ENGINES[tier](width, height)
+    eng.reset(frames[0])
+    streak = dict.fromkeys(seats, 0)
+    moved = set()
+    elapsed = 0.0
+    for g in frames[1:]:
+        t0 = time.perf_counter()
+        scores = eng.update(g, [s for s in seats if s not in moved])
+        elapsed += time.perf_counter() - t0
+        for seat, score in scores.items():
+            streak[seat] = streak[seat] + 1 if score >= eng.threshold else 0
+            if streak[seat] >= eng.persist:
+                moved.add(seat)
+    return {s: int(s not in moved) for s in seats}, elapsed, len(frames) - 1
+
+
+def synth_clips(seconds: float = 3.0, fps: int = 15, width: int = 640, height: int = 480,
+                seed: int = 0) -> List[Tuple[str, List[np.ndarray], Dict[str, int]]]:
+    """Labelled cabin clips: one textured occupant per seat plus a distractor per clip.
+    Labels are the expected UC per seat (0 = moved/conscious)."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * fps)
+    base = cv2.GaussianBlur(rng.integers(30, 90, (height, width, 3), dtype=np.uint8), (3, 3), 0)
+    patch = rng.integers(60, 255, (90, 70, 3), dtype=np.uint8)
+    boxes = seat_regions.to_pixels(width, height)
+    centres = {s: ((x1 + x2) // 2, (y1 + y2) // 2) for s, (x1, y1, x2, y2) in boxes.items()}
+
+    def draw(offsets: Dict[str, Tuple[int, int]], gain: float = 1.0, specks=()):
+        img = base.copy()
+        for seat, (cx, cy) in centres.items():
+            dx, dy = offsets.get(seat, (0, 0))
+            x, y = cx - 35 + dx, cy - 45 + dy
+            img[y:y + 90, x:x + 70] = patch
+        if gain != 1.0:
+            img = cv2.convertScaleAbs(img, alpha=gain)
+        for (sx, sy) in specks:
+            cv2.circle(img, (int(sx), int(sy)), 1, (235, 235, 235), -1)
+        return img
+
+    clips = []
+    # 1. S1 shifts a little (a hand, a head turn), everyone else still
+    clips.append(("s1_moves", [draw({"S1": (int(round(4 * np.sin(i / 2.0))), 0)}) for i in range(n)],
+                  {"S1": 0, "S2": 1, "S3": 1, "S4": 1}))
+    # 2. lighting flicker, nobody moves
+    clips.append(("flicker", [draw({}, gain=1.0 + 0.25 * np.sin(i * 1.7)) for i in range(n)],
+                  {"S1": 1, "S2": 1, "S3": 1, "S4": 1}))
+    # 3. airbag dust drifting through every seat, nobody moves
+    specks = rng.uniform((0, 0), (width, height), (120, 2))
+    vel = rng.uniform(-12, 12, (120, 2))
+    dust = []
+    for i in range(n):
+        dust.append(draw({}, specks=specks + vel * i))
+        specks = np.where((specks + vel * i < 0) | (specks + vel * i >= (width, height)), specks - vel * i, specks)
+    clips.append(("dust", dust, {"S1": 1, "S2": 1, "S3": 1, "S4": 1}))
+    # 4. S2 occupant's arm swings up to the S1 boundary and a little past it, S1 still
+    lean = []
+    edge = boxes["S2"][2]
+    for i in range(n):
+        img = draw({})
+        x = edge - 70 + int(round(40 * abs(np.sin(i / 3.0))))   # right edge reaches 20 px into S1
+        img[centres["S1"][1] - 40:centres["S1"][1] + 40, x:x + 50] = patch[:80, :50]
+        lean.append(img)
+    clips.append(("neighbour_lean", lean, {"S1": 1, "S2": 0, "S3": 1, "S4": 1}))
+    # 5. S3 and S4 move, with a small camera shake on every frame
+    shake = []
+    for i in range(n):
+        img = draw({"S3": (0, int(round(5 * np.sin(i / 2.0)))), "S4": (int(round(5 * np.cos(i / 2.0))), 0)})
+        m = np.float32([[1, 0, (i % 3) - 1], [0, 1, ((i // 3) % 3) - 1]])
+        shake.append(cv2.warpAffine(img, m, (width, height), borderMode=cv2.BORDER_REFLECT))
+    clips.append(("shake_s3_s4", shake, {"S1": 1, "S2": 1, "S3": 0, "S4": 0}))
+    return clips
+
+
+def load_clip(path: str, max_frames: int = 600) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = cap.read()
+        if not ok: break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def bench(clips, width: int = 640, height: int = 480, tiers: Sequence[str] = TIERS) -> Dict[str, dict]:
+    """clips: [(name, BGR frames, {seat: expected uc})]. fps counts engine time only."""
+    prepared = [(name, [_prep(f, width, height) for f in frames], labels) for name, frames, labels in clips]
+    out = {}
+    for tier in tiers:
+        correct = total = nframes = 0
+        secs = 0.0
+        per_clip = {}
+        for name, grays, labels in prepared:
+            if len(grays) < 2: continue
+            seats = [s for s in seat_regions.SEATS if s in labels]
+            verdict, elapsed, n = run_clip(grays, tier, width, height, seats)
+            ok = sum(verdict[s] == labels[s] for s in seats)
+            correct, total, nframes, secs = correct + ok, total + len(seats), nframes + n, secs + elapsed
+            per_clip[name] = {"correct": f"{ok}/{len(seats)}", "uc": verdict}
+        out[tier] = {"fps": round(nframes / secs, 1) if secs else None,
+                     "ms_per_frame": round(1000.0 * secs / nframes, 2) if nframes else None,
+                     "accuracy": round(correct / total, 3) if total else None, "clips": per_clip}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Motion engine tiers: benchmark and selection.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    bp = sub.add_parser("bench")
+    bp.add_argument("clips", nargs="*", help="recorded cabin clips (any format cv2 reads)")
+    bp.add_argument("--labels", default=None, help='JSON {"clip.mp4": {"S1": 0, "S2": 1, ...}} (0 = moved)')
+    bp.add_argument("--synth", action="store_true", help="use generated clips with distractors")
+    bp.add_argument("--seed", type=int, default=0)
+    sub.add_parser("select")
+    args = ap.parse_args()
+
+    if args.command == "select":
+        print(json.dumps({"costs_ms": measure_costs(640, 480), "budget_ms": round(cpu_budget_ms(), 2),
+                          "tier": select_tier(640, 480)}, indent=2))
+        return
+    if args.synth or not args.clips:
+        clips = synth_clips(seed=args.seed)
+    else:
+        labels = json.load(open(args.labels, encoding="utf-8")) if args.labels else {}
+        clips = [(p, load_clip(p), labels.get(p) or labels.get(os.path.basename(p)) or {}) for p in args.clips]
+    print(json.dumps(bench(clips), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# postcrash.py
+# Post-crash phase of main.main as a dependency graph of tasks, each on its own thread.
+# A task starts as soon as the tasks it depends on have finished (or given up), so
+# everything without a data dependency overlaps:
+#
+#   impact (pulse window) ── report_post (preliminary, UC pending) ──┬── image_upload
+#   capture (during stabilisation) ──────────────────────────────────┤
+#        └── motion (after stabilisation) ───────────────────────────┴── final_update ── bundle
+#
+# The dispatcher gets a scored report (every occupied seat counted as not-yet-conscious)
+# within about impact_score.POST_S of the trigger; /api/accident_update/<id> then replaces
+# it with the motion verdicts. Every task has a deadline measured from the trigger, and the
+# whole phase a hard deadline: a task that misses its deadline (or raises) is replaced by
+# its fallback value and the tasks after it carry on.
+#
+# A secondary impact (main.py links it to an open accident) runs the same graph with
+# accident_id set: no new report or photo, impacts are the per-seat maximum over all impacts
+# so far, motion is checked again, and the update carries impact_count.
+
+import time
+import uuid
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import requests
+
+import age
+import motion
+import capture
+import jsondata
+import metrics
+import report_schema
+import vision_pool
+import impact_score
+import accident_flag
+import accident_bundle
+import get_arduino_data
+
+HARD_DEADLINE_S = 45.0
+IMPACT_DEADLINE_S = 4.0
+REPORT_DEADLINE_S = 8.0
+IMAGE_DEADLINE_S = 25.0
+MOTION_SLACK_S = 3.0          # beyond stabilisation + motion warmup + RUN_DURATION
+UPDATE_SLACK_S = 5.0
+REPORT_TIMEOUT_S = 5
+PRELIM_JOIN_S = 2 * REPORT_TIMEOUT_S + 2.0   # final_update waits this long for a preliminary POST still in flight
+UC_PENDING = 2                # jsondata: scored like unconscious, reported as not conscious
+
+SEATS = ("S1", "S2", "S3", "S4")
+STAGES = ("impact", "capture", "report_post", "motion", "image_upload", "final_update", "bundle")
+
+_M_STAGE_MS = {stage: metrics.histogram("main_stage_ms", "Post-crash stage durations", stage=stage)
+               for stage in STAGES}
+_M_MISSES = {stage: metrics.counter("postcrash_deadline_misses_total", "Post-crash tasks that missed their deadline",
+                                    stage=stage) for stage in STAGES}
+
+
+def log(msg: str):
+    metrics.log("postcrash", msg)
+
+
+class Task:
+    __slots__ = ("name", "fn", "deps", "deadline_s", "fallback")
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 deadline_s: Optional[float] = None, fallback: Callable[[Dict[str, Any]], Any] = lambda r: None):
+        self.name, self.fn, self.deps = name, fn, tuple(deps)
+        self.deadline_s, self.fallback = deadline_s, fallback
+
+
+class TaskGraph:
+    """run() blocks until every task has a result. Each fn / fallback receives the results
+    dict so far (dependencies are always present). Late results after a deadline are ignored;
+    their threads are daemons and simply finish in the background."""
+
+    def __init__(self, tasks: Iterable[Task]):
+        self.tasks = {t.name: t for t in tasks}
+        self.results: Dict[str, Any] = {}
+        self.status: Dict[str, str] = {}            # ok | failed | timeout | skipped
+        self.timings: Dict[str, tuple] = {}         # name -> (start, end), seconds after t0
+
+    def run(self, hard_deadline_s: float = HARD_DEADLINE_S, t0: Optional[float] = None) -> Dict[str, Any]:
+        t0 = time.monotonic() if t0 is None else t0
+        done: "queue.Queue" = queue.Queue()
+        pending = list(self.tasks.values())
+        started: Dict[str, float] = {}
+
+        def finish(name, status, value):
+            self.status[name] = status
+            self.results[name] = value
+            self.timings[name] = (started.get(name, time.monotonic()) - t0, time.monotonic() - t0)
+            if status != "ok":
+                log(f"{name}: {status}, using fallback")
+            if status == "timeout" and name in _M_MISSES:
+                _M_MISSES[name].inc()
+
+        def fallback(task):
+            try:
+                return task.fallback(self.results)
+            except Exception as e:
+                log(f"{task.name}: fallback failed: {e}")
+                return None
+
+        def worker(task, snapshot):
+            try:
+                done.put((task.name, True, task.fn(snapshot)))
+            except Exception as e:
+                log(f"{task.name} failed: {e}")
+                done.put((task.name, False, None))
+
+        while True:
+            now = time.monotonic()
+            for task in [t for t in pending if all(d in self.status for d in t.deps)]:
+                pending.remove(task)
+                started[task.name] = now
+                threading.Thread(target=worker, args=(task, dict(self.results)),
+                                 name=f"postcrash-{task.name}", daemon=True).start()
+            running = [n for n in started if n not in self.status]
+            if not running and not pending:
+                break
+
+            if now - t0 >= hard_deadline_s:
+                for name in running:
+                    finish(name, "timeout", fallback(self.tasks[name]))
+                for task in pending:   # in dependency order: fallbacks may read earlier ones
+                    finish(task.name, "skipped", fallback(task))
+                break
+
+            wake = [t0 + hard_deadline_s] + [t0 + self.tasks[n].deadline_s for n in running
+                                             if self.tasks[n].deadline_s is not None]
+            try:
+                name, ok, value = done.get(timeout=max(0.0, min(wake) - now))
+            except queue.Empty:
+                now = time.monotonic()
+                for name in running:
+                    task = self.tasks[name]
+                    if task.deadline_s is not None and now - t0 >= task.deadline_s:
+                        finish(name, "timeout", fallback(task))
+                continue
+            if name in self.status:
+                continue   # already timed out
+            if ok:
+                finish(name, "ok", value)
+                a, b = self.timings[name]
+                if name in _M_STAGE_MS: _M_STAGE_MS[name].observe((b - a) * 1000.0)
+            else:
+                finish(name, "failed", fallback(self.tasks[name]))
+        return self.results
+
+
+def _wait_pulse_window(t_trigger: Optional[float], limit_s: float):
+    """Blocks until the seat history covers impact_score.POST_S after the trigger (t_trigger is
+    on the _recv_t time base) or limit_s passes. Nothing to wait for without a trigger time."""
+    if t_trigger is None: return
+    end = time.monotonic() + limit_s
+    while time.monotonic() < end:
+        hist = get_arduino_data.get_seat_history()
+        newest = max((samples[-1][0] for samples in hist.values() if samples), default=None)
+        if newest is not None and newest >= t_trigger + impact_score.POST_S:
+            return
+        time.sleep(0.05)
+
+
+def _post_report(base_url: str, path: str, seats: Dict[str, Any], key: Optional[str] = None,
+                 **meta) -> Optional[Dict[str, Any]]:
+    """POSTs a report in the most compact format the server accepts (report_schema.py).
+    key is sent as Idempotency-Key: triggers with the same key are one accident on the server."""
+    data, headers = report_schema.encode_request(base_url, seats, **meta)
+    if key: headers["Idempotency-Key"] = key
+    resp = requests.post(f"{base_url}{path}", data=data, headers=headers, timeout=REPORT_TIMEOUT_S)
+    if resp.status_code == 415:   # the server changed since we asked: ask again and resend once
+        report_schema.forget(base_url)
+        data, headers = report_schema.encode_request(base_url, seats, **meta)
+        if key: headers["Idempotency-Key"] = key
+        resp = requests.post(f"{base_url}{path}", data=data, headers=headers, timeout=REPORT_TIMEOUT_S)
+    if resp.status_code != 200:
+        log(f"ERROR: {path} returned {resp.status_code}: {resp.text}")
+        return None
+    return resp.json()
+
+
+def report(ages, uc, impacts, sits) -> Dict[str, Any]:
+    return jsondata.get_all_seats_dict(*[(ages[i], uc[i], impacts[i], sits[i]) for i in range(4)])
+
+
+def run(trigger_data: Dict[str, Any], ages, sits, occupied: Optional[Dict[str, bool]], server_base_url: str,
+        stabilise_s: float = 5.0, t0: Optional[float] = None, hard_deadline_s: float = HARD_DEADLINE_S,
+        accident_id: Optional[str] = None, prior_impacts=None, impact_count: int = 1) -> Dict[str, Any]:
+    """The whole post-crash phase. t0 is the trigger time (time.monotonic()); deadlines count
+    from it. accident_id / prior_impacts / impact_count are set for a secondary impact.
+    Returns {"report", "accident_id", "uc", "impacts", "image", "bundle", "status", "timings"}."""
+    t0 = time.monotonic() if t0 is None else t0
+    trigger = accident_flag.last_trigger   # the watch may fire again while this runs
+    t_trigger = (trigger or {}).get("t")
+    secondary = accident_id is not None
+
+    def merged(impacts):
+        if not prior_impacts: return impacts
+        return tuple(max(a, b) for a, b in zip(impacts, prior_impacts))
+    decided: Dict[str, int] = {}
+    lock = threading.Lock()
+    # The preliminary POST's own outcome. Its task timing out only means the graph stopped
+    # waiting: the request may still land, so later tasks join it instead of re-triggering.
+    prelim: Dict[str, Any] = {"id": None}
+    prelim_done = threading.Event()
+    report_key = str(uuid.uuid4())
+
+    def prelim_id(r):
+        if r["report_post"] or secondary: return r["report_post"]
+        prelim_done.wait(max(0.0, min(PRELIM_JOIN_S, t0 + hard_deadline_s - time.monotonic())))
+        return prelim["id"]
+
+    def impact(r):
+        _wait_pulse_window(t_trigger, impact_score.POST_S + 1.0)
+        return merged(impact_score.calculate_impact_scores(trigger_data, get_arduino_data.get_seat_history(), t_trigger))
+
+    def impact_fallback(r):   # pulse window never arrived: peak mode on the trigger snapshot
+        return merged(impact_score.calculate_impact_scores(trigger_data, None, t_trigger))
+
+    def report_post(r):
+        if secondary:
+            return accident_id
+        data = None
+        try:
+            body = report(ages, (UC_PENDING,) * 4, r["impact"], sits)
+            data = _post_report(server_base_url, "/api/accident_trigger", body, report_key, preliminary=True)
+        finally:
+            prelim["id"] = (data or {}).get("id")
+            prelim_done.set()
+        if prelim["id"]:
+            log(f"Server ACCEPTED preliminary report. Accident ID: {prelim['id']}")
+        return prelim["id"]
+
+    def capture_photo(r):
+        return None if secondary else capture.capture_jpeg()   # keep the first impact's photo
+
+    def motion_check(r):
+        # The camera is free once capture is done; the stabilisation wait still applies.
+        time.sleep(max(0.0, t0 + stabilise_s - time.monotonic()))
+        def on_result(seat, uc):
+            with lock: decided[seat] = uc
+            log(f"{seat}: {'conscious' if uc == motion.UC_CONSCIOUS else 'UNCONSCIOUS'}")
+        return vision_pool.motion_result(occupied, on_result=on_result)
+
+    def motion_fallback(r):   # seats already seen moving stay conscious
+        with lock:
+            return tuple(decided.get(seat, motion.UC_UNCONSCIOUS) for seat in SEATS)
+
+    def image_upload(r):
+        if not r["capture"]:
+            return False
+        target = prelim_id(r)
+        return bool(target) and capture.upload_jpeg(target, server_base_url, r["capture"])
+
+    def final_update(r):
+        body = report(ages, r["motion"], r["impact"], sits)
+        target = prelim_id(r)
+        if target:
+            path = f"/api/accident_update/{target}"
+            if _post_report(server_base_url, path, body, impact_count=impact_count) is not None:
+                return target
+            return None
+        # The preliminary POST failed or never answered: send the full report as a trigger.
+        # It carries the same Idempotency-Key, so if the preliminary one landed after all the
+        # server updates that accident instead of logging a second one.
+        data = _post_report(server_base_url, "/api/accident_trigger", body, report_key, impact_count=impact_count)
+        return (data or {}).get("id")
+
+    def bundle(r):
+        final_id = r["final_update"] or r["report_post"]
+        data = accident_bundle.build_bundle(
+            t_trigger, trigger, report(ages, r["motion"], r["impact"], sits),
+            impact_score.last_pulse_features, ages, r["motion"], motion.last_series, age.last_samples)
+        log(f"Bundle packed: {len(data) / 1024:.1f} KiB")
+        if secondary:   # the server keeps one bundle per accident: the first impact's
+            path = accident_bundle.save_local(f"{accident_id}-impact{impact_count}", data)
+            log(f"Secondary impact bundle kept at {path}")
+            return None
+        if final_id:   # spools locally itself when the upload fails
+            return final_id if accident_bundle.upload(final_id, server_base_url, data) else None
+        path = accident_bundle.save_local(time.strftime("local-%Y%m%dT%H%M%S"), data)
+        log(f"No accident_id; bundle kept at {path}")
+        return None
+
+    motion_deadline = stabilise_s + motion.WARMUP_SECONDS + motion.RUN_DURATION + MOTION_SLACK_S
+    graph = TaskGraph([
+        Task("impact", impact, deadline_s=IMPACT_DEADLINE_S, fallback=impact_fallback),
+        Task("capture", capture_photo, deadline_s=stabilise_s + 2.0),
+        Task("report_post", report_post, ("impact",), deadline_s=REPORT_DEADLINE_S),
+        Task("motion", motion_check, ("capture",), deadline_s=motion_deadline, fallback=motion_fallback),
+        Task("image_upload", image_upload, ("report_post", "capture"), deadline_s=IMAGE_DEADLINE_S,
+             fallback=lambda r: False),
+        Task("final_update", final_update, ("motion", "impact", "report_post"),
+             deadline_s=motion_deadline + UPDATE_SLACK_S),
+        Task("bundle", bundle, ("final_update",), deadline_s=hard_deadline_s),
+    ])
+    results = graph.run(hard_deadline_s, t0)
+
+    timings = {name: f"{a:.2f}-{b:.2f}s" for name, (a, b) in graph.timings.items()}
+    log(f"Post-crash tasks: {graph.status} ({timings})")
+    return {
+        "report": report(ages, results["motion"], results["impact"], sits),
+        "accident_id": results["final_update"] or results["report_post"],
+        "uc": results["motion"], "impacts": results["impact"],
+        "image": bool(results["image_upload"]), "bundle": results["bundle"],
+        "status": dict(graph.status), "timings": dict(graph.timings),
+    }
@@ -0,0 +1,184 @@
+# profiling.py
+# Opt-in profiling for the vision loops.
+#  * FrameProfiler: per-frame breakdown (capture, resize, color, detect, age, draw, display)
+#  * run_cprofile: one run under cProfile, dumped to a .prof file
+#  * SamplingProfiler: low-overhead stack sampler for one thread, written as collapsed stacks
+#    (feed to flamegraph.pl / speedscope)
+#
+#   python profiling.py age --mode frames
+#   python profiling.py motion --mode cprofile --out motion.prof
+#   python profiling.py age --mode sample --out age.folded
+#   RESQ_PROFILE=1 python main.py      # per-frame tables from every vision run
+
+import os, sys, time, threading, argparse
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+PROFILE_FRAMES = os.environ.get("RESQ_PROFILE", "0") == "1"
+MAX_FRAMES = 20000
+
+AGE_STAGES = ("capture", "resize", "color", "detect", "age", "draw", "display")
+MOTION_STAGES = ("capture", "resize", "color", "detect", "draw", "display")
+
+
+def _pct(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(round((len(sorted_vals) - 1) * p / 100.0)))]
+
+
+class _NoopProfiler:
+    __slots__ = ()
+    def start_frame(self): pass
+    def mark(self, stage): pass
+    def end_frame(self): pass
+    def report(self): pass
+
+NOOP = _NoopProfiler()
+
+
+class FrameProfiler:
+    """Call start_frame() at the top of the loop, mark(stage) after each step (time since the
+    previous mark is charged to that stage; repeated marks accumulate) and end_frame() at the end.
+    Frames abandoned with `continue` before end_frame() are simply dropped."""
+
+    def __init__(self, name: str, stages: Sequence[str]):
+        self.name = name
+        self.stages = tuple(stages)
+        self.samples: Dict[str, List[float]] = {s: [] for s in self.stages}
+        self.totals_ms: List[float] = []
+        self._cur: Dict[str, float] = {}
+        self._t0 = self._t = 0.0
+
+    def start_frame(self):
+        self._t0 = self._t = time.perf_counter()
+        self._cur = dict.fromkeys(self.stages, 0.0)
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self._cur[stage] = self._cur.get(stage, 0.0) + (now - self._t)
+        self._t = now
+
+    def end_frame(self):
+        if not self._cur or len(self.totals_ms) >= MAX_FRAMES: return
+        for stage, secs in self._cur.items():
+            self.samples.setdefault(stage, []).append(secs * 1000.0)
+        self.totals_ms.append((self._t - self._t0) * 1000.0)
+        self._cur = {}
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        total = sum(self.totals_ms) or 1.0
+        out = {}
+        for stage, vals in self.samples.items():
+            if not vals: continue
+            v = sorted(vals)
+            out[stage] = {"mean_ms": sum(v) / len(v), "p50_ms": _pct(v, 50), "p95_ms": _pct(v, 95),
+                          "share": sum(v) / total}
+        return out
+
+    def report(self):
+        n = len(self.totals_ms)
+        if not n:
+            print(f"[profiling] {self.name}: no complete frames recorded.")
+            return
+        fps = 1000.0 * n / sum(self.totals_ms)
+        print(f"[profiling] {self.name}: {n} frames, {fps:.1f} fps")
+        print(f"  {'stage':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'share':>9}")
+        for stage, st in self.summary().items():
+            print(f"  {stage:<10}{st['mean_ms']:>10.2f}{st['p50_ms']:>10.2f}{st['p95_ms']:>10.2f}{st['share']:>8.1%}")
+
+
+def frame_profiler(name: str, stages: Sequence[str], enabled: Optional[bool] = None):
+    """A FrameProfiler when enabled (or RESQ_PROFILE=1), otherwise the shared no-op."""
+    if enabled is None: enabled = PROFILE_FRAMES
+    return FrameProfiler(name, stages) if enabled else NOOP
+
+
+def run_cprofile(func, out_path: str, *args, **kwargs):
+    """Runs func once under cProfile, dumps stats to out_path and prints the top entries."""
+    import cProfile, pstats
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        prof.dump_stats(out_path)
+        print(f"[profiling] cProfile stats written to {out_path}")
+        pstats.Stats(prof).sort_stats("cumulative").print_stats(25)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every `interval` seconds from a helper thread.
+    Costs the target thread nothing beyond GIL hand-offs, so it is safe around cap.read()."""
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"[profiling] {sum(self.stacks.values())} samples written to {path}")
+
+    def top(self, n: int = 15):
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        print(f"[profiling] top {n} leaf frames ({total} samples):")
+        for leaf, count in leaves.most_common(n):
+            print(f"  {count / total:6.1%}  {leaf}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Profile one run of age_result or motion_result.")
+    ap.add_argument("target", choices=("age", "motion"))
+    ap.add_argument("--mode", choices=("frames", "cprofile", "sample"), default="frames")
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args()
+
+    if args.target == "age":
+        import age
+        func = lambda: age.age_result(profile=(args.mode == "frames"))
+    else:
+        import motion
+        func = lambda: motion.motion_result(profile=(args.mode == "frames"))
+
+    if args.mode == "frames":
+        print(f"Result: {func()}")
+    elif args.mode == "cprofile":
+        print(f"Result: {run_cprofile(func, args.out or f'{args.target}.prof')}")
+    else:
+        sampler = SamplingProfiler().start()
+        try:
+            print(f"Result: {func()}")
+        finally:
+            sampler.stop()
+        sampler.top()
+        sampler.write_collapsed(args.out or f"{args.target}.folded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# replay.py
+# Drives the pipeline without Arduinos or a webcam.
+# Recorded .ndjson weight logs (or synthetic crash profiles) are fed through
+# get_arduino_data.ingest_frame, the same entry point the serial manager uses,
+# at 1x, accelerated or max speed. Video files can stand in for the camera.
+#
+#   python replay.py synth crash.ndjson --crash-at 10 --peak-g 4
+#   python replay.py play /home/pi/weight_logs/*.ndjson --speed 10
+#   python replay.py bench --runs 20 --speed 20
+#   python replay.py main crash.ndjson --video cabin.mp4
+
+import json, math, time, heapq, random, argparse, threading
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Dict, Any, Optional, Tuple
+
+import get_arduino_data
+
+SAMPLE_HZ = 5.0   # firmware periodMs = 200
+BOARDS = {
+    "arduino_A": ("S1", "S2"),
+    "arduino_B": ("S3", "S4"),
+}
+DEFAULT_WEIGHTS = {"S1": 62.0, "S2": 0.0, "S3": 24.0, "S4": 0.0}
+# Fraction of the crash pulse each seat's MPU sees (front row closest to a frontal impact).
+DEFAULT_SEAT_GAIN = {"S1": 1.0, "S2": 0.9, "S3": 0.7, "S4": 0.65}
+CRASH_MARK = "crash"
+
+Frame = Tuple[float, Dict[str, Any]]   # (epoch seconds, frame dict)
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def _frame_time(frame: Dict[str, Any]) -> float:
+    if frame.get("_recv_t") is not None:
+        return float(frame["_recv_t"])
+    ts = frame.get("_recv_ts")
+    if ts:
+        return datetime.fromisoformat(ts.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    return float(frame.get("ts_ms", 0)) / 1000.0
+
+
+def percentile(values, p: float) -> Optional[float]:
+    if not values: return None
+    v = sorted(values)
+    k = (len(v) - 1) * (p / 100.0)
+    lo, hi = math.floor(k), math.ceil(k)
+    return v[lo] + (v[hi] - v[lo]) * (k - lo)
+
+
+# ---------- recorded logs ----------
+
+def read_ndjson(path) -> Iterable[Frame]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try: frame = json.loads(line)
+            except Exception: continue
+            yield _frame_time(frame), frame
+
+
+def load_logs(paths) -> Iterable[Frame]:
+    """Merges several per-port logs into one time-ordered stream."""
+    return heapq.merge(*(read_ndjson(p) for p in paths), key=lambda item: item[0])
+
+
+def write_ndjson(frames: Iterable[Frame], path):
+    with open(path, "w", encoding="utf-8") as f:
+        for _, frame in frames:
+            f.write(json.dumps(frame) + "\n")
+
+
+# ---------- synthetic crash profiles ----------
+
+def synth_crash_frames(duration_s: float = 20.0,
+                       crash_at_s: Optional[float] = 10.0,
+                       peak_g: float = 4.0,
+                       pulse_ms: float = 120.0,
+                       rate_hz: float = SAMPLE_HZ,
+                       weights: Optional[Dict[str, float]] = None,
+                       seat_gain: Optional[Dict[str, float]] = None,
+                       bump_rate_hz: float = 0.2,
+                       bump_g: float = 0.35,
+                       noise_g: float = 0.02,
+                       noise_kg: float = 0.3,
+                       seed: int = 0,
+                       start_ts: float = 1_700_000_000.0) -> List[Frame]:
+    """Deterministic firmware-format frames for both boards.
+    The crash is a half-sine pulse centred on crash_at_s followed by a decaying ring-down;
+    single-sample road bumps are sprinkled in to exercise false-trigger handling.
+    crash_at_s=None produces a crash-free drive. The first frame at/after the crash carries "_mark": "crash"."""
+    rng = random.Random(seed)
+    weights = weights or DEFAULT_WEIGHTS
+    seat_gain = seat_gain or DEFAULT_SEAT_GAIN
+    pulse_s = pulse_ms / 1000.0
+    period = 1.0 / rate_hz
+    frames: List[Frame] = []
+    marked = set()
+
+    def accel(seat: str, t: float) -> float:
+        g = 1.0 + rng.gauss(0.0, noise_g)
+        if crash_at_s is not None:
+            dt = t - crash_at_s
+            if abs(dt) <= pulse_s / 2:
+                g += peak_g * seat_gain.get(seat, 1.0) * math.cos(math.pi * dt / pulse_s)
+            elif pulse_s / 2 < dt < 1.5:
+                g += 0.3 * peak_g * seat_gain.get(seat, 1.0) * math.exp(-3.0 * dt) * abs(math.sin(12.0 * dt))
+        if rng.random() < bump_rate_hz / rate_hz:
+            g += bump_g * rng.uniform(0.5, 1.0)
+        return max(0.0, g)
+
+    for n in range(int(duration_s * rate_hz) + 1):
+        for b, (device_id, seats) in enumerate(BOARDS.items()):
+            t = n * period + b * 0.013          # boards are not phase-locked
+            frame: Dict[str, Any] = {"device_id": device_id, "ts_ms": int(t * 1000), "unit": "kg", "seats": []}
+            for seat in seats:
+                w = max(0.0, weights.get(seat, 0.0) + rng.gauss(0.0, noise_kg)) if weights.get(seat, 0.0) > 0 else 0.0
+                g = accel(seat, t)
+                frame["seats"].append({"name": seat, "loadCell": [round(w / 4, 3)] * 4,
+                                       "Weight": round(w, 3), "mpu_g": round(g, 4)})
+                frame[f"{seat}_Weight"] = round(w, 3)
+                frame[f"{seat}_mpu_g"] = round(g, 4)
+            frame["_recv_ts"] = _iso(start_ts + t)
+            frame["_alias"] = get_arduino_data.alias_for_device(device_id)
+            frame["_port"] = f"replay:{device_id}"
+            if crash_at_s is not None and t >= crash_at_s - pulse_s / 2 and device_id not in marked:
+                frame["_mark"] = CRASH_MARK
+                marked.add(device_id)
+            frames.append((start_ts + t, frame))
+    frames.sort(key=lambda item: item[0])
+    return frames
+
+
+# ---------- replay engine ----------
+
+class ReplaySource:
+    """Plays frames into get_arduino_data.ingest_frame in its own thread.
+    speed=1 is real time, >1 accelerated, 0 as fast as possible.
+    Install with get_arduino_data.set_source() to replace the serial manager in main.main."""
+
+    def __init__(self, frames: Iterable[Frame], speed: float = 1.0):
+        self.frames = frames
+        self.speed = speed
+        self.done = threading.Event()
+        self.marks: Dict[str, Tuple[float, float]] = {}   # mark -> (perf_counter at ingest, frame time)
+        self.count = 0
+        self.elapsed_s = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self._run, name="replay", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(2.0)
+
+    def _run(self):
+        t0 = None
+        wall0 = time.perf_counter()
+        for t, frame in self.frames:
+            if self._stop.is_set(): break
+            if t0 is None: t0 = t
+            if self.speed > 0:
+                delay = wall0 + (t - t0) / self.speed - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+            frame = dict(frame)
+            mark = frame.pop("_mark", None)
+            device_id = frame.get("device_id", "replay")
+            port = frame.get("_port") or f"replay:{device_id}"
+            alias = frame.get("_alias") or get_arduino_data.alias_for_device(device_id)
+            frame["_recv_t"] = t   # recorded time, so accelerated replay keeps the real dt
+            get_arduino_data.ingest_frame(port, alias, frame, log=False)
+            self.count += 1
+            if mark and mark not in self.marks:
+                self.marks[mark] = (time.perf_counter(), t)
+        self.elapsed_s = time.perf_counter() - wall0
+        self.done.set()
+
+
+# ---------- camera stand-in ----------
+
+class PacedVideoCapture:
+    """cv2.VideoCapture look-alike over a video file: frames arrive at the file's FPS
+    (scaled by speed, 0 = unpaced) and the clip loops, like a live camera would."""
+
+    def __init__(self, path, speed: float = 1.0, loop: bool = True):
+        import cv2
+        self._cv2 = cv2
+        self._cap = cv2.VideoCapture(str(path))
+        fps = self._cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self._period = 1.0 / (fps * speed) if speed > 0 else 0.0
+        self._next = time.perf_counter()
+        self.loop = loop
+
+    def isOpened(self): return self._cap.isOpened()
+    def set(self, prop, value): return True
+    def get(self, prop): return self._cap.get(prop)
+    def release(self): self._cap.release()
+
+    def read(self):
+        if self._period:
+            delay = self._next - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            self._next = max(self._next + self._period, time.perf_counter())
+        ok, frame = self._cap.read()
+        if not ok and self.loop:
+            self._cap.set(self._cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._cap.read()
+        return ok, frame
+
+
+def install_camera(factory: Callable[[Any], Any], headless: bool = True):
+    """Routes every vision module's open_camera() to factory(index) and turns off imshow."""
+    import importlib
+    for name in ("age", "motion", "capture"):
+        try: mod = importlib.import_module(name)
+        except ImportError as e:
+            print(f"[replay] Skipping camera hook for {name}: {e}")
+            continue
+        mod.open_camera = factory
+        if headless and hasattr(mod, "SHOW_WINDOW"):
+            mod.SHOW_WINDOW = False
+
+
+def install_video(path, speed: float = 1.0):
+    install_camera(lambda index=0: PacedVideoCapture(path, speed))
+
+
+# ---------- drivers ----------
+
+def bench_detection(runs: int = 10, speed: float = 20.0, seed: int = 0, **synth_kwargs) -> Dict[str, Any]:
+    """Replays synthetic drives through accident_flag.wait_accident_flag and reports
+    detection rate, false triggers (fired before the crash) and ingest-to-trigger latency."""
+    import accident_flag
+    rng = random.Random(seed)
+    latencies_ms, false_triggers, missed = [], 0, 0
+    for i in range(runs):
+        crash_at = round(rng.uniform(5.0, 15.0) * SAMPLE_HZ) / SAMPLE_HZ
+        frames = synth_crash_frames(crash_at_s=crash_at, seed=seed + i, **synth_kwargs)
+        get_arduino_data.reset_store()
+        src = ReplaySource(frames, speed=speed)
+        src.start()
+        duration = (frames[-1][0] - frames[0][0]) / speed if speed > 0 else 5.0
+        trigger = accident_flag.wait_accident_flag(timeout_s=duration + 1.0)
+        fired_at = time.perf_counter()
+        src.stop()
+        if trigger is None:
+            missed += 1
+        elif CRASH_MARK not in src.marks:
+            false_triggers += 1
+        else:
+            latencies_ms.append((fired_at - src.marks[CRASH_MARK][0]) * 1000.0)
+    return {
+        "runs": runs, "speed": speed,
+        "detected": len(latencies_ms), "false_triggers": false_triggers, "missed": missed,
+        "latency_ms_p50": percentile(latencies_ms, 50),
+        "latency_ms_p95": percentile(latencies_ms, 95),
+        "latency_ms_max": max(latencies_ms) if latencies_ms else None,
+    }
+
+
+def bench_ingest(n_seconds: float = 3600.0) -> Dict[str, Any]:
+    """Max-speed ingest throughput for n_seconds of synthetic driving."""
+    frames = synth_crash_frames(duration_s=n_seconds, crash_at_s=None)
+    get_arduino_data.reset_store()
+    src = ReplaySource(frames, speed=0)
+    src.start()
+    src.done.wait()
+    return {"frames": src.count, "seconds": round(src.elapsed_s, 3),
+            "frames_per_s": round(src.count / src.elapsed_s, 1) if src.elapsed_s else None}
+
+
+def run_main(frames: Iterable[Frame], speed: float = 1.0, video=None, incidents: Optional[int] = 1):
+    """Runs main.main() end to end on replayed sensor data (and a video file instead of the webcam).
+    incidents=None keeps the supervisor running after the log ends, like on the car."""
+    get_arduino_data.set_source(ReplaySource(frames, speed=speed))
+    if video:
+        install_video(video, speed=1.0)
+    import main
+    main.main(max_incidents=incidents)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay / simulation harness for ResQSEAT.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    sp = sub.add_parser("synth", help="write a synthetic crash profile as .ndjson")
+    sp.add_argument("out")
+    sp.add_argument("--duration", type=float, default=20.0)
+    sp.add_argument("--crash-at", type=float, default=10.0, help="seconds; negative for no crash")
+    sp.add_argument("--peak-g", type=float, default=4.0)
+    sp.add_argument("--pulse-ms", type=float, default=120.0)
+    sp.add_argument("--seed", type=int, default=0)
+
+    pp = sub.add_parser("play", help="replay recorded logs into the ingest path")
+    pp.add_argument("logs", nargs="+")
+    pp.add_argument("--speed", type=float, default=1.0, help="1 = real time, 0 = max speed")
+
+    bp = sub.add_parser("bench", help="detection latency and ingest throughput on synthetic drives")
+    bp.add_argument("--runs", type=int, default=10)
+    bp.add_argument("--speed", type=float, default=20.0)
+    bp.add_argument("--seed", type=int, default=0)
+
+    mp_ = sub.add_parser("main", help="run main.main() on replayed data")
+    mp_.add_argument("logs", nargs="*", help="recorded logs; a synthetic crash is used when omitted")
+    mp_.add_argument("--speed", type=float, default=1.0)
+    mp_.add_argument("--video", default=None)
+    mp_.add_argument("--incidents", type=int, default=1, help="accidents to handle before exiting (0 = run forever)")
+
+    args = ap.parse_args()
+    if args.command == "synth":
+        crash_at = args.crash_at if args.crash_at >= 0 else None
+        frames = synth_crash_frames(duration_s=args.duration, crash_at_s=crash_at,
+                                    peak_g=args.peak_g, pulse_ms=args.pulse_ms, seed=args.seed)
+        write_ndjson(frames, args.out)
+        print(f"[replay] Wrote {len(frames)} frames to {args.out}")
+    elif args.command == "play":
+        src = ReplaySource(load_logs(args.logs), speed=args.speed)
+        get_arduino_data.subscribe(lambda port, alias, frame: print(f"[{alias}] {frame.get('_recv_ts')} "
+            + " ".join(f"{s.get('name')}={s.get('Weight', 0):.1f}kg/{s.get('mpu_g', 0):.2f}g" for s in frame.get("seats", []))))
+        src.start()
+        src.done.wait()
+        print(f"[replay] {src.count} frames in {src.elapsed_s:.2f}s")
+    elif args.command == "bench":
+        print(json.dumps({"detection": bench_detection(args.runs, args.speed, args.seed),
+                          "ingest": bench_ingest()}, indent=2))
+    elif args.command == "main":
+        frames = load_logs(args.logs) if args.logs else synth_crash_frames(duration_s=120.0, crash_at_s=60.0)
+        run_main(frames, speed=args.speed, video=args.video, incidents=args.incidents or None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# report_schema.py
+# Accident report payload on the wire, shared by postcrash.py (sender) and server14.py.
+#
+# v1 is what jsondata.get_all_seats_dict() returns, plus the update fields; old clients send it
+# and old servers only understand it:
+#   {"seat1": {"is_child": true, "is_conscious": false, "impact": 32.5, "score": 92.5, "status": "occupied"},
+#    "seat2": {"is_child": "empty", "is_conscious": "empty", "impact": "empty", "score": 0, "status": "empty"},
+#    ..., "preliminary": true, "impact_count": 1}
+# v2 is positional and typed, null for an empty seat instead of "empty" strings:
+#   {"v": 2, "s": [[1, 0, 32.5, 92.5], null, ...], "preliminary": true, "impact_count": 1}
+#   seat = [is_child 0/1, is_conscious 0/1, impact 0..50, score]
+# Either version can be sent as JSON, MessagePack or CBOR (when msgpack / cbor2 are installed
+# on both ends), gzip'd when that makes it smaller. The sender asks each server once what it
+# accepts (GET /api/report_formats) and sends v1 JSON to servers that predate this.
+# The server always answers in JSON and stores v1 seat details, so the dashboard is unchanged.
+#
+#   python report_schema.py      # size and server-side parse time per format for a sample report
+
+import gzip
+import json
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+SCHEMA_VERSION = 2
+SCHEMAS = (1, 2)
+JSON, MSGPACK, CBOR = "application/json", "application/msgpack", "application/cbor"
+PREFERRED = (MSGPACK, CBOR, JSON)   # sender's order of preference
+FORMATS_PATH = "/api/report_formats"
+GZIP_MIN_BYTES = 200        # smaller bodies are sent as they are; gzip's header costs more than it saves
+MAX_BODY_BYTES = 64 * 1024  # decoded size limit (a real report is well under 1 KiB)
+MAX_SEATS = 8
+IMPACT_MAX = 50.0           # impact_score.py scale
+SCORE_MAX = 10 + 50 + IMPACT_MAX   # jsondata.py: child + unconscious + impact
+NEGOTIATE_TIMEOUT_S = 2.0
+NEGOTIATE_RETRY_S = 60.0    # an unreachable or older server is asked again after this long
+
+EMPTY_SEAT = {"is_child": "empty", "is_conscious": "empty", "impact": "empty", "score": 0, "status": "empty"}
+
+
+class ReportError(ValueError):
+    """A report the server cannot accept; status is the HTTP code to answer with."""
+
+    def __init__(self, msg: str, status: int = 400):
+        super().__init__(msg)
+        self.status = status
+
+
+def content_types() -> Tuple[str, ...]:
+    """Body formats this process can read and write."""
+    return tuple(t for t, ok in ((MSGPACK, msgpack), (CBOR, cbor2), (JSON, True)) if ok)
+
+
+def server_formats() -> Dict[str, Any]:
+    """Body of GET /api/report_formats."""
+    return {"schema": list(SCHEMAS), "content_types": list(content_types()), "encodings": ["gzip"]}
+
+
+# ---------- schema ----------
+
+def _num(x: float):
+    # 60.0 -> 60: shorter in every encoding, same value.
+    return int(x) if float(x).is_integer() else x
+
+
+def compact(seats: Dict[str, Dict[str, Any]], **meta) -> Dict[str, Any]:
+    """v1 seat dicts (seat1..seatN) -> a v2 report. meta: preliminary, impact_count."""
+    rows: List[Optional[list]] = []
+    for i in range(1, len(seats) + 1):
+        seat = seats[f"seat{i}"]
+        if seat.get("status") == "empty":
+            rows.append(None)
+        else:
+            rows.append([int(bool(seat["is_child"])), int(bool(seat["is_conscious"])),
+                         _num(seat["impact"]), _num(seat["score"])])
+    out: Dict[str, Any] = {"v": SCHEMA_VERSION, "s": rows}
+    out.update((k, v) for k, v in meta.items() if v is not None)
+    return out
+
+
+def _seat_v2(i: int, seat) -> Dict[str, Any]:
+    if seat is None:
+        return dict(EMPTY_SEAT)
+    if type(seat) not in (list, tuple) or len(seat) != 4:
+        raise ReportError(f"s[{i}]: expected [is_child, is_conscious, impact, score] or null")
+    child, conscious, impact, score = seat
+    if child not in (0, 1) or conscious not in (0, 1):
+        raise ReportError(f"s[{i}]: is_child / is_conscious must be 0 or 1")
+    if type(impact) not in (int, float) or not 0 <= impact <= IMPACT_MAX:
+        raise ReportError(f"s[{i}]: impact must be a number in 0..{IMPACT_MAX:g}")
+    if type(score) not in (int, float) or not 0 <= score <= SCORE_MAX:
+        raise ReportError(f"s[{i}]: score must be a number in 0..{SCORE_MAX:g}")
+    return {"is_child": bool(child), "is_conscious": bool(conscious), "impact": impact, "score": score,
+            "status": "occupied"}
+
+
+def parse(obj) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """Decoded body -> (v1 seat details, meta). meta: version, preliminary, impact_count (None if absent)."""
+    if type(obj) is not dict:
+        raise ReportError("report must be an object")
+    version = obj.get("v", 1)
+    if version == 2:
+        rows = obj.get("s")
+        if type(rows) is not list or not 1 <= len(rows) <= MAX_SEATS:
+            raise ReportError(f"s: expected a list of 1..{MAX_SEATS} seats")
+        seats = {f"seat{i + 1}": _seat_v2(i, row) for i, row in enumerate(rows)}
+    elif version == 1:
+        # Old clients: same leniency as before, but seat entries have to be objects.
+        seats = {key: val for key, val in obj.items() if key.startswith("seat")}
+        if not seats:
+            raise ReportError("Missing required seat data")
+        bad = [key for key, val in seats.items() if type(val) is not dict]
+        if bad:
+            raise ReportError(f"{', '.join(sorted(bad))}: seat entries must be objects")
+    else:
+        raise ReportError(f"unsupported schema version {version!r} (supported: {list(SCHEMAS)})")
+
+    count = obj.get("impact_count")
+    if count is not None and (type(count) is not int or count < 1):
+        raise ReportError("impact_count must be a positive integer")
+    return seats, {"version": version, "preliminary": bool(obj.get("preliminary")), "impact_count": count}
+
+
+# ---------- encodings ----------
+
+def dumps(obj, content_type: str = JSON) -> bytes:
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    if content_type == CBOR and cbor2 is not None:
+        return cbor2.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _gunzip(raw: bytes) -> bytes:
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        out = d.decompress(raw, MAX_BODY_BYTES + 1)
+    except zlib.error as e:
+        raise ReportError(f"bad gzip body: {e}")
+    if len(out) > MAX_BODY_BYTES:
+        raise ReportError(f"report larger than {MAX_BODY_BYTES} bytes", status=413)
+    return out
+
+
+def decode_body(raw: bytes, mimetype: Optional[str], content_encoding: Optional[str] = None):
+    """Request body -> Python object. Unknown types are rejected with 415 so the sender can
+    fall back to JSON; a missing Content-Type is read as JSON, like old curl tests did."""
+    enc = (content_encoding or "").strip().lower()
+    if enc == "gzip":
+        raw = _gunzip(raw)
+    elif enc not in ("", "identity"):
+        raise ReportError(f"unsupported Content-Encoding {enc!r}", status=415)
+    if len(raw) > MAX_BODY_BYTES:
+        raise ReportError(f"report larger than {MAX_BODY_BYTES} bytes", status=413)
+
+    mimetype = (mimetype or JSON).lower()
+    if mimetype in (MSGPACK, "application/x-msgpack") and msgpack is not None:
+        loads = lambda b: msgpack.unpackb(b, raw=False, strict_map_key=True)
+    elif mimetype == CBOR and cbor2 is not None:
+        loads = cbor2.loads
+    elif mimetype == JSON or mimetype.endswith("+json"):
+        loads = json.loads
+    else:
+        raise ReportError(f"unsupported Content-Type {mimetype!r} (accepted: {', '.join(content_types())})",
+                          status=415)
+    try:
+        return loads(raw)
+    except Exception as e:   # each decoder raises its own types
+        raise ReportError(f"could not decode {mimetype} body: {e}")
+
+
+# ---------- sender ----------
+
+_negotiated: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}   # base_url -> (when, formats or None)
+
+
+def negotiate(base_url: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """What the server accepts (cached per server), or None for an old / unreachable one."""
+    cached = _negotiated.get(base_url)
+    if cached and not refresh and (cached[1] is not None or time.monotonic() - cached[0] < NEGOTIATE_RETRY_S):
+        return cached[1]
+    import requests
+    formats = None
+    try:
+        resp = requests.get(f"{base_url}{FORMATS_PATH}", timeout=NEGOTIATE_TIMEOUT_S)
+        if resp.status_code == 200:
+            formats = resp.json()
+            if SCHEMA_VERSION not in formats.get("schema", ()):
+                formats = None
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    _negotiated[base_url] = (time.monotonic(), formats)
+    return formats
+
+
+def forget(base_url: str):
+    """Drops the cached formats (the server answered 415: it changed since we asked)."""
+    _negotiated.pop(base_url, None)
+
+
+def encode_request(base_url: str, seats: Dict[str, Dict[str, Any]], **meta) -> Tuple[bytes, Dict[str, str]]:
+    """(body, headers) for POSTing a report to base_url in the best format both ends support."""
+    formats = negotiate(base_url)
+    if formats is None:
+        obj, ctype = dict(seats), JSON
+        obj.update((k, v) for k, v in meta.items() if v is not None)
+    else:
+        obj = compact(seats, **meta)
+        accepted = formats.get("content_types", (JSON,))
+        ctype = next((t for t in PREFERRED if t in accepted and t in content_types()), JSON)
+    body = dumps(obj, ctype)
+    headers = {"Content-Type": ctype}
+    if formats is not None and "gzip" in formats.get("encodings", ()) and len(body) >= GZIP_MIN_BYTES:
+        packed = gzip.compress(body, compresslevel=6, mtime=0)
+        if len(packed) < len(body):
+            body, headers["Content-Encoding"] = packed, "gzip"
+    return body, headers
+
+
+if __name__ == "__main__":
+    import jsondata
+    seats = jsondata.get_all_seats_dict((1, 2, 41.37, 1), (0, 0, 12.5, 1), (0, 0, 0, 0), (0, 2, 30, 1))
+    legacy = dict(seats, preliminary=True)
+    v2 = compact(seats, preliminary=True)
+    runs = 20000
+    print(f"{'payload':<28}{'bytes':>7}{'parse us':>10}")
+    for name, obj, ctype, gz in (("v1 json", legacy, JSON, False), ("v1 json+gzip", legacy, JSON, True),
+                                 ("v2 json", v2, JSON, False), ("v2 msgpack", v2, MSGPACK, False),
+                                 ("v2 cbor", v2, CBOR, False)):
+        if ctype not in content_types():
+            print(f"{name:<28}{'(not installed)':>17}")
+            continue
+        body = dumps(obj, ctype)
+        if gz: body = gzip.compress(body, mtime=0)
+        enc = "gzip" if gz else None
+        assert parse(decode_body(body, ctype, enc))[0] == seats
+        t = time.perf_counter()
+        for _ in range(runs):
+            parse(decode_body(body, ctype, enc))
+        print(f"{name:<28}{len(body):>7}{(time.perf_counter() - t) / runs * 1e6:>10.1f}")
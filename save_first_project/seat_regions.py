@@ -0,0 +1,37 @@
+# seat_regions.py
+# Where each seat sits in the cabin camera image, as fractions of the frame (x1, y1, x2, y2).
+# The default is the original quadrant split used by age.py / motion.py (the camera faces
+# the occupants, so S1 is bottom-right and S4 top-left). Edit SEAT_REGIONS for a different
+# mounting; regions may leave gaps (aisles, pillars) but should not overlap.
+
+from typing import Dict, Optional, Tuple
+
+Region = Tuple[float, float, float, float]
+
+SEATS = ("S1", "S2", "S3", "S4")
+SEAT_REGIONS: Dict[str, Region] = {
+    "S4": (0.0, 0.0, 0.5, 0.5), "S3": (0.5, 0.0, 1.0, 0.5),
+    "S2": (0.0, 0.5, 0.5, 1.0), "S1": (0.5, 0.5, 1.0, 1.0),
+}
+
+
+def to_pixels(width: int, height: int, margin: float = 0.0,
+              regions: Optional[Dict[str, Region]] = None) -> Dict[str, Tuple[int, int, int, int]]:
+    """Pixel boxes per seat. margin (fraction of each region's size) is cut from every side,
+    so movement right at a boundary is not counted for either seat."""
+    out = {}
+    for seat, (x1, y1, x2, y2) in (regions or SEAT_REGIONS).items():
+        mx, my = (x2 - x1) * margin, (y2 - y1) * margin
+        out[seat] = (int(round((x1 + mx) * width)), int(round((y1 + my) * height)),
+                     int(round((x2 - mx) * width)), int(round((y2 - my) * height)))
+    return out
+
+
+def seat_at(x: float, y: float, width: int, height: int,
+            regions: Optional[Dict[str, Region]] = None) -> Optional[str]:
+    """Seat whose region contains pixel (x, y), or None (outside every region)."""
+    fx, fy = x / float(width), y / float(height)
+    for seat, (x1, y1, x2, y2) in (regions or SEAT_REGIONS).items():
+        if x1 <= fx < x2 and y1 <= fy < y2:
+            return seat
+    return None
@@ -2,9 +2,10 @@
 
 import json
 import time
+from collections import deque
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, Optional
 
 try:
     import get_arduino_data
@@ -15,6 +16,15 @@ except ImportError:
 WEIGHT_THRESHOLD_KG = 5.0
 SEATS = ["S1", "S2", "S3", "S4"]
 
+# Per-seat filtering on the ingest stream (HX711 weight every 200 ms):
+# median of the last MEDIAN_WINDOW samples -> EMA -> hysteresis band -> debounce timer.
+MEDIAN_WINDOW = 5           # 1 s at 5 Hz; removes single-sample spikes from bumps
+EMA_ALPHA = 0.3
+ON_KG = 6.0                 # must rise above this to become occupied ...
+OFF_KG = 4.0                # ... and fall below this to become empty
+DEBOUNCE_ON_S = 1.0
+DEBOUNCE_OFF_S = 2.0        # passengers shifting weight briefly unload the seat
+
 def safe_float(x, default=0.0):
     try:
         return float(x)
@@ -32,8 +42,75 @@ def normalize_age_code(x):
     except Exception:
         return 2
 
+class SeatFilter:
+    """O(1) per sample. `occupied` is None until the median window has filled once,
+    then it is decided straight from the filtered weight and debounced afterwards."""
+    __slots__ = ("window", "ema", "occupied", "pending_since")
+
+    def __init__(self):
+        self.window: deque = deque(maxlen=MEDIAN_WINDOW)
+        self.ema: Optional[float] = None
+        self.occupied: Optional[bool] = None
+        self.pending_since: Optional[float] = None
+
+    def update(self, t: float, weight: float) -> Optional[bool]:
+        self.window.append(weight)
+        med = sorted(self.window)[len(self.window) // 2]
+        self.ema = med if self.ema is None else self.ema + EMA_ALPHA * (med - self.ema)
+
+        if self.occupied is None:
+            if len(self.window) == MEDIAN_WINDOW:
+                self.occupied = self.ema > WEIGHT_THRESHOLD_KG
+            return self.occupied
+
+        crossing = (self.ema < OFF_KG) if self.occupied else (self.ema > ON_KG)
+        if not crossing:
+            self.pending_since = None
+        elif self.pending_since is None:
+            self.pending_since = t
+        elif t - self.pending_since >= (DEBOUNCE_OFF_S if self.occupied else DEBOUNCE_ON_S):
+            self.occupied = not self.occupied
+            self.pending_since = None
+        return self.occupied
+
+
+g_filters: Dict[str, SeatFilter] = {seat: SeatFilter() for seat in SEATS}
+_unsubscribe = None
+
+def _on_frame(port, alias, frame):
+    t = frame.get("_recv_t") or time.time()
+    for s in frame.get("seats", ()):
+        f = g_filters.get(s.get("name"))
+        if f is not None:
+            f.update(t, safe_float(s.get("Weight", 0.0)))
+
+def start():
+    """Subscribes the filters to get_arduino_data's ingest. Call before the readers start."""
+    global _unsubscribe
+    if _unsubscribe is None:
+        _unsubscribe = get_arduino_data.subscribe(_on_frame)
+
+def stop():
+    global _unsubscribe
+    if _unsubscribe is not None:
+        _unsubscribe()
+        _unsubscribe = None
+
+def reset():
+    for seat in SEATS:
+        g_filters[seat] = SeatFilter()
+
+def get_occupancy() -> Dict[str, int]:
+    """Debounced weight occupancy per seat (1 = loaded); no recomputation, just reads state."""
+    return {seat: int(bool(g_filters[seat].occupied)) for seat in SEATS}
+
+def get_filtered_weights() -> Dict[str, Optional[float]]:
+    return {seat: g_filters[seat].ema for seat in SEATS}
+
 def get_seat_status(age_tuple: Tuple[int, int, int, int],
-                      seats_data_dict: Dict[str, Dict[str, Any]]) -> Tuple[int, int, int, int]:
+                      seats_data_dict: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[int, int, int, int]:
+    """sit = weight occupancy AND an adult/child in that seat. Without seats_data_dict the
+    debounced filter state is used; with one, the single snapshot is thresholded as before."""
 
     age_codes = {
         "S1": normalize_age_code(age_tuple[0]),
@@ -42,6 +119,10 @@ def get_seat_status(age_tuple: Tuple[int, int, int, int],
         "S4": normalize_age_code(age_tuple[3]),
     }
 
+    if seats_data_dict is None:
+        occupancy = get_occupancy()
+        return tuple(int(occupancy[seat] == 1 and age_codes[seat] in (0, 1)) for seat in SEATS)
+
     sit_status_map = {}
     for seat in SEATS:
         weight = 0.0
@@ -88,3 +169,17 @@ if __name__ == "__main__":
     print(f"S2_sit: {s2_sit} (Expected: 1)")
     print(f"S3_sit: {s3_sit} (Expected: 0)")
     print(f"S4_sit: {s4_sit} (Expected: 0)")
+
+    # Filtered path: S2 carries a passenger with bumps and a brief shift off the seat,
+    # S3 gets one 30 kg spike. Neither should flip.
+    start()
+    t0 = time.time()
+    for i in range(50):
+        t = t0 + i * 0.2
+        s2 = 60.0 + (25.0 if i % 7 == 0 else 0.0) - (58.0 if 30 <= i < 34 else 0.0)
+        s3 = 30.0 if i == 20 else 1.0
+        get_arduino_data.ingest_frame("test", "test", {"_recv_t": t, "seats": [
+            {"name": "S1", "Weight": 15.0}, {"name": "S2", "Weight": s2},
+            {"name": "S3", "Weight": s3}, {"name": "S4", "Weight": 20.0}]}, log=False)
+    print(f"\nFiltered weights: {get_filtered_weights()}")
+    print(f"Debounced sit status: {get_seat_status(mock_ages)} (Expected: (1, 1, 0, 0))")
@@ -0,0 +1,266 @@
+# sensor_archive.py
+# Columnar archive for the seat sensor stream, replacing "parse gigabytes of ndjson".
+#
+# Layout (one row per seat sample, rows sorted by time inside each part):
+#   ARCHIVE/index.json                  boards list + one entry per part (t_min, t_max, rows)
+#   ARCHIVE/20231114T22-0001/t.npy      float64 epoch seconds (_recv_t)
+#                            seat.npy   uint8 index into SEATS
+#                            board.npy  uint8 index into index.json "boards"
+#                            weight.npy float32 kg
+#                            mpu_g.npy  float32 g
+#                            cells.npy  float32 (rows, 4) per load cell
+#                            ts_ms.npy  uint32 board millis()
+# Parts are plain .npy so queries memory-map them; `compress` turns cold parts into one .npz
+# each (~3-4x smaller, loaded instead of mapped).
+#
+#   python sensor_archive.py convert /home/pi/weight_logs/*.ndjson --out /home/pi/sensor_archive
+#   python sensor_archive.py query --from 2023-11-14T22:00 --to 2023-11-14T23:00 --seat S1 --stats
+#   python sensor_archive.py scan --above 1.5            # per-day max g / samples above a threshold
+#   python sensor_archive.py compress --older-than-days 7
+
+import os, sys, json, time, argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+SEATS = ("S1", "S2", "S3", "S4")
+SEAT_INDEX = {s: i for i, s in enumerate(SEATS)}
+CHUNK_S = 3600              # parts never span an hour boundary
+FLUSH_S = 600               # live writer flushes at least this often
+MAX_BUFFER_ROWS = 200_000
+INDEX_NAME = "index.json"
+
+COLUMNS = {"t": np.float64, "seat": np.uint8, "board": np.uint8, "weight": np.float32,
+           "mpu_g": np.float32, "cells": np.float32, "ts_ms": np.uint32}
+
+
+def _load_index(root: Path) -> Dict[str, Any]:
+    p = root / INDEX_NAME
+    if p.exists():
+        return json.loads(p.read_text(encoding="utf-8"))
+    return {"version": 1, "boards": [], "parts": []}
+
+
+def _save_index(root: Path, index: Dict[str, Any]):
+    tmp = root / (INDEX_NAME + ".tmp")
+    tmp.write_text(json.dumps(index, indent=1), encoding="utf-8")
+    tmp.replace(root / INDEX_NAME)
+
+
+class ArchiveWriter:
+    """Buffers rows and writes one part per hour bucket on flush. Single-threaded (ingest thread)."""
+
+    def __init__(self, root, flush_s: float = FLUSH_S):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.flush_s = flush_s
+        self.index = _load_index(self.root)
+        self._board_ids = {b: i for i, b in enumerate(self.index["boards"])}
+        self._buf: Dict[str, list] = {c: [] for c in COLUMNS}
+        self._bucket: Optional[int] = None
+        self._last_flush = time.monotonic()
+
+    def _board(self, name: str) -> int:
+        i = self._board_ids.get(name)
+        if i is None:
+            i = self._board_ids[name] = len(self.index["boards"])
+            self.index["boards"].append(name)
+        return i
+
+    def add_frame(self, frame: Dict[str, Any], t: Optional[float] = None):
+        t = float(frame.get("_recv_t") or t or time.time())
+        bucket = int(t // CHUNK_S)
+        if self._bucket is not None and bucket != self._bucket:
+            self.flush()
+        self._bucket = bucket
+        board = self._board(str(frame.get("_alias") or frame.get("device_id") or "?"))
+        ts_ms = int(frame.get("ts_ms") or 0) & 0xFFFFFFFF
+        b = self._buf
+        for s in frame.get("seats", ()):
+            i = SEAT_INDEX.get(s.get("name"))
+            if i is None: continue
+            cells = (list(s.get("loadCell") or []) + [0.0] * 4)[:4]
+            try:
+                w, g = float(s.get("Weight", 0.0)), float(s.get("mpu_g", 0.0))
+            except (TypeError, ValueError):
+                continue
+            b["t"].append(t); b["seat"].append(i); b["board"].append(board)
+            b["weight"].append(w); b["mpu_g"].append(g); b["cells"].append(cells); b["ts_ms"].append(ts_ms)
+        if len(b["t"]) >= MAX_BUFFER_ROWS or time.monotonic() - self._last_flush >= self.flush_s:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        n = len(self._buf["t"])
+        if not n: return
+        cols = {c: np.asarray(v, dtype=COLUMNS[c]) for c, v in self._buf.items()}
+        self._buf = {c: [] for c in COLUMNS}
+        order = np.argsort(cols["t"], kind="stable")
+        cols = {c: v[order] for c, v in cols.items()}
+
+        stamp = datetime.fromtimestamp(self._bucket * CHUNK_S, timezone.utc).strftime("%Y%m%dT%H")
+        seq = 1 + sum(1 for p in self.index["parts"] if p["name"].startswith(stamp))
+        name = f"{stamp}-{seq:04d}"
+        part = self.root / name
+        part.mkdir()
+        for c, v in cols.items():
+            np.save(part / f"{c}.npy", v)
+        self.index["parts"].append({"name": name, "t_min": float(cols["t"][0]), "t_max": float(cols["t"][-1]),
+                                    "rows": n, "format": "npy"})
+        _save_index(self.root, self.index)
+
+    def close(self):
+        self.flush()
+
+
+def convert_ndjson(paths: Sequence[str], root, progress: bool = True) -> int:
+    """Streams .ndjson logs (time-merged) into the archive. Returns the number of frames."""
+    import replay
+    writer = ArchiveWriter(root, flush_s=float("inf"))
+    n = 0
+    for t, frame in replay.load_logs(paths):
+        writer.add_frame(frame, t)
+        n += 1
+        if progress and n % 100_000 == 0:
+            print(f"[sensor_archive] {n} frames...")
+    writer.close()
+    return n
+
+
+class SensorArchive:
+    """Read side. Parts are memory-mapped, so a query touches only the pages it selects."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.index = _load_index(self.root)
+        self.boards = self.index["boards"]
+
+    def parts(self, t0: Optional[float] = None, t1: Optional[float] = None) -> List[Dict[str, Any]]:
+        return [p for p in self.index["parts"]
+                if (t0 is None or p["t_max"] >= t0) and (t1 is None or p["t_min"] < t1)]
+
+    def _open(self, part: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        path = self.root / part["name"]
+        if part.get("format") == "npz":
+            with np.load(str(path) + ".npz") as z:
+                return {c: z[c] for c in z.files}
+        return {c: np.load(path / f"{c}.npy", mmap_mode="r") for c in COLUMNS}
+
+    def iter_query(self, t0: Optional[float] = None, t1: Optional[float] = None,
+                   seats: Optional[Iterable[str]] = None, boards: Optional[Iterable[str]] = None,
+                   columns: Sequence[str] = ("t", "seat", "board", "weight", "mpu_g")) -> Iterator[Dict[str, np.ndarray]]:
+        """Yields one dict of column arrays per part, already filtered. Use for month-long scans."""
+        seat_ids = None if seats is None else np.array([SEAT_INDEX[s] for s in seats], dtype=np.uint8)
+        board_ids = None if boards is None else np.array([self.boards.index(b) for b in boards if b in self.boards],
+                                                          dtype=np.uint8)
+        for part in self.parts(t0, t1):
+            cols = self._open(part)
+            t = cols["t"]
+            lo = 0 if t0 is None else int(np.searchsorted(t, t0, "left"))
+            hi = len(t) if t1 is None else int(np.searchsorted(t, t1, "left"))
+            if hi <= lo: continue
+            mask = None
+            if seat_ids is not None:
+                mask = np.isin(cols["seat"][lo:hi], seat_ids)
+            if board_ids is not None:
+                m = np.isin(cols["board"][lo:hi], board_ids)
+                mask = m if mask is None else mask & m
+            out = {}
+            for c in columns:
+                v = cols[c][lo:hi]
+                out[c] = np.asarray(v[mask] if mask is not None else v)
+            if len(out[columns[0]]):
+                yield out
+
+    def query(self, *args, **kwargs) -> Dict[str, np.ndarray]:
+        """iter_query concatenated into one dict of arrays."""
+        columns = kwargs.get("columns", ("t", "seat", "board", "weight", "mpu_g"))
+        chunks = list(self.iter_query(*args, **kwargs))
+        if not chunks:
+            return {c: np.empty((0, 4) if c == "cells" else 0, dtype=COLUMNS[c]) for c in columns}
+        return {c: np.concatenate([ch[c] for ch in chunks]) for c in columns}
+
+    def compress(self, older_than_s: float = 7 * 86400):
+        """Packs parts older than the cutoff into one compressed .npz each."""
+        cutoff = time.time() - older_than_s
+        for part in self.index["parts"]:
+            if part.get("format") != "npy" or part["t_max"] >= cutoff: continue
+            cols = self._open(part)
+            np.savez_compressed(self.root / (part["name"] + ".npz"), **{c: np.asarray(v) for c, v in cols.items()})
+            for c in COLUMNS:
+                (self.root / part["name"] / f"{c}.npy").unlink()
+            (self.root / part["name"]).rmdir()
+            part["format"] = "npz"
+            _save_index(self.root, self.index)
+
+
+def _parse_time(s: Optional[str]) -> Optional[float]:
+    if s is None: return None
+    try: return float(s)
+    except ValueError:
+        return datetime.fromisoformat(s.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+
+def main():
+    from get_arduino_data import ARCHIVE_DIR
+    ap = argparse.ArgumentParser(description="Columnar sensor archive: convert, query, scan.")
+    ap.add_argument("--root", default=str(ARCHIVE_DIR))
+    sub = ap.add_subparsers(dest="command", required=True)
+    cp = sub.add_parser("convert")
+    cp.add_argument("logs", nargs="+")
+    cp.add_argument("--out", default=None)
+    qp = sub.add_parser("query")
+    qp.add_argument("--from", dest="t0", default=None, help="epoch seconds or ISO (UTC)")
+    qp.add_argument("--to", dest="t1", default=None)
+    qp.add_argument("--seat", action="append", default=None)
+    qp.add_argument("--board", action="append", default=None)
+    qp.add_argument("--stats", action="store_true", help="summary instead of rows")
+    sp = sub.add_parser("scan")
+    sp.add_argument("--above", type=float, default=1.5, help="count samples with mpu_g above this")
+    zp = sub.add_parser("compress")
+    zp.add_argument("--older-than-days", type=float, default=7.0)
+    args = ap.parse_args()
+
+    if args.command == "convert":
+        root = args.out or args.root
+        t = time.perf_counter()
+        n = convert_ndjson(args.logs, root)
+        src = sum(os.path.getsize(p) for p in args.logs)
+        dst = sum(f.stat().st_size for f in Path(root).rglob("*") if f.is_file())
+        print(f"[sensor_archive] {n} frames in {time.perf_counter() - t:.1f}s, {src / 1e6:.1f} MB ndjson -> {dst / 1e6:.1f} MB")
+        return
+
+    arc = SensorArchive(args.root)
+    t = time.perf_counter()
+    if args.command == "query":
+        r = arc.query(_parse_time(args.t0), _parse_time(args.t1), seats=args.seat, boards=args.board)
+        if args.stats:
+            stats = {"rows": int(len(r["t"]))}
+            for i, seat in enumerate(SEATS):
+                m = r["seat"] == i
+                if m.any():
+                    stats[seat] = {"rows": int(m.sum()), "max_g": float(r["mpu_g"][m].max()),
+                                   "mean_kg": round(float(r["weight"][m].mean()), 2)}
+            print(json.dumps(stats, indent=2))
+        else:
+            for row in zip(r["t"], r["seat"], r["board"], r["weight"], r["mpu_g"]):
+                print(f"{row[0]:.3f} {SEATS[row[1]]} {arc.boards[row[2]]} {row[3]:.2f}kg {row[4]:.3f}g")
+    elif args.command == "scan":
+        days: Dict[str, Dict[str, Any]] = {}
+        for ch in arc.iter_query(columns=("t", "mpu_g")):
+            day = np.floor(ch["t"] / 86400).astype(np.int64)
+            for d in np.unique(day):
+                g = ch["mpu_g"][day == d]
+                key = datetime.fromtimestamp(int(d) * 86400, timezone.utc).strftime("%Y-%m-%d")
+                e = days.setdefault(key, {"rows": 0, "max_g": 0.0, "above": 0})
+                e["rows"] += int(g.size); e["max_g"] = max(e["max_g"], float(g.max())); e["above"] += int((g > args.above).sum())
+        print(json.dumps(days, indent=2))
+    elif args.command == "compress":
+        arc.compress(args.older_than_days * 86400)
+    print(f"[sensor_archive] {args.command} took {(time.perf_counter() - t) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
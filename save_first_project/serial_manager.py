@@ -0,0 +1,394 @@
+# serial_manager.py
+# Multiplexes every Arduino serial port in one selector loop (one thread for all boards).
+# The open handle is shared for commands, dropped ports are reopened with backoff,
+# and decoded JSON frames are pushed to sync callbacks or asyncio queues.
+# Ports can also be discovered automatically: /dev/serial/by-id is rescanned (immediately on
+# udev events when pyudev is installed) and each board is identified by the device_id it sends.
+# Commands go through request()/request_many(): each carries an "id" that the firmware echoes
+# in its {"ack": ...} reply, so callers get the board's result (or None after timeout + retries).
+# POSIX only (selectors need a real fd), which is what the Pi gives us.
+
+import os, json, time, glob, itertools, threading, selectors
+from typing import Callable, Dict, Any, Optional, List, Tuple
+import serial
+import metrics
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+RECONNECT_MIN_S = 0.5
+RECONNECT_MAX_S = 10.0
+SELECT_TIMEOUT_S = 0.5
+READ_CHUNK = 4096
+MAX_LINE_BYTES = 8192
+
+SERIAL_BY_ID_GLOB = "/dev/serial/by-id/*"
+DISCOVERY_INTERVAL_S = 2.0        # rescan period without udev
+UDEV_FALLBACK_INTERVAL_S = 15.0   # safety rescan period when udev events are available
+UDEV_SETTLE_S = 0.3               # by-id symlinks appear shortly after the kernel event
+_UDEV = object()
+
+REQUEST_TIMEOUT_S = 2.0           # per attempt; a tare on the board takes ~1 s
+REQUEST_RETRIES = 1
+
+_M_PORTS_OPEN = metrics.gauge("serial_ports_open", "Serial ports currently open")
+
+# callback(port, alias, frame_dict) - runs on the manager thread, keep it short.
+FrameCallback = Callable[[str, str, Dict[str, Any]], None]
+
+
+class _Port:
+    __slots__ = ("path", "alias", "ser", "buf", "retry_at", "backoff", "write_lock",
+                 "device_id", "discovered", "m_lines", "m_bad", "m_reconnects")
+
+    def __init__(self, path: str, alias: str, discovered: bool = False):
+        self.path = path
+        self.alias = alias
+        self.device_id: Optional[str] = None
+        self.discovered = discovered
+        self.ser: Optional[serial.Serial] = None
+        self.buf = b""
+        self.retry_at = 0.0
+        self.backoff = RECONNECT_MIN_S
+        self.write_lock = threading.Lock()
+        port = os.path.basename(path)
+        self.m_lines = metrics.counter("serial_lines_total", "JSON frames read", port=port)
+        self.m_bad = metrics.counter("serial_parse_failures_total", "Lines that were not a JSON object", port=port)
+        self.m_reconnects = metrics.counter("serial_reconnects_total", "Serial errors that forced a reopen", port=port)
+
+
+class _Pending:
+    __slots__ = ("path", "cmd", "seat", "event", "reply")
+
+    def __init__(self, path: str, cmd: Dict[str, Any]):
+        self.path = path
+        self.cmd = cmd
+        self.seat = cmd.get("seat")
+        self.event = threading.Event()
+        self.reply: Optional[Dict[str, Any]] = None
+
+
+class SerialManager:
+    def __init__(self, baud: int,
+                 on_open: Optional[Callable[[str, str], None]] = None,
+                 on_identify: Optional[Callable[[str, str, str], None]] = None,
+                 alias_for: Optional[Callable[[str], str]] = None):
+        self.baud = baud
+        self.on_open = on_open
+        self.on_identify = on_identify   # on_identify(port, alias, device_id) after the first frame
+        self.alias_for = alias_for       # device_id -> alias used in logs and cal_store
+        self._ports: Dict[str, _Port] = {}
+        self._ports_lock = threading.Lock()
+        self._subscribers: List[FrameCallback] = []
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._discovery_glob: Optional[str] = None
+        self._discovery_interval = DISCOVERY_INTERVAL_S
+        self._next_scan = 0.0
+        self._udev_monitor = None
+        self._pending: Dict[Tuple[str, int], _Pending] = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    # ---- port registry ----
+    def add_port(self, path: str, alias: str, discovered: bool = False):
+        with self._ports_lock:
+            if path in self._ports: return
+            self._ports[path] = _Port(path, alias, discovered)
+        self._wake()
+
+    def remove_port(self, path: str):
+        with self._ports_lock:
+            p = self._ports.pop(path, None)
+        if p is not None:
+            self._close(p)
+            self._wake()
+
+    def ports(self) -> Dict[str, str]:
+        with self._ports_lock:
+            return {path: p.alias for path, p in self._ports.items()}
+
+    def is_open(self, path: str) -> bool:
+        p = self._ports.get(path)
+        return bool(p and p.ser is not None)
+
+    def devices(self) -> Dict[str, str]:
+        """{device_id: port} for every board that has completed its handshake."""
+        with self._ports_lock:
+            return {p.device_id: path for path, p in self._ports.items() if p.device_id and p.ser is not None}
+
+    def port_for_alias(self, alias: str) -> Optional[str]:
+        with self._ports_lock:
+            return next((path for path, p in self._ports.items() if p.alias == alias and p.ser is not None), None)
+
+    # ---- discovery ----
+    def enable_discovery(self, pattern: str = SERIAL_BY_ID_GLOB, interval_s: float = DISCOVERY_INTERVAL_S):
+        """Picks up boards matching pattern as they appear and forgets them when they vanish."""
+        self._discovery_glob = pattern
+        self._discovery_interval = interval_s
+        self._next_scan = 0.0
+        if pyudev is not None and self._udev_monitor is None:
+            try:
+                mon = pyudev.Monitor.from_netlink(pyudev.Context())
+                mon.filter_by("tty")
+                mon.start()
+                self._sel.register(mon.fileno(), selectors.EVENT_READ, _UDEV)
+                self._udev_monitor = mon
+                self._discovery_interval = max(interval_s, UDEV_FALLBACK_INTERVAL_S)
+            except Exception as e:
+                print(f"[serial_manager] udev monitor unavailable ({e}); polling {pattern} every {interval_s}s.")
+        self._wake()
+
+    def _scan(self):
+        found = set(glob.glob(self._discovery_glob))
+        known = self.ports()
+        for path in sorted(found - set(known)):
+            print(f"[serial_manager] Discovered {path}")
+            self.add_port(path, os.path.basename(path), discovered=True)
+        with self._ports_lock:
+            gone = [path for path, p in self._ports.items() if p.discovered and path not in found]
+        for path in gone:
+            print(f"[serial_manager] {known.get(path, path)} unplugged ({path})")
+            self.remove_port(path)
+
+    # ---- subscribers ----
+    def subscribe(self, callback: FrameCallback) -> Callable[[], None]:
+        self._subscribers = self._subscribers + [callback]
+        def unsubscribe():
+            self._subscribers = [cb for cb in self._subscribers if cb is not callback]
+        return unsubscribe
+
+    def async_subscribe(self, maxsize: int = 1000) -> "asyncio.Queue":
+        """Returns an asyncio.Queue of (port, alias, frame) fed from the manager thread.
+        Must be called from inside the running event loop that will consume it."""
+        import asyncio   # only async consumers pay for it (main.py boot does not)
+        loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize)
+
+        def _push(item):
+            if q.full():
+                q.get_nowait()  # drop the oldest frame rather than stall the serial loop
+            q.put_nowait(item)
+
+        def _cb(port, alias, frame):
+            try:
+                loop.call_soon_threadsafe(_push, (port, alias, frame))
+            except RuntimeError:  # loop closed
+                unsubscribe()
+
+        unsubscribe = self.subscribe(_cb)
+        return q
+
+    async def frames(self):
+        """async for port, alias, frame in manager.frames(): ..."""
+        q = self.async_subscribe()
+        while True:
+            yield await q.get()
+
+    # ---- commands ----
+    def send(self, path: str, obj: Dict[str, Any]) -> bool:
+        """Writes one JSON command on the already-open handle. Safe from any thread."""
+        p = self._ports.get(path)
+        if p is None or p.ser is None:
+            return False
+        try:
+            with p.write_lock:
+                p.ser.write((json.dumps(obj) + "\n").encode("utf-8"))
+                p.ser.flush()
+            return True
+        except (serial.SerialException, OSError) as e:
+            print(f"[{p.alias}] Write failed: {e}")
+            return False
+
+    def request(self, path: str, cmd: Dict[str, Any], timeout_s: float = REQUEST_TIMEOUT_S,
+                retries: int = REQUEST_RETRIES) -> Optional[Dict[str, Any]]:
+        """Sends cmd and returns the board's ack frame, or None if none arrived after retries.
+        An ack can still carry {"error": ...}; see ack_ok()."""
+        return self.request_many([(path, cmd)], timeout_s, retries)[0]
+
+    def request_many(self, items: List[Tuple[str, Dict[str, Any]]], timeout_s: float = REQUEST_TIMEOUT_S,
+                     retries: int = REQUEST_RETRIES) -> List[Optional[Dict[str, Any]]]:
+        """Issues all commands at once (any mix of ports) and waits for the acks together,
+        so N boards take one board round-trip. Unanswered commands are re-sent with the same
+        id, so a late ack from an earlier attempt still counts."""
+        pend = []
+        with self._pending_lock:
+            for path, cmd in items:
+                rid = next(self._ids)
+                pend.append((rid, _Pending(path, {**cmd, "id": rid})))
+                self._pending[(path, rid)] = pend[-1][1]
+        t0 = time.perf_counter()
+        try:
+            for attempt in range(retries + 1):
+                todo = [pd for _, pd in pend if not pd.event.is_set()]
+                if not todo: break
+                if attempt:
+                    print(f"[serial_manager] Retrying {len(todo)} unanswered command(s) (attempt {attempt + 1})")
+                sent = [pd for pd in todo if self.send(pd.path, pd.cmd)]   # closed ports fail fast
+                deadline = time.monotonic() + timeout_s
+                for pd in sent:
+                    pd.event.wait(max(0.0, deadline - time.monotonic()))
+        finally:
+            with self._pending_lock:
+                for rid, pd in pend:
+                    self._pending.pop((pd.path, rid), None)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        for _, pd in pend:
+            name = str(pd.cmd.get("cmd"))
+            if pd.reply is None:
+                metrics.counter("serial_request_timeouts_total", "Commands with no ack after retries", cmd=name).inc()
+            else:
+                metrics.histogram("serial_request_ms", "Command round-trip including retries", cmd=name).observe(elapsed_ms)
+        return [pd.reply for _, pd in pend]
+
+    def request_all(self, cmd: Dict[str, Any], timeout_s: float = REQUEST_TIMEOUT_S,
+                    retries: int = REQUEST_RETRIES) -> Dict[str, Optional[Dict[str, Any]]]:
+        """The same command to every identified board concurrently. {device_id: ack or None}"""
+        devices = self.devices()
+        replies = self.request_many([(path, cmd) for path in devices.values()], timeout_s, retries)
+        return dict(zip(devices.keys(), replies))
+
+    def _resolve(self, path: str, frame: Dict[str, Any]):
+        rid = frame.get("id")
+        with self._pending_lock:
+            if rid is not None:
+                pd = self._pending.get((path, rid))
+            else:   # firmware without request ids: first pending command of that name (and seat)
+                pd = next((x for (pth, _), x in self._pending.items()
+                           if pth == path and not x.event.is_set() and x.cmd.get("cmd") == frame.get("ack")
+                           and (x.seat is None or x.seat == frame.get("seat"))), None)
+        if pd is not None and not pd.event.is_set():
+            pd.reply = frame
+            pd.event.set()
+
+    # ---- loop ----
+    def start(self) -> threading.Thread:
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="serial-manager", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake()
+        if self._thread:
+            self._thread.join(2.0)
+        with self._ports_lock:
+            ports = list(self._ports.values())
+        for p in ports:
+            self._close(p)
+
+    def _wake(self):
+        try: os.write(self._wake_w, b"\0")
+        except OSError: pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if self._discovery_glob and now >= self._next_scan:
+                self._next_scan = now + self._discovery_interval
+                self._scan()
+            next_retry = now + SELECT_TIMEOUT_S
+            if self._discovery_glob:
+                next_retry = min(next_retry, self._next_scan)
+            with self._ports_lock:
+                ports = list(self._ports.values())
+            for p in ports:
+                if p.ser is None:
+                    if now >= p.retry_at:
+                        self._try_open(p)
+                    if p.ser is None:
+                        next_retry = min(next_retry, p.retry_at)
+
+            timeout = max(0.0, min(SELECT_TIMEOUT_S, next_retry - time.monotonic()))
+            for key, _ in self._sel.select(timeout):
+                if key.data is None:
+                    try: os.read(self._wake_r, 512)
+                    except OSError: pass
+                    continue
+                if key.data is _UDEV:
+                    while self._udev_monitor.poll(timeout=0) is not None:
+                        pass
+                    self._next_scan = min(self._next_scan, time.monotonic() + UDEV_SETTLE_S)
+                    continue
+                self._on_readable(key.data)
+
+    def _try_open(self, p: _Port):
+        try:
+            ser = serial.Serial(p.path, self.baud, timeout=0)
+        except (serial.SerialException, OSError) as e:
+            print(f"[{p.alias}] Failed to open serial port: {e}. Retrying in {p.backoff:.1f}s...")
+            p.retry_at = time.monotonic() + p.backoff
+            p.backoff = min(p.backoff * 2, RECONNECT_MAX_S)
+            return
+        p.ser, p.buf, p.backoff = ser, b"", RECONNECT_MIN_S
+        _M_PORTS_OPEN.inc()
+        self._sel.register(ser.fileno(), selectors.EVENT_READ, p)
+        print(f"[{p.alias}] Serial port opened successfully.")
+        if self.on_open:
+            try: self.on_open(p.path, p.alias)
+            except Exception as e: print(f"[{p.alias}] on_open hook failed: {e}")
+
+    def _identify(self, p: _Port, device_id: str):
+        p.device_id = device_id
+        if self.alias_for:
+            p.alias = self.alias_for(device_id)
+        print(f"[{p.alias}] Identified device_id={device_id} on {p.path}")
+        if self.on_identify:
+            try: self.on_identify(p.path, p.alias, device_id)
+            except Exception as e: print(f"[{p.alias}] on_identify hook failed: {e}")
+
+    def _close(self, p: _Port):
+        ser, p.ser, p.device_id = p.ser, None, None
+        if ser is None: return
+        _M_PORTS_OPEN.dec()
+        try: self._sel.unregister(ser.fileno())
+        except (KeyError, ValueError, OSError): pass
+        try: ser.close()
+        except Exception: pass
+
+    def _on_readable(self, p: _Port):
+        if p.ser is None: return
+        try:
+            chunk = p.ser.read(READ_CHUNK)
+        except (serial.SerialException, OSError) as e:
+            print(f"[{p.alias}] Serial error: {e}. Reopening port...")
+            p.m_reconnects.inc()
+            self._close(p)
+            p.retry_at = time.monotonic() + p.backoff
+            return
+        if not chunk: return
+
+        p.buf += chunk
+        *lines, p.buf = p.buf.split(b"\n")
+        if len(p.buf) > MAX_LINE_BYTES:
+            p.buf = b""
+        for raw in lines:
+            line = raw.decode("utf-8", errors="ignore").strip()
+            if not line: continue
+            try: frame = json.loads(line)
+            except Exception: frame = None
+            if not isinstance(frame, dict):
+                p.m_bad.inc()
+                continue
+            p.m_lines.inc()
+            if p.device_id is None and frame.get("device_id"):
+                self._identify(p, str(frame["device_id"]))
+            if "ack" in frame:
+                self._resolve(p.path, frame)
+            for cb in self._subscribers:
+                try: cb(p.path, p.alias, frame)
+                except Exception as e: print(f"[{p.alias}] Subscriber error: {e}")
+
+
+def ack_ok(ack: Optional[Dict[str, Any]]) -> bool:
+    """True when the board answered and did not report an error."""
+    return ack is not None and "error" not in ack
@@ -1,27 +1,106 @@
 #server14.py
 
 import os
+import json
+import time
 import uuid
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from flask import Flask, request, jsonify, send_from_directory, send_file, render_template, g, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+import metrics
+from static_assets import AssetStore, IMMUTABLE, gzip_bytes
+from image_store import ImageStore
+import report_schema
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)   # static/ is served fingerprinted from memory (/assets)
 CORS(app)
 
-IMAGE_FOLDER = 'images'
+IMAGE_FOLDER = 'images'     # defaults for init_storage(), relative to the cwd at that point
+BUNDLE_FOLDER = 'bundles'   # sensor bundles (.npz), kept out of the image store
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+MAX_BUNDLE_BYTES = 8 * 1024 * 1024
+PLOT_MAX_POINTS = 1500   # per series in /api/bundle/<id>; the raw .npz keeps every sample
+IMAGE_MAX_AGE = 86400    # browser cache for /image/...; a re-upload for the same id is rare
 
 ACCIDENT_LOG = []
-
-os.makedirs(IMAGE_FOLDER, exist_ok=True)
+ACCIDENT_INDEX = {}      # id -> the same dict held in ACCIDENT_LOG
+_log_version = 0         # bumped on every change to ACCIDENT_LOG or one of its entries
+_LOG_NONCE = uuid.uuid4().hex[:8]   # part of the /accidents ETag: versions restart at 0 with every process
+_log_cache = None        # (version, etag, body, gzip body) for /accidents
+PAGE_CACHE = {}          # cache key -> (etag, body, gzip body) of rendered pages
+PAGE_CACHE_MAX = 256
+REPORT_KEYS = OrderedDict()   # Idempotency-Key of an accident_trigger -> accident id (newest last)
+REPORT_KEYS_MAX = 4096
+_report_keys_lock = threading.Lock()
+
+ASSETS = AssetStore()
+app.jinja_env.globals['asset_url'] = ASSETS.url
+
+IMAGES = None                       # ImageStore, set up by init_storage()
+_storage_lock = threading.RLock()
 
 app.config['IMAGE_FOLDER'] = IMAGE_FOLDER
+app.config['BUNDLE_FOLDER'] = BUNDLE_FOLDER
+
+
+def init_storage(image_dir=None, bundle_dir=None):
+    """Opens the image store and bundle folder (default: app.config, i.e. images/ and bundles/
+    under the cwd). Importing server14 touches no files; the first request that needs storage
+    calls this with the defaults if nobody did."""
+    global IMAGES
+    with _storage_lock:
+        # absolute: send_file resolves relative paths against the app root, not the cwd
+        image_dir = os.path.abspath(image_dir or app.config['IMAGE_FOLDER'])
+        bundle_dir = os.path.abspath(bundle_dir or app.config['BUNDLE_FOLDER'])
+        os.makedirs(image_dir, exist_ok=True)
+        os.makedirs(bundle_dir, exist_ok=True)
+        store = ImageStore(image_dir)   # tiered, sharded, sqlite-indexed (image_store.py)
+        store.reindex()                 # adopt files left in the old flat images/ layout
+        for name in os.listdir(image_dir):   # bundles used to be saved next to the images
+            if name.endswith('.npz') and os.path.isfile(os.path.join(image_dir, name)):
+                os.replace(os.path.join(image_dir, name), os.path.join(bundle_dir, name))
+        app.config['IMAGE_FOLDER'], app.config['BUNDLE_FOLDER'] = image_dir, bundle_dir
+        IMAGES = store
+    return store
+
+
+def images():
+    if IMAGES is None:
+        with _storage_lock:   # concurrent first requests open the store once
+            if IMAGES is None:
+                init_storage()
+    return IMAGES
+
+
+def bundle_folder():
+    images()
+    return app.config['BUNDLE_FOLDER']
+
+_M_ACCIDENTS = metrics.gauge("accidents_in_memory", "Entries held in ACCIDENT_LOG")
+
+
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    if metrics.ENABLED:
+        endpoint = request.endpoint or "unknown"
+        metrics.counter("http_requests_total", "Requests served", endpoint=endpoint,
+                        status=response.status_code).inc()
+        metrics.histogram("http_request_ms", "Request handling time", endpoint=endpoint).observe(
+            (time.perf_counter() - g.t0) * 1000.0)
+        _M_ACCIDENTS.set(len(ACCIDENT_LOG))
+    return response
 
 
 def generate_priority_string(seat_data):
@@ -33,51 +112,172 @@ def generate_priority_string(seat_data):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def find_accident(accident_id):
+    return ACCIDENT_INDEX.get(accident_id)
+
+
+def accident_changed(accident_id):
+    """Call after changing ACCIDENT_LOG or an entry: drops the cached listing and player page."""
+    global _log_version
+    _log_version += 1
+    PAGE_CACHE.pop(('player', accident_id), None)
+
+
+def _cached_response(body, gz, mimetype, etag, cache_control):
+    """304 when the client already has etag; otherwise the gzip body if accepted."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif gz is not None and 'gzip' in request.accept_encodings:
+        response = Response(gz, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _render_cached(key, template, **context):
+    entry = PAGE_CACHE.get(key)
+    if entry is None:
+        version = _log_version
+        body = render_template(template, **context).encode('utf-8')
+        entry = (uuid.uuid4().hex[:16], body, gzip_bytes(body))
+        if version == _log_version:   # skip caching if the accident changed while rendering
+            if len(PAGE_CACHE) >= PAGE_CACHE_MAX:
+                PAGE_CACHE.pop(next(iter(PAGE_CACHE), None), None)
+            PAGE_CACHE[key] = entry
+    etag, body, gz = entry
+    return _cached_response(body, gz, 'text/html; charset=utf-8', etag, 'no-cache')
+
+
+@app.route('/assets/<filename>')
+def serve_asset(filename):
+    asset = ASSETS.get(filename)
+    if asset is None:
+        return jsonify({'error': 'Not found.'}), 404
+    return _cached_response(asset.body, asset.gz, asset.mimetype, asset.etag, IMMUTABLE)
+
+
 @app.route('/')
 def index():
-    return render_template('index14.html')
+    return _render_cached(('index',), 'index14.html')
+
+def read_report():
+    """(seat details, meta) of a report body in any format report_schema.py accepts: v1 or v2
+    schema; JSON, MessagePack or CBOR; optionally gzip'd. Raises report_schema.ReportError."""
+    raw = request.get_data(cache=False)
+    return report_schema.parse(report_schema.decode_body(raw, request.mimetype, request.content_encoding))
+
+
+def report_error(e):
+    resp = jsonify({'error': str(e)})
+    if e.status == 415:   # tells the sender what to fall back to
+        resp.headers['Accept-Post'] = ', '.join(report_schema.content_types())
+        resp.headers['Accept-Encoding'] = 'gzip'
+    return resp, e.status
+
+
+@app.route('/api/report_formats')
+def report_formats():
+    return jsonify(report_schema.server_formats())
+
+
+def apply_report(log_entry, seat_data, meta):
+    """Replaces the seat details of an existing accident (final report or secondary impact)."""
+    log_entry['seat_details'] = seat_data
+    log_entry['priority_score'] = generate_priority_string(seat_data)
+    log_entry['preliminary'] = meta['preliminary']
+    log_entry['impact_count'] = meta['impact_count'] or log_entry.get('impact_count', 1)   # secondary impacts
+    accident_changed(log_entry['id'])
+
+
+def _report_response(status, log_entry, meta):
+    if meta['version'] >= 2:   # compact senders only need the id back
+        return jsonify({'status': status, 'id': log_entry['id']})
+    return jsonify({'status': status, 'id': log_entry['id'], 'log_entry': log_entry})
+
+
+def new_accident(seat_data, meta):
+    accident_id = str(uuid.uuid4())
+    now = datetime.now()
+    priority_str = generate_priority_string(seat_data)
+
+    log_entry = {
+        'id': accident_id,
+        'year': now.strftime('%Y'),
+        'month': now.strftime('%m'),
+        'day': now.strftime('%d'),
+        'hour': now.strftime('%H'),
+        'minute': now.strftime('%M'),
+        'second': now.strftime('%S'),
+        'priority_score': priority_str,
+        'seat_details': seat_data,
+        'image_url': None,
+        'player_url': f'/player/{accident_id}',
+        'preliminary': meta['preliminary'],   # motion verdicts follow via accident_update
+        'impact_count': 1
+    }
+
+    ACCIDENT_LOG.insert(0, log_entry)
+    ACCIDENT_INDEX[accident_id] = log_entry
+    accident_changed(accident_id)
+    logger.info(f"Accident Logged: ID={accident_id}, Max Score={priority_str}")
+    return log_entry
+
 
 @app.route('/api/accident_trigger', methods=['POST'])
 def accident_trigger():
     try:
-        data = request.get_json()
-        seat_data = {key: data[key] for key in data if key.startswith('seat')}
-
-        if not seat_data:
-            return jsonify({'error': 'Missing required seat data'}), 400
-
-        accident_id = str(uuid.uuid4())
-
-        now = datetime.now()
-        priority_str = generate_priority_string(seat_data)
-
-        log_entry = {
-            'id': accident_id,
-            'year': now.strftime('%Y'),
-            'month': now.strftime('%m'),
-            'day': now.strftime('%d'),
-            'hour': now.strftime('%H'),
-            'minute': now.strftime('%M'),
-            'second': now.strftime('%S'),
-            'priority_score': priority_str,
-            'seat_details': seat_data,
-            'image_url': None,
-            'player_url': f'/player/{accident_id}'
-        }
-
-        ACCIDENT_LOG.insert(0, log_entry)
-        logger.info(f"Accident Logged: ID={accident_id}, Max Score={priority_str}")
-
-        return jsonify({'status': 'Accident logged', 'id': accident_id, 'log_entry': log_entry})
+        seat_data, meta = read_report()
+        # The Pi sends its final report as a new trigger with the same Idempotency-Key when
+        # the preliminary one never answered; if that one did land, both are one accident.
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return _report_response('Accident logged', new_accident(seat_data, meta), meta)
+        with _report_keys_lock:
+            existing = find_accident(REPORT_KEYS.get(key))
+            if existing is None:
+                log_entry = new_accident(seat_data, meta)
+                REPORT_KEYS[key] = log_entry['id']
+                while len(REPORT_KEYS) > REPORT_KEYS_MAX:
+                    REPORT_KEYS.popitem(last=False)
+                return _report_response('Accident logged', log_entry, meta)
+            # A preliminary report arriving after the final one must not undo it.
+            if not (meta['preliminary'] and not existing.get('preliminary')):
+                apply_report(existing, seat_data, meta)
+        logger.info(f"Accident Trigger repeated: ID={existing['id']} (same Idempotency-Key)")
+        return _report_response('Accident updated', existing, meta)
+    except report_schema.ReportError as e:
+        return report_error(e)
     except Exception as e:
         logger.error(f"Error processing accident trigger: {e}")
         return jsonify({'error': f'Invalid request or server error: {e}'}), 500
 
 
+@app.route('/api/accident_update/<accident_id>', methods=['POST'])
+def accident_update(accident_id):
+    # Final report for an accident first logged as preliminary: replaces the seat details.
+    log_entry = find_accident(accident_id)
+    if not log_entry:
+        return jsonify({'error': 'Accident ID not found.'}), 404
+
+    try:
+        seat_data, meta = read_report()
+    except report_schema.ReportError as e:
+        return report_error(e)
+
+    apply_report(log_entry, seat_data, meta)
+    logger.info(f"Accident Updated: ID={accident_id}, Max Score={log_entry['priority_score']}")
+    return _report_response('Accident updated', log_entry, meta)
+
+
 @app.route('/api/upload_image/<accident_id>', methods=['POST'])
 def upload_image(accident_id):
 
-    log_entry = next((log for log in ACCIDENT_LOG if log['id'] == accident_id), None)
+    log_entry = find_accident(accident_id)
     if not log_entry:
         return jsonify({'error': 'Accident ID not found.'}), 404
 
@@ -90,13 +290,13 @@ def upload_image(accident_id):
         return jsonify({'error': 'No selected file.'}), 400
 
     if file and allowed_file(file.filename):
-        filename = f"{accident_id}.jpg"
-        save_path = os.path.join(app.config['IMAGE_FOLDER'], filename)
+        filename = f"{secure_filename(accident_id)}.jpg"
 
         try:
-            file.save(save_path)
+            save_path = images().put(filename, file)
 
             log_entry['image_url'] = f'/image/{filename}'
+            accident_changed(accident_id)
             logger.info(f"Image uploaded for ID {accident_id} to {save_path}")
 
             return jsonify({'status': 'Image uploaded successfully', 'image_url': log_entry['image_url']}), 200
@@ -107,25 +307,136 @@ def upload_image(accident_id):
 
     return jsonify({'error': 'File type not allowed.'}), 400
 
+@app.route('/api/upload_bundle/<accident_id>', methods=['POST'])
+def upload_bundle(accident_id):
+    log_entry = find_accident(accident_id)
+    if not log_entry:
+        return jsonify({'error': 'Accident ID not found.'}), 404
+
+    file = request.files.get('file')
+    if file is None:
+        return jsonify({'error': 'No file part in the request.'}), 400
+
+    data = file.read(MAX_BUNDLE_BYTES + 1)
+    if len(data) > MAX_BUNDLE_BYTES:
+        return jsonify({'error': 'Bundle too large.'}), 413
+    if not data.startswith(b'PK'):
+        return jsonify({'error': 'Bundle must be an .npz file.'}), 400
+
+    filename = f"{secure_filename(accident_id)}.npz"
+    save_path = os.path.join(bundle_folder(), filename)
+    try:
+        with open(save_path, 'wb') as f:
+            f.write(data)
+    except OSError as e:
+        logger.error(f"Error saving bundle: {e}")
+        return jsonify({'error': f'Failed to save bundle: {e}'}), 500
+
+    log_entry['bundle_url'] = f'/bundle/{filename}'
+    accident_changed(accident_id)
+    logger.info(f"Bundle uploaded for ID {accident_id} ({len(data)} bytes)")
+    return jsonify({'status': 'Bundle uploaded successfully', 'bundle_url': log_entry['bundle_url']}), 200
+
+
+def _decimate(t, *ys):
+    step = max(1, -(-len(t) // PLOT_MAX_POINTS))
+    return [v[::step].round(4).tolist() for v in (t,) + ys]
+
+
+def bundle_plot_data(path):
+    """Plot-ready JSON for player14.html: times relative to the trigger, decimated per seat."""
+    import numpy as np
+    with np.load(path, allow_pickle=False) as z:
+        b = {k: z[k] for k in z.files}
+    meta = json.loads(b['meta'].tobytes().decode('utf-8'))
+    t0 = meta.get('t_trigger') or (float(b['sensor_t'][0]) if b['sensor_t'].size else 0.0)
+
+    sensors = {}
+    for i, seat in enumerate(meta['seats']):
+        sel = b['sensor_seat'] == i
+        if not sel.any():
+            continue
+        t, w, gv = _decimate(b['sensor_t'][sel] - t0, b['sensor_weight'][sel], b['sensor_mpu_g'][sel])
+        sensors[seat] = {'t': t, 'weight': w, 'mpu_g': gv}
+
+    motion = {}
+    if b['motion_t'].size:
+        cols = _decimate(b['motion_t'] - t0, *b['motion_ratio'].T)
+        motion = {'t': cols[0], **{seat: cols[i + 1] for i, seat in enumerate(meta['seats'])}}
+
+    ages = [{'t': round(float(t - t0), 3), 'seat': meta['seats'][s] if s < len(meta['seats']) else None, 'age': int(a)}
+            for t, s, a in zip(b['age_t'], b['age_seat'], b['age_years'])]
+
+    return {'sensors': sensors, 'motion': motion, 'ages': ages,
+            'trigger': meta.get('trigger'), 'pulse_features': meta.get('pulse_features'),
+            'calibration': meta.get('calibration'), 'boards': meta.get('boards')}
+
+
+@app.route('/api/bundle/<accident_id>')
+def bundle_data(accident_id):
+    path = os.path.join(bundle_folder(), f"{secure_filename(accident_id)}.npz")
+    if not os.path.exists(path):
+        return jsonify({'error': 'No bundle for this accident.'}), 404
+    try:
+        return jsonify(bundle_plot_data(path))
+    except Exception as e:
+        logger.error(f"Error reading bundle {path}: {e}")
+        return jsonify({'error': f'Failed to read bundle: {e}'}), 500
+
+
 @app.route('/image/<filename>')
 def serve_image(filename):
-    return send_from_directory(app.config['IMAGE_FOLDER'], filename)
+    found = images().open(filename)
+    if found is None:
+        return jsonify({'error': 'Image not found.'}), 404
+    kind, src = found
+    if kind == 'bytes':   # cold tier, read out of the month's archive
+        response = Response(src, mimetype='image/jpeg')
+        response.set_etag(f'{filename}-{len(src)}')
+        response.make_conditional(request)
+    else:
+        response = send_file(src, mimetype='image/jpeg', conditional=True)
+    response.cache_control.no_cache = None
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    return response
+
+@app.route('/bundle/<filename>')
+def serve_bundle(filename):
+    return send_from_directory(bundle_folder(), secure_filename(filename), as_attachment=True)
 
 @app.route('/accidents')
 def accident_list():
-    return jsonify(ACCIDENT_LOG)
+    # Polled every 5 s by every open dashboard: serialised once per change, 304 when unchanged.
+    global _log_cache
+    if _log_cache is None or _log_cache[0] != _log_version:
+        body = json.dumps(ACCIDENT_LOG).encode('utf-8')
+        _log_cache = (_log_version, f'log-{_LOG_NONCE}-{_log_version}', body, gzip_bytes(body))
+    _, etag, body, gz = _log_cache
+    return _cached_response(body, gz, 'application/json', etag, 'no-cache')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/player/<accident_id>')
 def player(accident_id):
-    log_entry = next((log for log in ACCIDENT_LOG if log['id'] == accident_id), {})
+    log_entry = find_accident(accident_id)
+    if log_entry is None:   # not cached: unknown ids must not fill PAGE_CACHE
+        return render_template('player14.html', accident_id=accident_id, priority_score='N/A',
+                               seat_details={}, image_url=None, bundle_url=None, impact_count=1)
 
-    return render_template(
+    return _render_cached(
+        ('player', accident_id),
         'player14.html',
         accident_id=accident_id,
         priority_score=log_entry.get('priority_score', 'N/A'),
         seat_details=log_entry.get('seat_details', {}),
-        image_url=log_entry.get('image_url')
+        image_url=log_entry.get('image_url'),
+        bundle_url=log_entry.get('bundle_url'),
+        preliminary=log_entry.get('preliminary', False),
+        impact_count=log_entry.get('impact_count', 1)
     )
 
 if __name__ == '__main__':
+    init_storage().start_maintenance()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,64 @@
+// dashboard.js
+// Accident log table for index14.html (replaces the Alpine.js CDN build).
+// Polls /accidents every POLL_MS; the server answers with an ETag, so unchanged polls are 304s
+// and the table is only rebuilt when the log actually changed.
+(function () {
+    const POLL_MS = 5000;
+    const COLUMNS = ['year', 'month', 'day', 'hour', 'minute', 'second'];
+
+    const errorBox = document.getElementById('log-error');
+    const emptyBox = document.getElementById('log-empty');
+    const tableBox = document.getElementById('log-table');
+    const tbody = document.getElementById('log-rows');
+    let lastBody = null;
+
+    function cell(text, cls) {
+        const td = document.createElement('td');
+        td.className = cls;
+        td.textContent = text == null ? '' : text;
+        return td;
+    }
+
+    function render(log) {
+        const rows = document.createDocumentFragment();
+        for (const entry of log) {
+            const tr = document.createElement('tr');
+            for (const key of COLUMNS) {
+                tr.appendChild(cell(entry[key], 'px-3 py-4 whitespace-nowrap text-sm text-gray-500'));
+            }
+            const score = entry.preliminary ? entry.priority_score + ' (preliminary)' : entry.priority_score;
+            tr.appendChild(cell(score, 'px-6 py-4 text-sm text-red-600 font-semibold'));
+            const action = cell('', 'px-6 py-4 whitespace-nowrap text-sm font-medium');
+            const a = document.createElement('a');
+            a.href = entry.player_url;
+            a.target = '_blank';
+            a.className = 'text-ewha-green-text hover:underline hover:text-ewha-green-hover font-medium';
+            a.textContent = 'More Information';
+            action.appendChild(a);
+            tr.appendChild(action);
+            rows.appendChild(tr);
+        }
+        tbody.replaceChildren(rows);
+        emptyBox.hidden = log.length > 0;
+        tableBox.hidden = log.length === 0;
+    }
+
+    function fetchLog() {
+        fetch('/accidents', {cache: 'no-cache'})
+            .then(response => response.ok ? response.text() : Promise.reject(response.status))
+            .then(body => {
+                errorBox.hidden = true;
+                if (body === lastBody) return;
+                lastBody = body;
+                render(JSON.parse(body));
+            })
+            .catch(err => {
+                errorBox.textContent = 'Failed to load accident log or network error.';
+                errorBox.hidden = false;
+                console.error('Fetch error:', err);
+            });
+    }
+
+    fetchLog();
+    setInterval(fetchLog, POLL_MS);
+})();
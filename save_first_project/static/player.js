@@ -0,0 +1,84 @@
+// player.js
+// Sensor bundle charts for player14.html.
+// The bundle is fetched only when its section scrolls into view, so the page itself stays light.
+(function () {
+    const SEAT_COLORS = {S1: '#00462A', S2: '#2563eb', S3: '#d97706', S4: '#dc2626'};
+    const section = document.getElementById('bundle-section');
+
+    function drawChart(canvas, seriesBySeat) {
+        const dpr = window.devicePixelRatio || 1;
+        const w = canvas.clientWidth, h = canvas.clientHeight;
+        canvas.width = w * dpr; canvas.height = h * dpr;
+        const ctx = canvas.getContext('2d');
+        ctx.scale(dpr, dpr);
+        let tMin = Infinity, tMax = -Infinity, yMin = Infinity, yMax = -Infinity;
+        for (const s of Object.values(seriesBySeat)) {
+            for (let i = 0; i < s.t.length; i++) {
+                tMin = Math.min(tMin, s.t[i]); tMax = Math.max(tMax, s.t[i]);
+                yMin = Math.min(yMin, s.y[i]); yMax = Math.max(yMax, s.y[i]);
+            }
+        }
+        if (!isFinite(tMin)) { ctx.fillStyle = '#9ca3af'; ctx.fillText('No data', 8, 16); return; }
+        if (yMax === yMin) { yMax += 1; yMin -= 1; }
+        if (tMax === tMin) { tMax += 1; }
+        const pad = 28;
+        const x = t => pad + (t - tMin) / (tMax - tMin) * (w - pad - 6);
+        const y = v => h - 16 - (v - yMin) / (yMax - yMin) * (h - 24);
+
+        ctx.font = '10px sans-serif'; ctx.fillStyle = '#6b7280'; ctx.strokeStyle = '#e5e7eb';
+        ctx.strokeRect(pad, 8, w - pad - 6, h - 24);
+        ctx.fillText(yMax.toFixed(1), 2, 14); ctx.fillText(yMin.toFixed(1), 2, h - 16);
+        ctx.fillText(tMin.toFixed(1) + 's', pad, h - 3);
+        ctx.fillText(tMax.toFixed(1) + 's', w - 36, h - 3);
+        if (tMin <= 0 && tMax >= 0) {   // trigger
+            ctx.strokeStyle = '#b91c1c'; ctx.setLineDash([4, 3]);
+            ctx.beginPath(); ctx.moveTo(x(0), 8); ctx.lineTo(x(0), h - 16); ctx.stroke();
+            ctx.setLineDash([]);
+        }
+        for (const [seat, s] of Object.entries(seriesBySeat)) {
+            ctx.strokeStyle = SEAT_COLORS[seat] || '#111827'; ctx.lineWidth = 1.2;
+            ctx.beginPath();
+            s.t.forEach((t, i) => i ? ctx.lineTo(x(t), y(s.y[i])) : ctx.moveTo(x(t), y(s.y[i])));
+            ctx.stroke();
+        }
+    }
+
+    function render(data) {
+        const pick = key => Object.fromEntries(Object.entries(data.sensors).map(([seat, s]) => [seat, {t: s.t, y: s[key]}]));
+        drawChart(document.getElementById('chart-g'), pick('mpu_g'));
+        drawChart(document.getElementById('chart-weight'), pick('weight'));
+        const motion = {};
+        if (data.motion.t) {
+            for (const seat of Object.keys(SEAT_COLORS)) {
+                if (data.motion[seat]) motion[seat] = {t: data.motion.t, y: data.motion[seat]};
+            }
+        }
+        drawChart(document.getElementById('chart-motion'), motion);
+
+        document.getElementById('bundle-legend').innerHTML = Object.entries(SEAT_COLORS)
+            .map(([seat, c]) => `<span class="mr-3"><span class="legend-swatch" style="background:${c}"></span>${seat}</span>`)
+            .join('') + '<span class="ml-2 text-red-700">- - trigger (t = 0)</span>';
+
+        const details = {trigger: data.trigger && {reason: data.trigger.reason, seats: data.trigger.seats},
+                         pulse_features: data.pulse_features, age_samples: data.ages.length,
+                         calibration: data.calibration};
+        document.getElementById('bundle-details').textContent = JSON.stringify(details, null, 1);
+        document.getElementById('bundle-status').textContent = '';
+    }
+
+    function load() {
+        fetch(section.dataset.src)
+            .then(r => r.ok ? r.json() : Promise.reject(r.status))
+            .then(render)
+            .catch(err => { document.getElementById('bundle-status').textContent = 'Failed to load sensor data (' + err + ').'; });
+    }
+
+    if ('IntersectionObserver' in window) {
+        const io = new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) { io.disconnect(); load(); }
+        });
+        io.observe(section);
+    } else {
+        load();
+    }
+})();
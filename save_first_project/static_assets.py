@@ -0,0 +1,74 @@
+# static_assets.py
+# Fingerprinted, pre-compressed static files for server14's dashboard.
+# Every file in static/ is read once at startup and served from memory as
+# /assets/<stem>.<sha256[:10]><ext> with a one-year immutable Cache-Control: any edit changes
+# the URL, so browsers never need to revalidate. gzip bodies are built once, not per request.
+#
+#   python static_assets.py            # print the manifest (logical name -> URL, sizes)
+
+import os, gzip, hashlib, mimetypes
+from typing import Dict, Optional
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+URL_PREFIX = "/assets/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+GZIP_MIN_BYTES = 512
+GZIP_LEVEL = 9
+
+
+class Asset:
+    __slots__ = ("name", "filename", "mimetype", "body", "gz", "etag")
+
+    def __init__(self, name: str, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()[:10]
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.filename = f"{stem}.{digest}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.body = body
+        self.gz = gzip_bytes(body)
+        self.etag = digest
+
+
+def gzip_bytes(body: bytes) -> Optional[bytes]:
+    """gzip body once (mtime=0 keeps the output stable). None when it would not help."""
+    if len(body) < GZIP_MIN_BYTES:
+        return None
+    gz = gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return gz if len(gz) < len(body) else None
+
+
+class AssetStore:
+    def __init__(self, root: str = STATIC_DIR):
+        self.root = root
+        self.by_name: Dict[str, Asset] = {}
+        self.by_filename: Dict[str, Asset] = {}
+        self.reload()
+
+    def reload(self):
+        by_name = {}
+        if os.path.isdir(self.root):
+            for name in sorted(os.listdir(self.root)):
+                path = os.path.join(self.root, name)
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        by_name[name] = Asset(name, f.read())
+        self.by_name = by_name
+        self.by_filename = {a.filename: a for a in by_name.values()}
+
+    def url(self, name: str) -> str:
+        """URL for a logical file name (templates: {{ asset_url('dashboard.css') }})."""
+        asset = self.by_name.get(name)
+        if asset is None:
+            raise KeyError(f"static asset not found: {name}")
+        return URL_PREFIX + asset.filename
+
+    def get(self, filename: str) -> Optional[Asset]:
+        return self.by_filename.get(filename)
+
+
+if __name__ == "__main__":
+    store = AssetStore()
+    for a in store.by_name.values():
+        gz = f"{len(a.gz)} B gzip" if a.gz else "not compressed"
+        print(f"{a.name:<16} {URL_PREFIX + a.filename:<36} {len(a.body):>7} B  {gz}")
@@ -0,0 +1,191 @@
+# vision_pool.py
+# Runs age / motion analysis on several cameras at once, one worker process per camera.
+# Each worker writes its per-seat codes into a shared-memory array; the parent merges
+# them into one per-seat result set.
+
+import time
+import multiprocessing as mp
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+SEATS = ("S1", "S2", "S3", "S4")
+
+# One entry per camera. Every camera is still split into four quadrants, and
+# "seats" names them in the same (S1, S2, S3, S4) order age_result()/motion_result() return.
+# A second camera can look at the same seats from another angle (e.g. {"index": 2, "seats":
+# ("S2", "S1", "S4", "S3")} mounted facing backwards); its results are merged per seat.
+# Seats must come from SEATS: the sensors, reports and server only know S1..S4.
+CAMERAS: List[Dict[str, Any]] = [
+    {"index": 0, "seats": ("S1", "S2", "S3", "S4")},
+]
+
+AGE_EMPTY = 2          # age.py: 0 = adult, 1 = child, 2 = empty
+UC_UNCONSCIOUS = 1     # motion.py: 0 = conscious, 1 = unconscious
+WORKER_TIMEOUT_S = 60.0
+POLL_S = 0.05          # how often the parent checks worker results while streaming
+PENDING = -1           # shared slot not decided yet
+
+# 'spawn' so every worker loads its own camera/model state instead of forking torch/cv2 handles.
+_CTX = mp.get_context("spawn")
+
+
+def _age_worker(cam_index, offset, shared, stop_event):
+    import age
+    codes = age.age_result(stop_event=stop_event, cam_index=cam_index)
+    for i, code in enumerate(codes):
+        shared[offset + i] = int(code)
+
+
+def _motion_worker(cam_index, offset, shared, masks):
+    # Each verdict is published the moment it is decided, so the parent can stream it on.
+    import motion
+    for seat, code in motion.iter_motion(masks[offset // 4], cam_index=cam_index):
+        shared[offset + motion.SEATS.index(seat)] = int(code)
+
+
+def check_cameras(cameras: Sequence[Dict[str, Any]]):
+    """Raises ValueError for a camera that does not name four seats out of SEATS."""
+    for cam in cameras:
+        seats = tuple(cam.get("seats", ()))
+        if len(seats) != 4:
+            raise ValueError(f"vision_pool: camera {cam.get('index')} must name 4 quadrant seats, got {seats}")
+        unknown = [seat for seat in seats if seat not in SEATS]
+        if unknown:
+            raise ValueError(f"vision_pool: camera {cam.get('index')} seats {unknown} are not in {SEATS}")
+
+
+check_cameras(CAMERAS)
+
+
+def _merge_age(a: int, b: int) -> int:
+    # Same seat seen by two cameras: any detection beats "empty", and child beats adult.
+    if a == AGE_EMPTY: return b
+    if b == AGE_EMPTY: return a
+    return 1 if 1 in (a, b) else 0
+
+
+def _merge_uc(a: int, b: int) -> int:
+    # Movement seen by any camera means the occupant is conscious.
+    return min(a, b)
+
+
+def _merge(cameras, values, merge_fn) -> Dict[str, int]:
+    results: Dict[str, int] = {}
+    for cam_no, cam in enumerate(cameras):
+        for i, seat in enumerate(cam["seats"]):
+            code = int(values[cam_no * 4 + i])
+            results[seat] = merge_fn(results[seat], code) if seat in results else code
+    return results
+
+
+def _run_pool(target, cameras, default: int, extra_args=(), timeout_s=WORKER_TIMEOUT_S,
+              on_poll=None) -> List[int]:
+    """on_poll(shared), if given, is called every POLL_S while the workers run and once at the end."""
+    shared = _CTX.Array("i", [default] * (4 * len(cameras)), lock=False)
+    procs = []
+    for cam_no, cam in enumerate(cameras):
+        p = _CTX.Process(target=target, args=(cam["index"], cam_no * 4, shared) + tuple(extra_args),
+                         name=f"vision-cam{cam['index']}", daemon=True)
+        p.start()
+        procs.append(p)
+
+    deadline = time.monotonic() + timeout_s
+    if on_poll is not None:
+        while any(p.is_alive() for p in procs) and time.monotonic() < deadline:
+            on_poll(shared)
+            time.sleep(POLL_S)
+    for p in procs:
+        p.join(max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            print(f"[vision_pool WARN] {p.name} did not finish in {timeout_s}s. Terminating.")
+            p.terminate()
+            p.join(1.0)
+        elif p.exitcode != 0:
+            print(f"[vision_pool WARN] {p.name} exited with code {p.exitcode}. Using defaults for its seats.")
+    if on_poll is not None:
+        on_poll(shared)
+    return list(shared)
+
+
+def age_results(cameras: Optional[Sequence[Dict[str, Any]]] = None, stop_event=None) -> Dict[str, int]:
+    """Runs age_result on every camera in parallel and merges them into {seat: age_code}."""
+    cameras = list(cameras or CAMERAS)
+    check_cameras(cameras)
+    if len(cameras) == 1:
+        import age
+        return _merge(cameras, age.age_result(stop_event=stop_event, cam_index=cameras[0]["index"]), _merge_age)
+
+    mp_stop = _CTX.Event()
+    if stop_event is not None and stop_event.is_set():
+        mp_stop.set()
+    # A stop requested while the workers run (main.py stops the age check on a trigger).
+    forward = None if stop_event is None else (lambda _: stop_event.is_set() and mp_stop.set())
+    values = _run_pool(_age_worker, cameras, AGE_EMPTY, extra_args=(mp_stop,), on_poll=forward)
+    return _merge(cameras, values, _merge_age)
+
+
+def _camera_mask(cam, occupied) -> Optional[Tuple[bool, ...]]:
+    """occupied {seat: bool} (global seat names) -> this camera's (q1..q4) mask for motion.py."""
+    if occupied is None: return None
+    return tuple(bool(occupied.get(seat, True)) for seat in cam["seats"])
+
+
+def motion_results(cameras: Optional[Sequence[Dict[str, Any]]] = None,
+                   occupied: Optional[Dict[str, Any]] = None, on_result=None) -> Dict[str, int]:
+    """Runs motion_result on every camera in parallel and merges them into {seat: uc_code}.
+    occupied {seat: bool} skips empty seats; on_result(seat, uc) streams each merged verdict as
+    soon as it is final (conscious on any camera, unconscious once every camera covering it is done)."""
+    cameras = list(cameras or CAMERAS)
+    check_cameras(cameras)
+    if len(cameras) == 1:
+        import motion
+        cam = cameras[0]
+        stream = None
+        if on_result is not None:
+            stream = lambda q_seat, uc: on_result(cam["seats"][motion.SEATS.index(q_seat)], uc)
+        codes = motion.motion_result(cam_index=cam["index"], occupied=_camera_mask(cam, occupied), on_result=stream)
+        return _merge(cameras, codes, _merge_uc)
+
+    reported = set()
+    def poll(shared):
+        seen: Dict[str, List[int]] = {}
+        for cam_no, cam in enumerate(cameras):
+            for i, seat in enumerate(cam["seats"]):
+                seen.setdefault(seat, []).append(shared[cam_no * 4 + i])
+        for seat, codes in seen.items():
+            if seat in reported: continue
+            if 0 in codes:
+                reported.add(seat)
+                on_result(seat, 0)
+            elif PENDING not in codes:
+                reported.add(seat)
+                on_result(seat, UC_UNCONSCIOUS)
+
+    masks = [_camera_mask(cam, occupied) for cam in cameras]
+    values = _run_pool(_motion_worker, cameras, PENDING, extra_args=(masks,),
+                       on_poll=poll if on_result is not None else None)
+    values = [UC_UNCONSCIOUS if v == PENDING else v for v in values]
+    return _merge(cameras, values, _merge_uc)
+
+
+def as_tuple(results: Dict[str, int], default: int, seats: Sequence[str] = SEATS) -> Tuple[int, ...]:
+    return tuple(results.get(seat, default) for seat in seats)
+
+
+def age_result(stop_event=None) -> Tuple[int, ...]:
+    """Drop-in for age.age_result(): merged ages as (S1_age, S2_age, S3_age, S4_age)."""
+    return as_tuple(age_results(stop_event=stop_event), AGE_EMPTY)
+
+
+def motion_result(occupied: Optional[Dict[str, Any]] = None, on_result=None) -> Tuple[int, ...]:
+    """Drop-in for motion.motion_result(): merged UC flags as (S1_UC, S2_UC, S3_UC, S4_UC)."""
+    return as_tuple(motion_results(occupied=occupied, on_result=on_result), UC_UNCONSCIOUS)
+
+
+if __name__ == "__main__":
+    print(f"Running vision_pool.py directly (Test Mode) with {len(CAMERAS)} camera(s)")
+    t0 = time.monotonic()
+    ages = age_results()
+    print(f"Merged ages: {ages} ({time.monotonic() - t0:.1f}s)")
+    t0 = time.monotonic()
+    ucs = motion_results()
+    print(f"Merged UC: {ucs} ({time.monotonic() - t0:.1f}s)")
@@ -0,0 +1,118 @@
+# warm_camera.py
+# Keeps the cabin camera open between uses when main.py runs as a supervisor.
+# install() wraps open_camera() in age / motion / capture: the first call opens the device as
+# before, later calls hand back the same capture object, and release() only returns it.
+# Each checkout after the first drops FLUSH_FRAMES buffered frames so nobody reads a stale
+# image taken minutes ago. A second user while the handle is checked out waits (up to
+# LEASE_WAIT_S) for it to come back rather than opening the device again, which V4L2 refuses
+# with EBUSY. vision_pool's worker processes (multi-camera setups) open their own cameras and
+# are not affected.
+
+import time
+import threading
+from typing import Callable, Dict
+
+FLUSH_FRAMES = 3
+PREWARM_S = 2.0          # frames read by prewarm() so auto-exposure settles before the first real use
+LEASE_WAIT_S = 10.0      # how long a second user waits for the shared handle (main.py stops the age check on a trigger)
+MODULES = ("age", "motion", "capture")
+
+_lock = threading.Lock()
+_returned = threading.Condition(_lock)   # notified whenever a lease is given back or dropped
+_open: Dict[int, "_Shared"] = {}
+
+
+class _Shared:
+    __slots__ = ("cap", "busy", "uses")
+
+    def __init__(self, cap):
+        self.cap, self.busy, self.uses = cap, False, 0
+
+
+class _Lease:
+    """What callers get instead of the raw capture. warm is True when the device was already
+    open (capture.py skips its exposure-settling sleep then)."""
+
+    def __init__(self, index: int, shared: _Shared, warm: bool):
+        self._index, self._shared, self.warm = index, shared, warm
+
+    def __getattr__(self, name):
+        return getattr(self._shared.cap, name)
+
+    def read(self):
+        ok, frame = self._shared.cap.read()
+        if not ok:   # unplugged or wedged: reopen on the next checkout
+            with _lock:
+                if _open.get(self._index) is self._shared:
+                    del _open[self._index]
+                _returned.notify_all()
+            self._shared.cap.release()
+        return ok, frame
+
+    def release(self):
+        with _lock:
+            self._shared.busy = False
+            _returned.notify_all()
+
+
+def _wrap(opener: Callable) -> Callable:
+    def open_camera(index=0):
+        with _lock:
+            deadline = time.monotonic() + LEASE_WAIT_S
+            shared = _open.get(index)
+            while shared is not None and shared.busy:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    print(f"[warm_camera WARN] camera {index} still checked out after {LEASE_WAIT_S}s; "
+                          f"opening it directly")
+                    return opener(index)
+                _returned.wait(left)
+                shared = _open.get(index)
+            warm = shared is not None and shared.cap.isOpened()
+            if not warm:
+                cap = opener(index)
+                if not cap.isOpened():
+                    return cap
+                shared = _open[index] = _Shared(cap)
+            shared.busy = True
+            shared.uses += 1
+        if warm:
+            grab = getattr(shared.cap, "grab", shared.cap.read)   # stand-ins may only have read()
+            for _ in range(FLUSH_FRAMES):
+                grab()
+        return _Lease(index, shared, warm)
+    open_camera.warm_wrapped = True
+    return open_camera
+
+
+def install(modules=MODULES):
+    """Routes each module's open_camera() through the shared handles (idempotent)."""
+    import importlib
+    for name in modules:
+        try: mod = importlib.import_module(name)
+        except ImportError as e:
+            print(f"[warm_camera] Skipping {name}: {e}")
+            continue
+        if not getattr(mod.open_camera, "warm_wrapped", False):
+            mod.open_camera = _wrap(mod.open_camera)
+
+
+def prewarm(index=0, module="age") -> bool:
+    """Opens camera index at boot (after install()) and reads for PREWARM_S, then hands it
+    back, so the first age check starts on a settled device instead of paying for the open
+    and the exposure warmup itself."""
+    import importlib, time
+    cap = importlib.import_module(module).open_camera(index)
+    ok = cap.isOpened()
+    deadline = time.monotonic() + PREWARM_S
+    while ok and time.monotonic() < deadline:
+        ok = cap.read()[0]
+    cap.release()
+    return ok
+
+
+def release_all():
+    with _lock:
+        for shared in _open.values():
+            shared.cap.release()
+        _open.clear()